@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""
+Benchmark LDAPAuthenticator against a synthetic in-memory directory
+
+Generates a directory with a configurable number of users and groups served
+by ldap3's MOCK_SYNC strategy, then drives `authenticate`,
+`get_nested_groups` and `add_user` with many concurrent clients. Reports
+throughput, p50/p95/p99 latency and ldap operations per login, and
+optionally stores the results as JSON so runs can be compared between
+releases. Runs fully offline.
+
+    python benchmarks/authenticator.py --users 2000 --clients 50 --output before.json
+    python benchmarks/authenticator.py --users 2000 --clients 50 --compare before.json
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ldap3
+from prometheus_client import REGISTRY
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldapauthenticator import LDAPAuthenticator  # noqa: E402
+from ldapauthenticator.metrics import record_operation  # noqa: E402
+
+BASE_DN = 'dc=example,dc=com'
+USER_BASE_DN = 'ou=users,' + BASE_DN
+GROUP_BASE_DN = 'ou=groups,' + BASE_DN
+SERVICE_DN = 'cn=svc,' + BASE_DN
+SERVICE_PASSWORD = 'svc-password'
+PASSWORD = 'password'
+ALLOWED_GROUP_DN = 'cn=allowed,' + GROUP_BASE_DN
+
+User = collections.namedtuple('User', ['name'])
+
+
+class SyntheticDirectory(object):
+    """
+    In-memory directory of users and groups served by ldap3's MOCK_SYNC strategy
+
+    `allowed_groups` is the root of a tree of nested groups `depth` levels
+    deep where every group has `fanout` member groups. `groups` additional
+    unrelated groups are created, and every user is a member of
+    `memberships` of them. A share `authorized` of the users is also member
+    of a random group of the nested tree.
+    """
+
+    def __init__(self, users=1000, groups=200, depth=3, fanout=3, memberships=10, authorized=0.8, seed=0):
+        self.server = ldap3.Server('mock-ldap')
+        self.usernames = ['user{:06d}'.format(i) for i in range(users)]
+        self.nested_groups = list()
+        rnd = random.Random(seed)
+        conn = ldap3.Connection(
+            self.server, user=SERVICE_DN, password=SERVICE_PASSWORD, client_strategy=ldap3.MOCK_SYNC)
+        add = conn.strategy.add_entry
+        add(SERVICE_DN, {'objectClass': 'person', 'cn': 'svc', 'userPassword': SERVICE_PASSWORD})
+
+        # nested tree below allowed group
+        add(ALLOWED_GROUP_DN, {'objectClass': 'group', 'cn': 'allowed'})
+        level = [ALLOWED_GROUP_DN]
+        for d in range(depth):
+            next_level = list()
+            for parent in level:
+                for f in range(fanout):
+                    cn = 'nested-{}-{}'.format(d, len(next_level))
+                    dn = 'cn={},{}'.format(cn, GROUP_BASE_DN)
+                    add(dn, {'objectClass': 'group', 'cn': cn, 'memberOf': [parent]})
+                    next_level.append(dn)
+            self.nested_groups.extend(next_level)
+            level = next_level
+
+        # unrelated groups
+        other_groups = list()
+        for i in range(groups):
+            dn = 'cn=group-{:06d},{}'.format(i, GROUP_BASE_DN)
+            add(dn, {'objectClass': 'group', 'cn': 'group-{:06d}'.format(i)})
+            other_groups.append(dn)
+
+        # users
+        permitted = [ALLOWED_GROUP_DN] + self.nested_groups
+        for username in self.usernames:
+            member_of = rnd.sample(other_groups, min(memberships, len(other_groups)))
+            if rnd.random() < authorized:
+                member_of.append(rnd.choice(permitted))
+            attributes = {'objectClass': 'person', 'uid': username, 'userPassword': PASSWORD}
+            if member_of:
+                attributes['memberOf'] = member_of
+            add('uid={},{}'.format(username, USER_BASE_DN), attributes)
+
+
+class BenchmarkLDAPAuthenticator(LDAPAuthenticator):
+    """
+    LDAPAuthenticator bound to a SyntheticDirectory instead of real servers.
+    Every ldap operation is delayed by `latency` seconds to emulate network
+    round trips, and home directories are created in memory.
+    """
+
+    directory = None
+    latency = 0.0
+    home_dir_latency = 0.0
+
+    def ldap_connection(self, server_pool, username, password):
+        start = time.monotonic()
+        self.delay()
+        conn = ldap3.Connection(
+            self.directory.server,
+            user=username,
+            password=password,
+            client_strategy=ldap3.MOCK_SYNC,
+            read_only=True,
+            auto_range=False)
+        search = conn.search
+
+        def delayed_search(*args, **kwargs):
+            self.delay()
+            return search(*args, **kwargs)
+
+        conn.search = delayed_search
+        bound = conn.bind()
+        record_operation(self.server_label(conn), 'bind', time.monotonic() - start)
+        return conn if bound else None
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    _home_dirs = None
+    _home_dirs_lock = threading.Lock()
+
+    def user_home_dir_exists(self, username):
+        with self._home_dirs_lock:
+            return username in (self._home_dirs or ())
+
+    def add_user_home_dir(self, username):
+        if self.home_dir_latency:
+            time.sleep(self.home_dir_latency)
+        with self._home_dirs_lock:
+            if self._home_dirs is None:
+                self._home_dirs = set()
+            self._home_dirs.add(username)
+
+
+def percentile(values, pct):
+    """
+    Return pct percentile of values using nearest rank
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(latencies, elapsed, **extra):
+    """
+    Compile throughput and latency percentiles in milliseconds
+    """
+    result = {
+        'count': len(latencies),
+        'seconds': round(elapsed, 4),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+    for pct in (50, 95, 99):
+        value = percentile(latencies, pct)
+        result['p{}_ms'.format(pct)] = None if value is None else round(value * 1000, 3)
+    result.update(extra)
+    return result
+
+
+def operations_per_login():
+    """
+    Return current sum and count of the operations per login histogram
+    """
+    total = REGISTRY.get_sample_value('ldapauthenticator_operations_per_login_sum') or 0.0
+    count = REGISTRY.get_sample_value('ldapauthenticator_operations_per_login_count') or 0.0
+    return total, count
+
+
+def make_authenticator(directory, args, **config):
+    """
+    Create benchmark authenticator for directory
+    """
+    authenticator = BenchmarkLDAPAuthenticator(
+        server_hosts=['ldap.example.com'],
+        bind_user_dn=SERVICE_DN,
+        bind_user_password=SERVICE_PASSWORD,
+        user_search_base=USER_BASE_DN,
+        user_search_filter='(&(objectClass=person)(uid={username}))',
+        group_search_base=GROUP_BASE_DN,
+        group_search_filter='(&(objectClass=group)(memberOf={group}))',
+        allowed_groups=[ALLOWED_GROUP_DN],
+        allow_nested_groups=True,
+        executor_max_workers=args.workers,
+        service_pool_max_size=args.workers,
+        login_concurrency_limit=args.clients,
+        login_throttle_username_attempts=0,
+        login_throttle_username_failures=0,
+        server_standby_connections=0,
+        **config)
+    authenticator.directory = directory
+    authenticator.latency = args.latency / 1000.0
+    authenticator.home_dir_latency = args.home_dir_latency / 1000.0
+    return authenticator
+
+
+@gen.coroutine
+def bench_authenticate(authenticator, directory, args, seed):
+    """
+    Run args.logins logins of random users from args.clients concurrent clients
+    """
+    rnd = random.Random(seed)
+    attempts = list()
+    for _ in range(args.logins):
+        password = 'wrong' if rnd.random() < args.bad_passwords else PASSWORD
+        attempts.append((rnd.choice(directory.usernames), password))
+    latencies = list()
+    results = collections.Counter()
+    queue = collections.deque(attempts)
+
+    @gen.coroutine
+    def client():
+        while queue:
+            username, password = queue.popleft()
+            start = time.perf_counter()
+            response = yield authenticator.authenticate(None, {'username': username, 'password': password})
+            latencies.append(time.perf_counter() - start)
+            results['success' if response else 'denied'] += 1
+
+    ops_before = operations_per_login()
+    start = time.perf_counter()
+    yield [client() for _ in range(args.clients)]
+    elapsed = time.perf_counter() - start
+    ops_after = operations_per_login()
+    logins = ops_after[1] - ops_before[1]
+    ops = round((ops_after[0] - ops_before[0]) / logins, 2) if logins else None
+    return summarize(latencies, elapsed, ops_per_login=ops, results=dict(results))
+
+
+def bench_nested_groups(authenticator, args):
+    """
+    Expand the nested groups of the allowed group args.expansions times
+    from args.clients concurrent threads
+    """
+    latencies = list()
+
+    def expand(_):
+        conn = authenticator.create_service_connection()
+        try:
+            start = time.perf_counter()
+            groups = authenticator.get_nested_groups(conn, ALLOWED_GROUP_DN)
+            latencies.append(time.perf_counter() - start)
+            return len(groups)
+        finally:
+            conn.unbind()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        sizes = list(pool.map(expand, range(args.expansions)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, nested_groups=sizes[0] if sizes else 0)
+
+
+@gen.coroutine
+def bench_add_user(authenticator, directory, args, seed):
+    """
+    Add args.adds users, a share of them repeatedly, from args.clients
+    concurrent clients
+    """
+    rnd = random.Random(seed)
+    names = [rnd.choice(directory.usernames) for _ in range(args.adds)]
+    queue = collections.deque(User(name) for name in names)
+    latencies = list()
+
+    @gen.coroutine
+    def client():
+        while queue:
+            user = queue.popleft()
+            start = time.perf_counter()
+            yield authenticator.add_user(user)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    yield [client() for _ in range(args.clients)]
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, distinct_users=len(set(names)))
+
+
+def run(args):
+    """
+    Build directory and run all scenarios
+    """
+    build_start = time.perf_counter()
+    directory = SyntheticDirectory(
+        users=args.users,
+        groups=args.groups,
+        depth=args.depth,
+        fanout=args.fanout,
+        memberships=args.memberships,
+        authorized=args.authorized,
+        seed=args.seed)
+    build_seconds = time.perf_counter() - build_start
+
+    scenarios = collections.OrderedDict()
+    loop = IOLoop.current()
+
+    authenticator = make_authenticator(directory, args)
+    scenarios['authenticate'] = loop.run_sync(
+        lambda: bench_authenticate(authenticator, directory, args, args.seed))
+    authenticator.shutdown()
+
+    authenticator = make_authenticator(
+        directory, args, user_cache_ttl=0, user_cache_negative_ttl=0, permitted_groups_cache_ttl=0)
+    scenarios['authenticate_uncached'] = loop.run_sync(
+        lambda: bench_authenticate(authenticator, directory, args, args.seed))
+    scenarios['get_nested_groups'] = bench_nested_groups(authenticator, args)
+    authenticator.shutdown()
+
+    authenticator = make_authenticator(directory, args, create_user_home_dir=True)
+    scenarios['add_user'] = loop.run_sync(
+        lambda: bench_add_user(authenticator, directory, args, args.seed))
+    authenticator.shutdown()
+
+    return {
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'ldap3': ldap3.__version__,
+        'parameters': {
+            key: getattr(args, key) for key in (
+                'users', 'groups', 'depth', 'fanout', 'memberships', 'authorized', 'clients', 'workers',
+                'logins', 'bad_passwords', 'expansions', 'adds', 'latency', 'home_dir_latency', 'seed')},
+        'directory': {
+            'build_seconds': round(build_seconds, 3),
+            'nested_groups': len(directory.nested_groups),
+        },
+        'scenarios': scenarios,
+    }
+
+
+def report(results, baseline=None):
+    """
+    Print scenario results, and the change relative to baseline if given
+    """
+    columns = ('count', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'ops_per_login')
+    print('{:<22}'.format('scenario') + ''.join('{:>14}'.format(c) for c in columns))
+    for name, scenario in results['scenarios'].items():
+        print('{:<22}'.format(name) + ''.join(
+            '{:>14}'.format('-' if scenario.get(c) is None else scenario[c]) for c in columns))
+        previous = (baseline or {}).get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        changes = list()
+        for c in columns[1:]:
+            if scenario.get(c) is None or not previous.get(c):
+                changes.append('-')
+            else:
+                changes.append('{:+.1f}%'.format((scenario[c] - previous[c]) / previous[c] * 100))
+        print('{:<22}{:>14}'.format('  vs ' + (baseline.get('label') or 'baseline'), '') + ''.join(
+            '{:>14}'.format(c) for c in changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='users in the directory')
+    parser.add_argument('--groups', type=int, default=200, help='groups unrelated to allowed_groups')
+    parser.add_argument('--depth', type=int, default=3, help='nesting depth below the allowed group')
+    parser.add_argument('--fanout', type=int, default=3, help='member groups of every nested group')
+    parser.add_argument('--memberships', type=int, default=10, help='unrelated group memberships per user')
+    parser.add_argument('--authorized', type=float, default=0.8, help='share of users in a permitted group')
+    parser.add_argument('--clients', type=int, default=20, help='concurrent clients')
+    parser.add_argument('--workers', type=int, default=10, help='ldap executor threads and pooled connections')
+    parser.add_argument('--logins', type=int, default=2000, help='logins per authenticate scenario')
+    parser.add_argument('--bad-passwords', type=float, default=0.1, help='share of logins with a wrong password')
+    parser.add_argument('--expansions', type=int, default=200, help='nested group expansions')
+    parser.add_argument('--adds', type=int, default=1000, help='add_user calls')
+    parser.add_argument('--latency', type=float, default=1.0, help='emulated ldap round trip in milliseconds')
+    parser.add_argument('--home-dir-latency', type=float, default=5.0,
+                        help='emulated home directory creation in milliseconds')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--label', default=None, help='label stored with the results, e.g. a release')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
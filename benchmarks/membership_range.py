@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Benchmark permitted group checks against users with very large memberships
+
+Emulates Active Directory range retrieval (at most 1500 values per response)
+for synthetic users and compares the permitted group check of logins, which
+stops reading pages at the first permitted group, with reading every page.
+
+    python benchmarks/membership_range.py --memberships 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldapauthenticator import LDAPAuthenticator  # noqa: E402
+
+
+class RangedConnection(object):
+    """
+    Minimal stand-in for an ldap3 connection serving one user entry whose
+    membership attribute is split into range retrieval pages
+    """
+
+    def __init__(self, dn, attribute, values, page_size=1500):
+        self.dn = dn
+        self.attribute = attribute
+        self.values = values
+        self.page_size = page_size
+        self.server = None
+        self.response = None
+        self.result = None
+        self.searches = 0
+
+    def page(self, start):
+        end = start + self.page_size - 1
+        if end >= len(self.values) - 1:
+            name = '{};range={}-*'.format(self.attribute, start)
+        else:
+            name = '{};range={}-{}'.format(self.attribute, start, end)
+        return {
+            'type': 'searchResEntry',
+            'dn': self.dn,
+            'attributes': {self.attribute: [], name: self.values[start:end + 1]},
+        }
+
+    def search(self, search_base, search_filter, search_scope=None, attributes=None, **kwargs):
+        self.searches += 1
+        start = int(attributes[0].partition(';range=')[2].partition('-')[0])
+        self.response = [self.page(start)]
+        return True
+
+
+def run(authenticator, memberships, position, repeat):
+    plan = authenticator.auth_plan
+    dn = 'CN=user,OU=Users,DC=example,DC=com'
+    values = ['CN=group-{:06d},OU=Groups,DC=example,DC=com'.format(i) for i in range(memberships)]
+    permitted = frozenset(['CN=allowed,OU=Groups,DC=example,DC=com'])
+    if position is not None:
+        values[position] = 'CN=allowed,OU=Groups,DC=example,DC=com'
+
+    results = dict()
+    # without permitted groups the login search steps read every page
+    for mode, groups in (('streaming', permitted), ('materialized', frozenset())):
+        searches = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn = RangedConnection(dn, plan.user_membership_attribute, values)
+            entry = conn.page(0)
+            conn.searches = 1
+            authenticator.find_permitted_membership(conn, plan, entry, groups)
+            searches += conn.searches
+        elapsed = time.perf_counter() - start
+        results[mode] = (elapsed / repeat * 1000, searches / repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--memberships', type=int, default=10000, help='memberships per synthetic user')
+    parser.add_argument('--repeat', type=int, default=200, help='checks per scenario')
+    args = parser.parse_args()
+
+    authenticator = LDAPAuthenticator(
+        server_hosts=['ldap.example.com'],
+        bind_user_dn='CN=svc,DC=example,DC=com',
+        bind_user_password='unused',
+        user_search_base='OU=Users,DC=example,DC=com',
+        user_search_filter='(sAMAccountName={username})')
+
+    scenarios = [
+        ('match in first page', 10),
+        ('match in last page', args.memberships - 1),
+        ('no match', None),
+    ]
+    print('{:<22} {:>14} {:>10} {:>14} {:>10}'.format(
+        'scenario', 'streaming ms', 'searches', 'materialize ms', 'searches'))
+    for name, position in scenarios:
+        results = run(authenticator, args.memberships, position, args.repeat)
+        print('{:<22} {:>14.3f} {:>10.1f} {:>14.3f} {:>10.1f}'.format(
+            name, results['streaming'][0], results['streaming'][1],
+            results['materialized'][0], results['materialized'][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Benchmark user password checks with full TLS handshakes, resumed TLS sessions and standby connections
+
+Runs a minimal local ldap server answering StartTLS and simple binds with a
+4096 bit RSA certificate and times verify_user_credentials with new
+connections doing a full handshake, new connections resuming the last TLS
+session, and standby connections opened and negotiated in the background.
+Requires the openssl command to create the certificate.
+
+    python benchmarks/tls_resumption.py --logins 200
+"""
+
+import argparse
+import logging
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tornado.ioloop import IOLoop  # noqa: E402
+from ldapauthenticator import LDAPAuthenticator  # noqa: E402
+
+START_TLS_OID = b'1.3.6.1.4.1.1466.20037'
+PASSWORD = 'secret'
+
+
+def read_tlv(data, offset=0):
+    """
+    Return (tag, value, end offset) of the BER element at offset
+    """
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    return tag, data[offset:offset + length], offset + length
+
+
+def tlv(tag, value):
+    length = len(value)
+    if length < 0x80:
+        return bytes([tag, length]) + value
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, 'big') + value
+
+
+def response(message_id, tag, code, extra=b''):
+    result = tlv(0x0a, bytes([code])) + tlv(0x04, b'') + tlv(0x04, b'') + extra
+    return tlv(0x30, tlv(0x02, message_id) + tlv(tag, result))
+
+
+class LDAPResponder(object):
+    """
+    Ldap server on localhost answering StartTLS and simple binds, accepting
+    PASSWORD for every dn, and searches without any entries. Counts full
+    and resumed TLS handshakes.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.handshakes = {False: 0, True: 0}
+        self._lock = threading.Lock()
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            sock, _ = self.listener.accept()
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    def receive(self, sock, buffer):
+        while True:
+            if len(buffer) >= 2:
+                try:
+                    _, _, end = read_tlv(buffer)
+                except IndexError:
+                    end = None
+                if end is not None and end <= len(buffer):
+                    return buffer[:end], buffer[end:]
+            chunk = sock.recv(65536)
+            if not chunk:
+                return None, buffer
+            buffer += chunk
+
+    def serve(self, sock):
+        buffer = b''
+        try:
+            while True:
+                message, buffer = self.receive(sock, buffer)
+                if message is None:
+                    return
+                _, body, _ = read_tlv(message)
+                _, message_id, offset = read_tlv(body)
+                tag, request, _ = read_tlv(body, offset)
+                if tag == 0x42:  # unbindRequest
+                    return
+                if tag == 0x77:  # extendedRequest
+                    _, name, _ = read_tlv(request)
+                    code = 0 if name == START_TLS_OID else 2
+                    sock.sendall(response(message_id, 0x78, code))
+                    if code == 0:
+                        sock = self.context.wrap_socket(sock, server_side=True)
+                        with self._lock:
+                            self.handshakes[sock.session_reused] += 1
+                elif tag == 0x60:  # bindRequest
+                    _, _, offset = read_tlv(request)
+                    _, _, offset = read_tlv(request, offset)
+                    _, password, _ = read_tlv(request, offset)
+                    code = 0 if password == PASSWORD.encode() else 49
+                    sock.sendall(response(message_id, 0x61, code))
+                elif tag == 0x63:  # searchRequest, no entries
+                    sock.sendall(response(message_id, 0x65, 0))
+                else:
+                    return
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            sock.close()
+
+
+def server_context(directory):
+    """
+    Return server SSLContext with a new self-signed 4096 bit RSA certificate
+    """
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:4096', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run(responder, logins, interval, **config):
+    log = logging.getLogger('tls_resumption')
+    log.setLevel(logging.CRITICAL)
+    authenticator = LDAPAuthenticator(
+        server_hosts=['127.0.0.1'],
+        server_port=responder.port,
+        bind_user_dn='cn=svc,dc=example,dc=com',
+        bind_user_password=PASSWORD,
+        user_search_base='ou=users,dc=example,dc=com',
+        user_search_filter='(uid={username})',
+        log=log,
+        **config)
+    plan = authenticator.auth_plan
+    full, resumed = responder.handshakes[False], responder.handshakes[True]
+    durations = list()
+
+    def check():
+        # standby connections are opened once the event loop starts
+        time.sleep(1)
+        for i in range(logins):
+            password = PASSWORD if i % 4 else 'wrong'
+            user_dn = 'uid=user{},ou=users,dc=example,dc=com'.format(i)
+            start = time.perf_counter()
+            valid = authenticator.verify_user_credentials(plan, user_dn, password)
+            durations.append(time.perf_counter() - start)
+            assert valid == (password == PASSWORD)
+            time.sleep(interval)
+
+    IOLoop.current().run_sync(lambda: IOLoop.current().run_in_executor(None, check))
+    authenticator.shutdown()
+    return (
+        percentile(durations, 0.5) * 1000,
+        percentile(durations, 0.95) * 1000,
+        responder.handshakes[False] - full,
+        responder.handshakes[True] - resumed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=200, help='password checks per scenario')
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between password checks')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        responder = LDAPResponder(server_context(directory))
+
+    scenarios = [
+        ('full handshake', dict(server_tls_session_reuse=False, server_standby_connections=0)),
+        ('session resumption', dict(server_tls_session_reuse=True, server_standby_connections=0)),
+        ('standby + resumption', dict(server_tls_session_reuse=True, server_standby_connections=2)),
+    ]
+    print('{:<22} {:>8} {:>8} {:>8} {:>8} {:>8}'.format('scenario', 'logins', 'p50 ms', 'p95 ms', 'full', 'resumed'))
+    for name, config in scenarios:
+        p50, p95, full, resumed = run(responder, args.logins, args.interval, **config)
+        print('{:<22} {:>8} {:>8.2f} {:>8.2f} {:>8.0f} {:>8.0f}'.format(name, args.logins, p50, p95, full, resumed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Caches used to avoid repeated ldap lookups
+"""
+
+import base64
+import collections
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from ldap3.utils.ciDict import CaseInsensitiveDict
+
+
+class CacheBackend(object):
+    """
+    Interface of caches storing ldap lookups.
+
+    Keys are strings and values are JSON types, byte strings, sets or ldap3
+    attribute dicts. Entries expire `ttl` seconds
+    after being stored unless a different ttl is passed to `set`.
+    """
+
+    def get(self, key, default=None):
+        """
+        Return cached value for key, or default if missing or expired
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """
+        Store value for key
+        """
+        raise NotImplementedError
+
+    def pop(self, key, default=None):
+        """
+        Remove key from cache and return its value
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release resources held by the cache
+        """
+
+
+class TTLCache(CacheBackend):
+    """
+    Thread-safe LRU cache with per-entry expiry.
+
+    Entries expire `ttl` seconds after being stored unless a different ttl is
+    passed to `set`. Once `maxsize` entries are stored, the least recently
+    used entry is evicted.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Return cached value for key, or default if missing or expired
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > self.timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Store value for key, evicting least recently used entries if full
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, self.timer() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove key from cache and return its value
+        """
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            self._data.clear()
+
+
+def dump_value(value):
+    """
+    Return JSON text of a cached value. Byte strings, sets and ldap3 case
+    insensitive attribute dicts are tagged so they are restored as such
+    """
+    return json.dumps(value, default=_encode_value, separators=(',', ':'))
+
+
+def load_value(text):
+    """
+    Return cached value from JSON text written by dump_value
+    """
+    return json.loads(text, object_hook=_decode_value)
+
+
+def _encode_value(value):
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, (set, frozenset)):
+        return {'__set__': sorted(value, key=repr)}
+    if isinstance(value, CaseInsensitiveDict):
+        return {'__ci__': dict(value)}
+    raise TypeError('{!r} is not cacheable'.format(type(value).__name__))
+
+
+def _decode_value(obj):
+    if len(obj) == 1:
+        if '__bytes__' in obj:
+            return base64.b64decode(obj['__bytes__'])
+        if '__set__' in obj:
+            return frozenset(obj['__set__'])
+        if '__ci__' in obj:
+            return CaseInsensitiveDict(obj['__ci__'])
+    return obj
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache stored in a SQLite database in write-ahead-log mode, so several
+    processes on one host can share entries and keep them across restarts.
+
+    Lookups are answered by an in-memory TTLCache so they never wait for the
+    database. A background thread writes changes behind to the database and
+    every `poll_interval` seconds loads the entries stored or removed by
+    other processes. Values are stored as JSON.
+
+    Expiry uses wall clock time as entries are shared between processes.
+    Once more than `maxsize` entries are stored, expired entries and then
+    the entries closest to expiry are removed.
+    """
+
+    # check size limit every this many writes
+    trim_interval = 100
+
+    def __init__(self, path, maxsize=1024, ttl=300, timer=time.time, poll_interval=1.0):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.poll_interval = poll_interval
+        self._front = TTLCache(maxsize, ttl, timer)
+        self._queue = queue.Queue()
+        self._writes = 0
+        # last database change seen, and changes made by this process
+        self._seq = 0
+        self._own = set()
+        self._thread = threading.Thread(target=self._run, name='ldap-cache-writer', daemon=True)
+        self._thread.start()
+
+    @property
+    def hits(self):
+        return self._front.hits
+
+    @property
+    def misses(self):
+        return self._front.misses
+
+    def __len__(self):
+        return len(self._front)
+
+    def get(self, key, default=None):
+        return self._front.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._front.set(key, value, ttl)
+        try:
+            text = dump_value(value)
+        except (TypeError, ValueError):
+            # kept in memory only
+            return
+        self._queue.put(('set', key, text, self.timer() + ttl))
+
+    def pop(self, key, default=None):
+        value = self._front.pop(key, default)
+        self._queue.put(('pop', key, None, self.timer() + self.ttl))
+        return value
+
+    def clear(self):
+        """
+        Remove all entries. Other processes drop their copies as they expire
+        """
+        self._front.clear()
+        self._queue.put(('clear', None, None, None))
+
+    def flush(self):
+        """
+        Wait until all changes have been written to the database and the
+        changes of other processes have been loaded
+        """
+        self._queue.put(('poll', None, None, None))
+        self._queue.join()
+
+    def close(self):
+        """
+        Write pending changes and stop the background thread
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _connect(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # removed entries are kept with a null value until they expire so
+        # other processes see the removal
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS json_entries (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'key TEXT NOT NULL UNIQUE, value TEXT, expires REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS json_entries_expires ON json_entries (expires)')
+        return conn
+
+    def _run(self):
+        conn = None
+        stop = False
+        while not stop:
+            try:
+                ops = [self._queue.get(timeout=self.poll_interval)]
+            except queue.Empty:
+                ops = []
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in ops
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._write(conn, [op for op in ops if op is not None and op[0] != 'poll'])
+                self._poll(conn)
+            except sqlite3.Error:
+                # the changes stay in memory only, reconnect for the next batch
+                conn = None
+            finally:
+                for _ in ops:
+                    self._queue.task_done()
+        if conn is not None:
+            conn.close()
+
+    def _write(self, conn, ops):
+        if not ops:
+            return
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for action, key, text, expires in ops:
+                if action == 'clear':
+                    conn.execute('DELETE FROM json_entries')
+                else:
+                    cursor = conn.execute(
+                        'INSERT OR REPLACE INTO json_entries (key, value, expires) VALUES (?, ?, ?)',
+                        (key, text, expires))
+                    self._own.add(cursor.lastrowid)
+                    self._writes += 1
+                    if self._writes % self.trim_interval == 0:
+                        self._trim(conn)
+
+    def _trim(self, conn):
+        conn.execute('DELETE FROM json_entries WHERE expires <= ?', (self.timer(),))
+        excess = conn.execute('SELECT COUNT(*) FROM json_entries').fetchone()[0] - self.maxsize
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM json_entries WHERE seq IN '
+                '(SELECT seq FROM json_entries ORDER BY expires LIMIT ?)', (excess,))
+
+    def _poll(self, conn):
+        rows = conn.execute(
+            'SELECT seq, key, value, expires FROM json_entries WHERE seq > ? AND expires > ? ORDER BY seq',
+            (self._seq, self.timer())).fetchall()
+        for seq, key, text, expires in rows:
+            self._seq = max(self._seq, seq)
+            if seq in self._own:
+                continue
+            if text is None:
+                self._front.pop(key)
+                continue
+            try:
+                value = load_value(text)
+            except ValueError:
+                continue
+            self._front.set(key, value, expires - self.timer())
+        self._own.clear()
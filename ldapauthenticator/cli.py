@@ -0,0 +1,80 @@
+"""
+Command line check of whether users are still permitted to log in
+
+    jupyterhub-ldap-check-users -f jupyterhub_config.py alice bob
+    jupyterhub-ldap-check-users -f jupyterhub_config.py --denied < usernames.txt
+"""
+
+import argparse
+import logging
+import os
+import sys
+from ldap3.core.exceptions import LDAPException
+from traitlets.config.loader import PyFileConfigLoader
+from ldapauthenticator.ldapauthenticator import LDAPAuthenticator
+
+EXIT_PERMITTED = 0
+EXIT_DENIED = 1
+EXIT_CONFIG_ERROR = 2
+EXIT_LDAP_ERROR = 3
+
+EPILOG = """exit status:
+  {}  all users are permitted
+  {}  at least one user is denied or not found
+  {}  invalid arguments or configuration
+  {}  ldap error, e.g. no server reachable
+""".format(EXIT_PERMITTED, EXIT_DENIED, EXIT_CONFIG_ERROR, EXIT_LDAP_ERROR)
+
+# a one-shot check opens no connections ahead of time and starts no
+# background refreshes
+CHECK_SETTINGS = dict(
+    service_pool_min_size=0,
+    authorization_index_enabled=False,
+    server_standby_connections=0,
+    server_info_path='',
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check whether usernames are permitted to log in by LDAPAuthenticator. '
+                    'Prints one tab separated line of username, status and dn per user.',
+        epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('usernames', nargs='*', help='usernames to check, read from stdin if omitted')
+    parser.add_argument('-f', '--config', default='jupyterhub_config.py', help='JupyterHub config file')
+    parser.add_argument('--denied', action='store_true', help='only print users that are not permitted')
+    parser.add_argument('--debug', action='store_true', help='log ldap activity')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING, stream=sys.stderr)
+    config_path = os.path.abspath(args.config)
+    loader = PyFileConfigLoader(os.path.basename(config_path), path=os.path.dirname(config_path))
+    config = loader.load_config()
+    for name, value in CHECK_SETTINGS.items():
+        config.LDAPAuthenticator[name] = value
+    authenticator = LDAPAuthenticator(config=config)
+    usernames = args.usernames or (line for line in sys.stdin if line.strip())
+
+    denied = 0
+    try:
+        for result in authenticator.iter_authorized_users(usernames):
+            if result.authorized:
+                status = 'permitted'
+            else:
+                status = 'denied' if result.dn else 'not_found'
+                denied += 1
+            if result.authorized and args.denied:
+                continue
+            print('{}\t{}\t{}'.format(result.username, status, result.dn or ''), flush=True)
+    except ValueError as exc:
+        parser.exit(EXIT_CONFIG_ERROR, 'error: {}\n'.format(exc))
+    except LDAPException as exc:
+        parser.exit(EXIT_LDAP_ERROR, 'ldap error: {}: {}\n'.format(type(exc).__name__, exc))
+    finally:
+        authenticator.shutdown(wait=False)
+    return EXIT_DENIED if denied else EXIT_PERMITTED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Routing of usernames to separate ldap domains
+"""
+
+import asyncio
+import collections
+import re
+from concurrent.futures import Future as ConcurrentFuture
+from functools import partial
+import ldap3
+from tornado import gen
+from tornado.ioloop import IOLoop
+from traitlets import Any, Dict, default
+from traitlets.config import Config, LoggingConfigurable
+from ldapauthenticator.membership import UserAuthorization
+
+# settings of 'domains' profiles holding state of a single domain, never
+# inherited from the global settings
+DOMAIN_STATE_TRAITS = ['server_info_path', 'authorization_index_path', 'cache_backend', 'cache_path']
+
+DomainProfile = collections.namedtuple('DomainProfile', ['name', 'suffixes', 'regex', 'authenticator'])
+DomainProfile.__doc__ = """
+Domain authenticator and the username suffixes and regex routed to it
+"""
+
+
+class DomainsMixin(LoggingConfigurable):
+    """
+    Authentication of usernames against the domains of 'domains', each with
+    an authenticator of its own. Mixed into LDAPAuthenticator, which sets
+    `domain_traits` to the settings domains inherit unless their profile
+    overrides them.
+    """
+
+    domain_traits = ()
+
+    domains = Dict(
+        config=True,
+        help="""
+        Profiles of separate ldap domains, e.g. Active Directory forests,
+        keyed by domain name. Each profile is a dict of LDAPAuthenticator
+        settings overriding the global ones for that domain, such as
+        'server_hosts', 'bind_user_dn', 'user_search_base',
+        'user_search_filter' and 'allowed_groups', plus the routing keys
+        'username_suffix' (a suffix or list of suffixes) and
+        'username_regex'. Profiles inherit the global connection, search,
+        connection pool, cache and authorization index settings.
+        'server_info_path', 'authorization_index_path', 'cache_backend' and
+        'cache_path' are not inherited, and hub-wide settings such as the
+        login throttle, login traces and home directory creation cannot be
+        set per domain. Usernames are authenticated against the domain
+        they are routed to. Usernames routed to several or no domains are
+        searched for in all candidate domains at once and authenticated
+        against the first domain finding exactly one user. Searches of the
+        other domains that have not started yet are cancelled, and a warning
+        is logged when a username is found in more than one domain (defaults
+        to {}).
+        """
+    )
+
+    domain_profiles = Any(
+        help="""
+        List of DomainProfile with an authenticator per domain of 'domains'
+        """
+    )
+
+    @default('domain_profiles')
+    def _default_domain_profiles(self):
+        inherited = {name: getattr(self, name) for name in self.domain_traits}
+        profiles = list()
+        for name, settings in self.domains.items():
+            settings = dict(settings)
+            suffixes = settings.pop('username_suffix', None) or ()
+            if isinstance(suffixes, str):
+                suffixes = (suffixes,)
+            regex = settings.pop('username_regex', None)
+            unknown = set(settings).difference(self.domain_traits, DOMAIN_STATE_TRAITS)
+            if unknown:
+                raise ValueError("domain '{}': {} cannot be set per domain".format(name, ', '.join(sorted(unknown))))
+            # hub-wide settings such as the login throttle, traces and home
+            # directories stay with this authenticator. Domains only inherit
+            # domain_traits, and share its ldap executor and queue limit.
+            authenticator = type(self)(
+                parent=self, config=Config(), domains={}, executor=self.executor, **dict(inherited, **settings))
+            authenticator._executor_owner = self
+            profiles.append(DomainProfile(
+                name=name,
+                suffixes=tuple(suffix.lower() for suffix in suffixes),
+                regex=re.compile(regex) if regex else None,
+                authenticator=authenticator))
+        return profiles
+
+    def iter_domain_authorized_users(self, usernames):
+        """
+        Check usernames against the domains of 'domains' they are routed to.
+        Usernames routed to several domains are checked by the first of them
+        finding exactly one user.
+        """
+        settings = dict()
+        for batch, invalid in self._authorized_user_batches(usernames):
+            if batch is None:
+                yield UserAuthorization(invalid, None, False)
+                continue
+            found = dict()
+            for profile, names in self._domain_batches(batch, found):
+                authenticator = profile.authenticator
+                if profile.name not in settings:
+                    try:
+                        settings[profile.name] = authenticator.batch_settings()
+                    except ValueError as exc:
+                        raise ValueError("domain '{}': {}".format(profile.name, exc))
+                plan, permitted_groups, in_chain = settings[profile.name]
+                for result in authenticator.service_pool.run(
+                        authenticator.search_users, plan, names, permitted_groups, in_chain):
+                    if result.dn is not None:
+                        found[result.username] = result
+            for username in batch:
+                yield found.get(username) or UserAuthorization(username, None, False)
+
+    @gen.coroutine
+    def check_domain_batch(self, batch, settings):
+        """
+        Check a batch of usernames against the domains they are routed to,
+        running one search per domain on the ldap executor. `settings` keeps
+        the batch settings of each domain between batches. Returns list of
+        UserAuthorization in the order of batch.
+        """
+        found = dict()
+        for profile, names in self._domain_batches(batch, found):
+            authenticator = profile.authenticator
+            if profile.name not in settings:
+                try:
+                    settings[profile.name] = yield authenticator.load_batch_settings()
+                except ValueError as exc:
+                    raise ValueError("domain '{}': {}".format(profile.name, exc))
+            plan, permitted_groups, in_chain = settings[profile.name]
+            results = yield authenticator.run_searches(
+                authenticator.search_users_steps, plan, names, permitted_groups, in_chain)
+            found.update((result.username, result) for result in results if result.dn is not None)
+        return [found.get(username) or UserAuthorization(username, None, False) for username in batch]
+
+    def _domain_batches(self, batch, found):
+        """
+        Yield each domain profile and the usernames of batch routed to it
+        that no previous domain found. `found` is updated by the caller
+        between domains.
+        """
+        routes = dict((username, self.route_domains(username)) for username in batch)
+        for profile in self.domain_profiles:
+            names = [username for username in batch if username not in found and profile in routes[username]]
+            if names:
+                yield profile, names
+
+    def route_domains(self, username):
+        """
+        Return profiles of the domains username is routed to by suffix or
+        regex, or all profiles if no domain matches
+        """
+        lowered = username.lower()
+        profiles = [
+            profile for profile in self.domain_profiles
+            if any(lowered.endswith(suffix) for suffix in profile.suffixes)
+            or (profile.regex is not None and profile.regex.search(username))]
+        return profiles or list(self.domain_profiles)
+
+    @gen.coroutine
+    def find_user_domain(self, profiles, username, login=None):
+        """
+        Search for username in all domains of profiles at once and return
+        the profile of the first domain finding exactly one user, or None.
+        Searches of the other domains still waiting for an executor thread
+        are cancelled, those already running complete and store their result
+        in the user cache of their domain. Raises the last ldap error if no
+        domain found the user and a search failed.
+        """
+        usable = list()
+        for profile in profiles:
+            if profile.authenticator.auth_plan.error:
+                self.log.error("Domain '%s' is not usable: %s", profile.name, profile.authenticator.auth_plan.error)
+            else:
+                usable.append(profile)
+        # users cached in a domain are found before any search is started
+        cached = list()
+        for profile in usable:
+            authenticator = profile.authenticator
+            response = authenticator.user_cache.get(authenticator.cache_key(authenticator.auth_plan, 'user', username))
+            if response is not None and len(response) == 1:
+                cached.append(profile.name)
+        if cached:
+            if len(cached) > 1:
+                self.log.warning(
+                    "User '%s' found in domains %s. Authenticating against domain '%s'.",
+                    username, cached, cached[0])
+            return next(profile for profile in usable if profile.name == cached[0])
+
+        found = list()
+        queued = list()
+        searches = list()
+        for profile in usable:
+            authenticator = profile.authenticator
+            plan = authenticator.auth_plan
+            user_search_filter = authenticator.format_user_search_filter(plan, username, login)
+            search = authenticator.run_searches(authenticator.lookup_user_steps, plan, user_search_filter, login=login)
+            if isinstance(search, ConcurrentFuture):
+                # searches on the ldap executor can be cancelled until they start
+                queued.append(search)
+                search = asyncio.wrap_future(search)
+            IOLoop.current().add_future(search, partial(self._domain_search_done, profile, username, plan, found))
+            searches.append(search)
+
+        last_exc = None
+        waiter = gen.WaitIterator(*searches)
+        while not waiter.done():
+            try:
+                response = yield waiter.next()
+            except ldap3.core.exceptions.LDAPException as exc:
+                last_exc = exc
+                continue
+            if len(response) == 1:
+                for search in queued:
+                    search.cancel()
+                return usable[waiter.current_index]
+        if last_exc is not None:
+            raise last_exc
+        return None
+
+    def _domain_search_done(self, profile, username, plan, found, search):
+        """
+        Cache the result of the user search of a domain, log its failure and
+        warn about a user found in more than one domain
+        """
+        if search.cancelled():
+            return
+        exc = search.exception()
+        if exc is not None:
+            self.log.warning(
+                "ldap search in domain '%s' failed: %s: %s", profile.name, exc.__class__.__name__, exc)
+            return
+        response = search.result()
+        profile.authenticator.cache_user_response(plan, username, response)
+        if len(response) == 1:
+            found.append(profile.name)
+            if len(found) > 1:
+                self.log.warning(
+                    "User '%s' found in domains %s. Authenticating against domain '%s'.",
+                    username, found, found[0])
+
+    @gen.coroutine
+    def authenticate_domain_user(self, username, password, login):
+        """
+        Authenticate username against the domain of 'domains' it is routed
+        to or found in. The domain is stored in auth_state for refresh_user.
+        """
+        profiles = self.route_domains(username)
+        if len(profiles) > 1:
+            names = [profile.name for profile in profiles]
+            self.log.debug("Searching for user '%s' in domains %s.", username, names)
+            try:
+                with login.phase('domain_search'):
+                    profile = yield self.find_user_domain(profiles, username, login)
+            except ldap3.core.exceptions.LDAPException as exc:
+                return self._deny(
+                    login, 'server_down',
+                    "ldap search in domains %s failed: %s: %s", names, exc.__class__.__name__, exc)
+            if profile is None:
+                return self._deny(login, 'no_such_user', "User '%s' not found in domains %s.", username, names)
+        else:
+            profile = profiles[0]
+        self.log.debug("Authenticating user '%s' against domain '%s'.", username, profile.name)
+        auth_response = yield profile.authenticator.authenticate_ldap_user(username, password, login)
+        if auth_response:
+            auth_response['auth_state']['domain'] = profile.name
+        return auth_response
+
+    @gen.coroutine
+    def refresh_domain_user(self, user, handler=None):
+        """
+        Re-validate a logged in user against the domain stored in its
+        auth_state, or the domain it is routed to or found in
+        """
+        auth_state = (yield user.get_auth_state()) or {}
+        profiles = [profile for profile in self.domain_profiles if profile.name == auth_state.get('domain')]
+        profiles = profiles or self.route_domains(user.name)
+        profile = profiles[0]
+        if len(profiles) > 1:
+            try:
+                profile = yield self.find_user_domain(profiles, user.name)
+            except ldap3.core.exceptions.LDAPException as exc:
+                # keep users logged in while the directory is unavailable
+                self.log.warning(
+                    "Could not refresh user '%s': %s: %s", user.name, exc.__class__.__name__, exc)
+                return True
+            if profile is None:
+                self.log.warning("User '%s' no longer found in any domain. Requiring new login.", user.name)
+                return False
+        result = yield profile.authenticator.refresh_user(user, handler)
+        if isinstance(result, dict):
+            result['auth_state']['domain'] = profile.name
+        return result
@@ -0,0 +1,359 @@
+"""
+Event loop driven ldap engine pipelining operations over shared connections
+"""
+
+import collections
+from datetime import timedelta
+import ldap3
+from ldap3.core.exceptions import (
+    LDAPCommunicationError, LDAPException, LDAPResponseTimeoutError, LDAPSessionTerminatedByServerError)
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.operation.bind import bind_operation
+from ldap3.strategy.asynchronous import AsyncStrategy
+from tornado import gen, locks
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+
+class NotifyingAsyncStrategy(AsyncStrategy):
+    """
+    ldap3 ASYNC strategy calling back from the receiver thread as soon as the
+    response to a message is complete, so no thread has to block in
+    get_response while waiting for it
+    """
+
+    def __init__(self, ldap_connection):
+        AsyncStrategy.__init__(self, ldap_connection)
+        self._waiters = dict()
+        self._abandoned = set()
+        self.terminated = False
+
+    def open(self, reset_usage=True, read_server_info=True):
+        self.terminated = False
+        AsyncStrategy.open(self, reset_usage, read_server_info)
+
+    def add_waiter(self, message_id, callback):
+        """
+        Call callback() once the response to message_id is complete, or
+        callback(exc) if the connection closes first
+        """
+        with self.event_lock:
+            event = self._events.get(message_id)
+            done = event is not None and event.is_set()
+            if not done and not self.terminated:
+                self._waiters[message_id] = callback
+        if done:
+            callback()
+        elif self.terminated:
+            callback(LDAPSessionTerminatedByServerError('connection closed'))
+
+    def set_event_for_message(self, message_id):
+        # called by the receiver thread holding async_lock
+        with self.event_lock:
+            if message_id in self._abandoned:
+                self._abandoned.discard(message_id)
+                self._events.pop(message_id, None)
+                self._responses.pop(message_id, None)
+                return
+        AsyncStrategy.set_event_for_message(self, message_id)
+        with self.event_lock:
+            callback = self._waiters.pop(message_id, None)
+        if callback is not None:
+            callback()
+
+    def abandon_message(self, message_id):
+        """
+        Stop waiting for message_id and drop its response if it arrives later
+        """
+        with self.event_lock:
+            self._waiters.pop(message_id, None)
+            event = self._events.pop(message_id, None)
+            if event is None or not event.is_set():
+                self._abandoned.add(message_id)
+        with self.async_lock:
+            if self._responses is not None:
+                self._responses.pop(message_id, None)
+        if self._outstanding:
+            self._outstanding.pop(message_id, None)
+
+    def close(self):
+        AsyncStrategy.close(self)
+        with self.event_lock:
+            self.terminated = True
+            waiters = list(self._waiters.values())
+            self._waiters.clear()
+        for callback in waiters:
+            callback(LDAPSessionTerminatedByServerError('connection closed with operations outstanding'))
+
+
+def engine_connection(server, **kwargs):
+    """
+    Return an unopened ldap3 Connection using NotifyingAsyncStrategy
+    """
+    conn = ldap3.Connection(server, client_strategy=ldap3.ASYNC, auto_bind=ldap3.AUTO_BIND_NONE, **kwargs)
+    strategy = conn.strategy = NotifyingAsyncStrategy(conn)
+    conn.send = strategy.send
+    conn.open = strategy.open
+    conn.get_response = strategy.get_response
+    conn.post_send_single_response = strategy.post_send_single_response
+    conn.post_send_search = strategy.post_send_search
+    return conn
+
+
+class AsyncLDAPEngine(object):
+    """
+    Runs ldap searches and binds from the event loop without occupying a
+    thread per operation.
+
+    Searches are pipelined over up to `connections` connections created by
+    `service_factory`, each carrying any number of outstanding operations
+    correlated by message id. Binds of authenticating users change the
+    identity of their connection and must not overlap other operations on
+    it, so they run one at a time on up to `bind_connections` unbound
+    connections created by `bind_factory`. Factories are blocking and run on
+    `executor`; operations only write their request and wait on a future
+    resolved by the receiver thread of the connection. Operations time out
+    after `timeout` seconds.
+
+    `operation(conn, name, login, search=None)` is a context manager
+    recording each operation, passed the keyword arguments of searches.
+    """
+
+    def __init__(self, service_factory, bind_factory, executor, operation, connections=2,
+                 bind_connections=4, timeout=None, log=None):
+        self.service_factory = service_factory
+        self.bind_factory = bind_factory
+        self.executor = executor
+        self.operation = operation
+        self.connections = max(connections, 1)
+        self.bind_connections = max(bind_connections, 1)
+        self.timeout = timeout
+        self.log = log
+        self._service = list()
+        self._opening = None
+        self._inflight = collections.Counter()
+        self._retired = set()
+        self._idle_binds = list()
+        self._bind_slots = None
+        self._generation = 0
+        self._closed = False
+
+    @property
+    def size(self):
+        """
+        Number of open service and bind connections
+        """
+        return len(self._service) + len(self._idle_binds)
+
+    def _close(self, conn):
+        """
+        Close connection ignoring errors
+        """
+        try:
+            conn.unbind()
+        except LDAPException:
+            pass
+
+    def _response(self, conn, message_id):
+        """
+        Return future of the (response, result) of message_id on conn
+        """
+        io_loop = IOLoop.current()
+        waiter = Future()
+
+        def resolve(exc=None):
+            if waiter.done():
+                return
+            if exc is not None:
+                waiter.set_exception(exc)
+                return
+            try:
+                response, result = conn.get_response(message_id, timeout=0)
+            except LDAPException as get_exc:
+                waiter.set_exception(get_exc)
+                return
+            if result is None:
+                waiter.set_exception(LDAPSessionTerminatedByServerError('connection closed'))
+                return
+            waiter.set_result((response or [], result))
+
+        conn.strategy.add_waiter(message_id, lambda exc=None: io_loop.add_callback(resolve, exc))
+        return waiter
+
+    @gen.coroutine
+    def _wait(self, conn, message_id):
+        """
+        Wait at most `timeout` seconds for the response to message_id
+        """
+        self._inflight[conn] += 1
+        try:
+            future = self._response(conn, message_id)
+            if self.timeout:
+                response = yield gen.with_timeout(timedelta(seconds=self.timeout), future)
+            else:
+                response = yield future
+        except gen.TimeoutError:
+            future.cancel()
+            conn.strategy.abandon_message(message_id)
+            raise LDAPResponseTimeoutError('no response from server within {} seconds'.format(self.timeout))
+        finally:
+            self._inflight[conn] -= 1
+            if not self._inflight[conn]:
+                del self._inflight[conn]
+                if conn in self._retired:
+                    self._retired.discard(conn)
+                    self._close(conn)
+        return response
+
+    @gen.coroutine
+    def _open(self, factory):
+        """
+        Open connection with factory on the executor
+        """
+        conn = yield IOLoop.current().run_in_executor(self.executor, factory)
+        return conn
+
+    @gen.coroutine
+    def _open_service(self):
+        generation = self._generation
+        try:
+            conn = yield self._open(self.service_factory)
+        finally:
+            self._opening = None
+        if generation != self._generation or self._closed:
+            self._close(conn)
+        else:
+            self._service.append(conn)
+
+    def _service_opened(self, future):
+        exc = future.exception()
+        if exc is not None and self.log:
+            self.log.warning("Failed to open ldap engine connection: %s: %s", exc.__class__.__name__, exc)
+
+    @gen.coroutine
+    def _service_connection(self):
+        """
+        Return least busy service connection, opening another one while all
+        are busy and fewer than `connections` are open
+        """
+        while True:
+            if self._closed:
+                raise LDAPException('ldap engine is closed')
+            self._service = [conn for conn in self._service if not conn.closed]
+            conn = min(self._service, key=lambda c: self._inflight[c], default=None)
+            if conn is not None and (not self._inflight[conn] or len(self._service) >= self.connections):
+                return conn
+            if self._opening is None:
+                self._opening = self._open_service()
+                IOLoop.current().add_future(self._opening, self._service_opened)
+            if conn is not None:
+                return conn
+            yield self._opening
+
+    def _retire(self, conn):
+        """
+        Close connection once its outstanding operations complete
+        """
+        if self._inflight[conn]:
+            self._retired.add(conn)
+        else:
+            self._close(conn)
+
+    @gen.coroutine
+    def search(self, login=None, **kwargs):
+        """
+        Run Connection.search on a service connection and return its
+        (response, result). Searches failing with a communication error are
+        retried once on another connection.
+        """
+        for attempt in (1, 2):
+            conn = yield self._service_connection()
+            try:
+                with self.operation(conn, 'search', login, search=kwargs):
+                    message_id = conn.search(**kwargs)
+                    response = yield self._wait(conn, message_id)
+                    # entries of the search just completed, as on sync connections
+                    conn.response = response[0]
+                return response
+            except LDAPCommunicationError:
+                if conn in self._service:
+                    self._service.remove(conn)
+                self._retire(conn)
+                if attempt == 2:
+                    raise
+
+    @gen.coroutine
+    def run(self, steps, login=None):
+        """
+        Run the searches of the steps generator and return its result. Step
+        generators yield keyword arguments of Connection.search and are sent
+        the (response, result) of each search.
+        """
+        try:
+            search = next(steps)
+            while True:
+                response = yield self.search(login=login, **search)
+                search = steps.send(response)
+        except StopIteration as stop:
+            return stop.value
+
+    @gen.coroutine
+    def bind(self, user_dn, password, login=None):
+        """
+        Simple bind as user_dn on a bind connection. Returns True if the
+        credentials are valid.
+        """
+        if not password:
+            return False
+        if self._bind_slots is None:
+            self._bind_slots = locks.Semaphore(self.bind_connections)
+        yield self._bind_slots.acquire()
+        try:
+            for attempt in (1, 2):
+                generation = self._generation
+                conn = None
+                while self._idle_binds and conn is None:
+                    conn = self._idle_binds.pop()
+                    if conn.closed:
+                        conn = None
+                if conn is None:
+                    conn = yield self._open(self.bind_factory)
+                try:
+                    with self.operation(conn, 'bind', login):
+                        request = bind_operation(
+                            conn.version, ldap3.SIMPLE, user_dn, password, auto_encode=conn.auto_encode)
+                        message_id = conn.post_send_single_response(conn.send('bindRequest', request))
+                        _, result = yield self._wait(conn, message_id)
+                except LDAPCommunicationError:
+                    self._close(conn)
+                    if attempt == 2:
+                        raise
+                    continue
+                except Exception:
+                    self._close(conn)
+                    raise
+                if generation == self._generation and not self._closed:
+                    self._idle_binds.append(conn)
+                else:
+                    self._close(conn)
+                return result['result'] == RESULT_SUCCESS
+        finally:
+            self._bind_slots.release()
+
+    def clear(self):
+        """
+        Close all connections. Connections with outstanding operations are
+        closed once their operations complete.
+        """
+        self._generation += 1
+        service, self._service = self._service, list()
+        idle, self._idle_binds = self._idle_binds, list()
+        for conn in service + idle:
+            self._retire(conn)
+
+    def close(self):
+        """
+        Close the engine and all connections
+        """
+        self._closed = True
+        self.clear()
@@ -0,0 +1,52 @@
+"""
+JupyterHub API handlers registered by LDAPAuthenticator
+"""
+
+import json
+from jupyterhub.apihandlers.base import APIHandler
+from jupyterhub.scopes import needs_scope
+from tornado import web
+
+# scope required by every handler, held by JupyterHub's admin role
+ADMIN_SCOPE = 'admin:users'
+
+
+class UserCacheAPIHandler(APIHandler):
+    """
+    Evict a single user from the ldap user lookup cache
+
+    DELETE /hub/api/ldap/cache/users/:username
+    """
+
+    @needs_scope(ADMIN_SCOPE)
+    def delete(self, username):
+        username = self.authenticator.normalize_username(username)
+        self.authenticator.evict_user(username)
+        self.set_status(204)
+
+
+class LoginTraceAPIHandler(APIHandler):
+    """
+    List or drop the kept traces of slow logins and user provisionings,
+    newest first
+
+    GET /hub/api/ldap/traces[?min_duration=seconds]
+    DELETE /hub/api/ldap/traces
+    """
+
+    @needs_scope(ADMIN_SCOPE)
+    def get(self):
+        try:
+            min_duration = float(self.get_argument('min_duration', 0))
+        except ValueError:
+            raise web.HTTPError(400, 'min_duration must be a number of seconds')
+        traces = [
+            trace.as_dict() for trace in self.authenticator.login_traces.traces()
+            if trace.duration >= min_duration]
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({'traces': traces}))
+
+    @needs_scope(ADMIN_SCOPE)
+    def delete(self):
+        self.authenticator.login_traces.clear()
+        self.set_status(204)
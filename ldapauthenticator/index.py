@@ -0,0 +1,105 @@
+"""
+In-memory index of users permitted to log in
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# re-read entries changed this many seconds before the last sync to allow
+# for clock skew and replication delay between servers
+SYNC_OVERLAP = 300
+
+
+def generalized_time(seconds):
+    """
+    Return LDAP generalized time `seconds` before now
+    """
+    moment = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+    return moment.strftime('%Y%m%d%H%M%SZ')
+
+
+class AuthorizationIndex(object):
+    """
+    Thread-safe mapping of normalized usernames to user dns of all members
+    of the permitted groups.
+
+    Usernames and dns are interned, so dns shared with other caches and the
+    group sets are stored once. `watermark` is the generalized time entries
+    have to be modified after to be picked up by the next sync, and
+    `group_stamps` holds the last seen modifyTimestamp of changed groups.
+    """
+
+    def __init__(self, fingerprint, groups, members=None, watermark=None, group_stamps=None, built=None):
+        self.fingerprint = fingerprint
+        self.groups = frozenset(groups)
+        self.watermark = watermark
+        self.group_stamps = dict(group_stamps or {})
+        self.built = time.time() if built is None else built
+        self._members = dict()
+        self._lock = threading.Lock()
+        for username, dn in (members or {}).items():
+            self.add(username, dn)
+
+    def __len__(self):
+        return len(self._members)
+
+    def get(self, username):
+        """
+        Return dn of permitted user, or None
+        """
+        return self._members.get(username)
+
+    def add(self, username, dn):
+        """
+        Add permitted user
+        """
+        with self._lock:
+            self._members[sys.intern(username)] = sys.intern(dn)
+
+    def discard(self, username):
+        """
+        Remove user if present
+        """
+        with self._lock:
+            self._members.pop(username, None)
+
+    def dump(self, path):
+        """
+        Write index to path, replacing any previous snapshot atomically
+        """
+        with self._lock:
+            members = dict(self._members)
+        data = {
+            'fingerprint': self.fingerprint,
+            'groups': sorted(self.groups),
+            'watermark': self.watermark,
+            'group_stamps': self.group_stamps,
+            'built': self.built,
+            'members': members,
+        }
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read index snapshot from path. Return None if there is no snapshot.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(
+            data['fingerprint'],
+            data['groups'],
+            members=data['members'],
+            watermark=data['watermark'],
+            group_stamps=data['group_stamps'],
+            built=data['built'])
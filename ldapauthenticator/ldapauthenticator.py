@@ -24,26 +24,126 @@ LDAP Authenticator plugin for JupyterHub
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import copy
+import atexit
+import collections
+import hashlib
+import hmac
+import json
 import os
-import pipes
-import pwd
+import random
 import re
-import sys
-from subprocess import Popen, PIPE, STDOUT
+import string
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
 from jupyterhub.auth import Authenticator
-from jupyterhub.traitlets import Command
 import ldap3
-from ldap3.utils.conv import escape_filter_chars
-from tornado import gen
-from traitlets import Any, Int, Bool, List, Unicode, Union, default, observe
+from ldap3.utils.conv import escape_filter_chars, unescape_filter_chars
+from ldap3.protocol.rfc4512 import DsaInfo, SchemaInfo
+from ldap3.utils.dn import escape_rdn
+from tornado import gen, locks
+from tornado.ioloop import IOLoop, PeriodicCallback
+from traitlets import Any, Float, Int, Bool, List, Unicode, Union, default, observe
+from ldapauthenticator.cache import SQLiteCache, TTLCache
+from ldapauthenticator.domains import DomainsMixin
+from ldapauthenticator.engine import AsyncLDAPEngine, engine_connection
+from ldapauthenticator.handlers import LoginTraceAPIHandler, UserCacheAPIHandler
+from ldapauthenticator.index import SYNC_OVERLAP, AuthorizationIndex, generalized_time
+from ldapauthenticator.membership import (
+    IN_CHAIN_MATCHING_RULE, NESTED_GROUPS_STRATEGIES, MembershipMixin, UserAuthorization)
+from ldapauthenticator.metrics import (
+    CACHE_REQUESTS, LOGIN_RESULTS, PHASE_DURATION_SECONDS, THROTTLED_LOGINS, LoginRecord,
+    call_with_login, current_login, record_operation)
+from ldapauthenticator.pool import LDAPConnectionPool, StandbyConnections
+from ldapauthenticator.provisioning import ProvisioningMixin
+from ldapauthenticator.servers import SERVER_FAILURES, ServerSelector
+from ldapauthenticator.throttle import LoginThrottle
+from ldapauthenticator.tracing import Trace, TraceBuffer
+from ldapauthenticator.tls import ResumingTls
 
 
-class LDAPAuthenticator(Authenticator):
+HOST_IP_REGEX = re.compile(
+    r'^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$')
+HOST_NAME_REGEX = re.compile(r'^((?!-)[a-z0-9\-]{1,63}(?<!-)\.){1,}((?!-)[a-z0-9\-]{1,63}(?<!-)){1}$')
+HOST_URL_REGEX = re.compile(
+    r'^(ldaps?://)(((?!-)[a-z0-9\-]{1,63}(?<!-)\.){1,}((?!-)[a-z0-9\-]{1,63}(?<!-)){1}):([0-9]{3})$')
+
+# traits compiled into the auth plan
+AUTH_PLAN_TRAITS = [
+    'server_hosts', 'server_port', 'server_use_ssl', 'server_connect_timeout',
+    'server_pool_strategy', 'server_pool_active', 'server_pool_exhaust',
+    'bind_user_dn', 'bind_user_password', 'user_search_base',
+    'user_search_filter', 'user_membership_attribute', 'group_search_base',
+    'group_search_filter', 'allowed_groups', 'nested_groups_strategy',
+    'user_attribute', 'ldap_engine', 'server_tls_session_reuse', 'user_dn_template',
+    'server_get_info', 'filter_by_group', 'allow_nested_groups', 'nested_groups_max_depth',
+    'server_side_group_filter',
+]
+
+# settings of 'domains' profiles, inherited from the global settings unless
+# the profile overrides them
+DOMAIN_TRAITS = AUTH_PLAN_TRAITS + [
+    'server_receive_timeout', 'server_latency_decay', 'server_circuit_failures', 'server_circuit_backoff',
+    'server_circuit_max_backoff', 'server_hedge_delay', 'server_standby_connections', 'server_standby_max_age',
+    'group_search_batch_size', 'pipeline_user_bind', 'ldap_engine_connections', 'ldap_engine_bind_connections',
+    'service_pool_min_size', 'service_pool_max_size', 'service_pool_idle_timeout',
+    'service_pool_acquire_timeout', 'service_pool_health_check_interval', 'user_cache_size', 'user_cache_ttl',
+    'user_cache_negative_ttl', 'permitted_groups_cache_ttl', 'permitted_groups_cache_stale_ttl',
+    'permitted_groups_refresh_backoff', 'authorization_index_enabled', 'authorization_index_page_size',
+    'authorization_index_sync_interval', 'authorization_index_rebuild_interval', 'authorized_users_batch_size',
+    'refresh_user_membership',
+]
+
+# traits configuring the server selector
+SERVER_SELECTOR_TRAITS = [
+    'server_latency_decay', 'server_circuit_failures', 'server_circuit_backoff', 'server_circuit_max_backoff',
+]
+
+# login results counting as failed logins for the login throttle
+THROTTLE_FAILURE_RESULTS = ('no_such_user', 'not_in_group', 'bad_password')
+
+# attribute compared to '{username}' in a user search filter
+USER_ATTRIBUTE_REGEX = re.compile(r'\(([\w.;-]+)=\{username\}\)')
+
+PAGED_RESULTS_CONTROL = '1.2.840.113556.1.4.319'
+LDAP_ENGINES = ('thread', 'async')
+SERVER_GET_INFO = ('NONE', 'DSA', 'SCHEMA', 'ALL')
+
+AuthPlan = collections.namedtuple('AuthPlan', [
+    'error',
+    'server_hosts',
+    'server_pool',
+    'server_pool_strategy',
+    'user_search_base',
+    'user_search_filter',
+    'user_membership_attribute',
+    'group_search_base',
+    'group_search_filter',
+    'allowed_groups',
+    'permitted_groups',
+    'nested_groups_strategy',
+    'filter_by_group',
+    'allow_nested_groups',
+    'nested_groups_max_depth',
+    'server_side_group_filter',
+    'user_attribute',
+    'user_dn_template',
+    'fingerprint',
+])
+AuthPlan.__doc__ = """
+Immutable snapshot of the configuration used by the authentication hot path
+"""
+
+
+class LDAPAuthenticator(DomainsMixin, MembershipMixin, ProvisioningMixin, Authenticator):
     """
     LDAP Authenticator for Jupyterhub
     """
 
+    domain_traits = DOMAIN_TRAITS
+
     server_hosts = Union(
         [List(), Unicode()],
         config=True,
@@ -105,6 +205,11 @@ class LDAPAuthenticator(Authenticator):
         RANDOM: each time the connection is open a random server is chosen in the
             pool. If 'server_pool_active' is set to True unavailable servers
             will be discarded.
+        FASTEST: Each time the connection is open the server with the lowest
+            average connect and operation latency is used. Servers failing
+            'server_circuit_failures' times in a row are skipped until a
+            background probe succeeds. 'server_pool_active' and
+            'server_pool_exhaust' are ignored.
         """
     )
 
@@ -131,6 +236,143 @@ class LDAPAuthenticator(Authenticator):
         """
     )
 
+    server_latency_decay = Float(
+        default_value=0.3,
+        config=True,
+        help="""
+        Weight of the most recent measurement in the moving average of server
+        latency used by the 'FASTEST' server_pool_strategy. Higher values
+        react faster to latency changes (defaults to 0.3).
+        """
+    )
+
+    server_circuit_failures = Int(
+        default_value=3,
+        config=True,
+        help="""
+        Number of consecutive failed connects or operations after which a
+        server is skipped by the 'FASTEST' server_pool_strategy (defaults to 3).
+        """
+    )
+
+    server_circuit_backoff = Int(
+        default_value=5,
+        config=True,
+        help="""
+        Number of seconds a failing server is skipped before it is probed
+        again. The wait doubles with every failed probe (defaults to 5).
+        """
+    )
+
+    server_circuit_max_backoff = Int(
+        default_value=300,
+        config=True,
+        help="""
+        Maximum number of seconds a failing server is skipped between probes
+        (defaults to 300).
+        """
+    )
+
+    server_hedge_delay = Float(
+        default_value=0,
+        config=True,
+        help="""
+        Number of seconds to wait for a connection to the fastest server
+        before also connecting to the next server, using whichever connects
+        first. Only used by the 'FASTEST' server_pool_strategy of the
+        'thread' ldap_engine. Set to 0 to disable hedging (defaults to 0).
+        """
+    )
+
+    server_selector = Any(
+        help="""
+        Tracker of server latency and failures used to order servers
+        """
+    )
+
+    @default('server_selector')
+    def _default_server_selector(self):
+        return ServerSelector(
+            decay=self.server_latency_decay,
+            failure_threshold=self.server_circuit_failures,
+            backoff=self.server_circuit_backoff,
+            max_backoff=self.server_circuit_max_backoff)
+
+    server_tls_session_reuse = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        Boolean specifying if TLS sessions negotiated with a server are
+        resumed by later connections to it, replacing the full StartTLS
+        handshake of new connections with an abbreviated one. Sockets are
+        then wrapped by LDAPAuthenticator instead of ldap3 (defaults to
+        False).
+        """
+    )
+
+    server_standby_connections = Int(
+        default_value=0,
+        config=True,
+        help="""
+        Number of connections per server kept open with StartTLS already
+        negotiated, so verifying a user's password starts with the bind.
+        Standby connections are opened when the hub starts and replaced in
+        the background after use. Set to 0 to open a new connection for every
+        password check (defaults to 0).
+        """
+    )
+
+    server_standby_max_age = Int(
+        default_value=60,
+        config=True,
+        help="""
+        Number of seconds a standby connection waits to be used before it is
+        replaced, so servers do not close it for being idle (defaults to 60).
+        """
+    )
+
+    standby_connections = Any(
+        help="""
+        Opened, unbound connections used to verify user passwords
+        """
+    )
+
+    @default('standby_connections')
+    def _default_standby_connections(self):
+        return StandbyConnections(
+            partial(self.open_server_connection, username=None, password=None),
+            self.submit_connect,
+            size=self.server_standby_connections,
+            max_age=self.server_standby_max_age)
+
+    server_get_info = Unicode(
+        default_value='NONE',
+        config=True,
+        help="""
+        Server information read from a server after every bind of a new
+        connection: 'NONE', 'DSA' (the root DSE), 'SCHEMA' or 'ALL'. The
+        schema is only used to format attribute values by their syntax and
+        is a large download from Active Directory, so authentication does not
+        need it (defaults to 'NONE').
+        """
+    )
+
+    server_info_path = Unicode(
+        config=True,
+        help="""
+        Path of a JSON snapshot of the root DSE and schema of the ldap
+        servers. The snapshot is loaded at startup and used for all
+        connections without reading server information again. If the file
+        does not exist, the information is read once from the first
+        reachable server and saved to it. Delete the file to refresh the
+        snapshot after a schema change. Profiles of 'domains' do not
+        inherit this path, set one in each profile to snapshot its servers
+        (defaults to None).
+        """
+    )
+
+    _server_info = None
+
     bind_user_dn = Unicode(
         allow_none=True,
         default_value=None,
@@ -165,7 +407,18 @@ class LDAPAuthenticator(Authenticator):
         have that value substituted with the username of the authenticating user.
         """
     )
-    
+
+    user_attribute = Unicode(
+        allow_none=True,
+        default_value=None,
+        config=True,
+        help="""
+        Attribute of user entries holding the username. Inferred from
+        'user_search_filter' when unset, e.g. 'uid' for '(uid={username})'
+        (defaults to None).
+        """
+    )
+
     filter_by_group = Bool(
         default_value=True,
         config=True,
@@ -220,348 +473,2112 @@ class LDAPAuthenticator(Authenticator):
         """
     )
 
-    username_pattern = Unicode(
+    server_side_group_filter = Bool(
+        default_value=False,
         config=True,
         help="""
-        Regular expression pattern that all valid usernames must match. If a
-        username does not match the pattern specified here, authentication will
-        not be attempted. If not set, allow any username (defaults to None).
+        If True, permitted groups are combined with user_search_filter so the
+        ldap server checks group membership during the user search and only
+        returns the user's dn. Avoids transferring the membership attribute of
+        users belonging to many groups (defaults to False).
         """
     )
 
-    username_regex = Any(
+    nested_groups_strategy = Unicode(
+        default_value='recursive',
+        config=True,
         help="""
-        Compiled regex kept in sync with `username_pattern`
+        Strategy used to resolve nested group membership when
+        'allow_nested_groups' is set to True (defaults to 'recursive').
+
+        recursive: Expand nested groups of allowed_groups with group searches
+            and compare them against the user's membership attribute.
+        in_chain: Let the server resolve nested membership during the user
+            search using the Active Directory LDAP_MATCHING_RULE_IN_CHAIN
+            matching rule. Authorization costs one search regardless of
+            nesting depth. Only supported by Active Directory.
         """
     )
 
-    @observe('username_pattern')
-    def _username_pattern_changed(self, change):
-        if not change['new']:
-            self.username_regex = None
-        self.username_regex = re.compile(change['new'])
-
-    create_user_home_dir = Bool(
-        default_value=False,
+    nested_groups_max_depth = Int(
+        default_value=0,
         config=True,
         help="""
-        If set to True, will attempt to create a user's home directory
-        locally if that directory does not exist already.
+        Maximum number of nesting levels below allowed_groups searched for
+        nested groups. Set to 0 for no limit (defaults to 0).
         """
     )
 
-    create_user_home_dir_cmd = Command(
+    group_search_batch_size = Int(
+        default_value=50,
         config=True,
         help="""
-        Command to create a users home directory.
+        Maximum number of groups combined into a single nested group search
+        filter. Lower this value if the ldap server rejects long search
+        filters (defaults to 50).
         """
     )
-    @default('create_user_home_dir_cmd')
-    def _default_create_user_home_dir_cmd(self):
-        if sys.platform == 'linux':
-            home_dir_cmd = ['mkhomedir_helper']
-        else:
-            self.log.debug("Not sure how to create a home directory on '%s' system", sys.platform)
-            home_dir_cmd = ['']
-        return home_dir_cmd
-
-    @gen.coroutine
-    def add_user(self, user):
-        username = user.name
-        user_exists = yield gen.maybe_future(self.user_home_dir_exists(username))
-        if not user_exists:
-            if self.create_user_home_dir:
-                yield gen.maybe_future(self.add_user_home_dir(username))
-            else:
-                raise KeyError("Domain user '%s' does not exists locally." % username)
-        yield gen.maybe_future(super().add_user(user))
 
-    def user_home_dir_exists(self, username):
+    user_cache_size = Int(
+        default_value=4096,
+        config=True,
+        help="""
+        Maximum number of user lookups (dn and group memberships) kept in the
+        user cache. Least recently used entries are evicted first
+        (defaults to 4096).
         """
-        Verify user home directory exists
+    )
+
+    user_cache_ttl = Int(
+        default_value=300,
+        config=True,
+        help="""
+        Number of seconds a successful user lookup is cached. Set to 0 to
+        disable caching (defaults to 300).
         """
-        user = pwd.getpwnam(username)
-        home_dir = user[5]
-        return bool(os.path.isdir(home_dir))
+    )
 
-    def add_user_home_dir(self, username):
+    user_cache_negative_ttl = Int(
+        default_value=30,
+        config=True,
+        help="""
+        Number of seconds a user lookup that found no user, or more than one
+        user, is cached. Set to 0 to disable negative caching (defaults to 30).
         """
-        Creates user home directory
+    )
+
+    cache_backend = Unicode(
+        default_value='memory',
+        config=True,
+        help="""
+        Storage of the user cache and nested group expansions (defaults to
+        'memory').
+
+        memory: Cache in the memory of the hub process.
+        sqlite: Cache in the SQLite database at 'cache_path', shared by all
+            hub processes on the host and kept across restarts. Lookups are
+            answered from memory and entries stored by other processes are
+            seen within a second.
         """
-        cmd = [arg.replace('USERNAME', username) for arg in self.create_user_home_dir_cmd] + [username]
-        self.log.info("Creating '%s' user home directory using command '%s'", username, ' '.join(map(pipes.quote, cmd)))
-        create_dir = Popen(cmd, stdout=PIPE, stderr=STDOUT)
-        create_dir.wait()
-        if create_dir.returncode:
-            err = create_dir.stdout.read().decode('utf8', 'replace')
-            raise RuntimeError("Failed to create system user %s: %s" % (username, err))
+    )
 
-    def normalize_username(self, username):
+    cache_path = Unicode(
+        default_value='jupyterhub_ldap_cache.sqlite',
+        config=True,
+        help="""
+        Path of the SQLite database used by the 'sqlite' cache_backend
+        (defaults to 'jupyterhub_ldap_cache.sqlite').
         """
-        Normalize username for ldap query
+    )
 
-        modifications:
-         - format to lowercase
-         - escape filter characters (ldap3)
+    user_cache = Any(
+        config=True,
+        help="""
+        Cache of user lookups, membership search results and nested group
+        expansions. Built from 'cache_backend' unless set to an object
+        implementing ldapauthenticator.cache.CacheBackend.
         """
-        username = username.lower()
-        username = escape_filter_chars(username)
-        return username
+    )
 
-    def validate_username(self, username):
+    @default('user_cache')
+    def _default_user_cache(self):
+        if self.cache_backend == 'sqlite':
+            return SQLiteCache(self.cache_path, maxsize=self.user_cache_size, ttl=self.user_cache_ttl)
+        return TTLCache(maxsize=self.user_cache_size, ttl=self.user_cache_ttl)
+
+    @staticmethod
+    def cache_key(plan, kind, name=''):
         """
-        Validate a normalized username
-        Return True if username is valid, False otherwise.
+        Return user cache key of `kind`, versioned by the plan fingerprint so
+        entries stored under different configuration are never reused
         """
-        if '/' in username:
-            # / is not allowed in usernames
-            return False
-        if not username:
-            # empty usernames are not allowed
-            return False
-        if not self.username_regex:
-            return True
-        return bool(self.username_regex.match(username))
+        return '{}:{}:{}'.format(plan.fingerprint, kind, name)
 
-    def validate_host(self, host):
+    def evict_user(self, username):
         """
-        Validate hostname
-        Return True if host is valid, False otherwise.
+        Remove normalized username from the user cache
         """
-        host_ip_regex = re.compile(r'^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$')
-        host_name_regex = re.compile(r'^((?!-)[a-z0-9\-]{1,63}(?<!-)\.){1,}((?!-)[a-z0-9\-]{1,63}(?<!-)){1}$')
-        host_url_regex = re.compile(r'^(ldaps?://)(((?!-)[a-z0-9\-]{1,63}(?<!-)\.){1,}((?!-)[a-z0-9\-]{1,63}(?<!-)){1}):([0-9]{3})$')
-        if bool(host_ip_regex.match(host)):
-            # using ipv4 address
-            valid = True
-        elif bool(host_name_regex.match(host)):
-            # using a hostname address
-            valid = True
-        elif bool(host_url_regex.match(host)):
-            # using host url address
-            valid = True
-        else:
-            # unsupported host format
-            valid = False
-        return valid
+        plan = self.auth_plan
+        self.user_cache.pop(self.cache_key(plan, 'user', username))
+        self.user_cache.pop(self.cache_key(plan, 'membership', username))
+        if self.domains:
+            for profile in self.domain_profiles:
+                profile.authenticator.evict_user(username)
 
-    def create_ldap_server_pool_obj(self, ldap_servers=None):
+    def get_handlers(self, app):
+        return super().get_handlers(app) + [
+            (r'/api/ldap/cache/users/([^/]+)', UserCacheAPIHandler),
+            (r'/api/ldap/traces', LoginTraceAPIHandler),
+        ]
+
+    executor_max_workers = Int(
+        default_value=10,
+        config=True,
+        help="""
+        Maximum number of threads used to run blocking ldap operations outside
+        of the JupyterHub event loop (defaults to 10).
         """
-        Create ldap3 ServerPool Object
+    )
+
+    executor_max_queue = Int(
+        default_value=0,
+        config=True,
+        help="""
+        Maximum number of ldap operations of logins permitted to wait for, or
+        run on, the ldap executor. Authentication attempts exceeding this limit
+        are rejected immediately. Background work, such as filling the service
+        pool at startup, authorization index syncs and background group
+        refreshes, is not counted. Set to 0 for no limit (defaults to 0).
         """
-        server_pool = ldap3.ServerPool(
-            ldap_servers,
-            pool_strategy=self.server_pool_strategy.upper(),
-            active=self.server_pool_active,
-            exhaust=self.server_pool_exhaust
-        )
-        return server_pool
+    )
 
-    def create_ldap_server_obj(self, host):
+    executor = Any(
+        help="""
+        Executor used to run blocking ldap operations
         """
-        Create ldap3 Server Object
+    )
+
+    @default('executor')
+    def _default_executor(self):
+        atexit.register(self.shutdown)
+        return ThreadPoolExecutor(max_workers=self.executor_max_workers)
+
+    _executor_pending = 0
+    # authenticator of 'domains' whose executor and queue limit are shared
+    _executor_owner = None
+
+    def run_ldap(self, func, *args, login=None, **kwargs):
         """
-        server = ldap3.Server(
-            host,
-            port=self.server_port,
-            use_ssl=self.server_use_ssl,
-            connect_timeout=self.server_connect_timeout
-        )
-        return server
+        Run blocking ldap call on the ldap executor and return a future.
+        Ldap operations of the call are attributed to the LoginRecord `login`,
+        and only calls made for a login count towards 'executor_max_queue'.
+        """
+        future = self.executor.submit(call_with_login, login, func, *args, **kwargs)
+        if login is not None:
+            owner = self._executor_owner or self
+            owner._executor_pending += 1
+            IOLoop.current().add_future(future, owner._executor_task_done)
+        return future
 
-    def ldap_connection(self, server_pool, username, password):
+    def _executor_task_done(self, future):
+        self._executor_pending -= 1
+
+    def executor_full(self):
         """
-        Create ldaps Connection Object
+        Return True if the ldap executor queue depth limit has been reached
         """
-        try:
-            conn = ldap3.Connection(
-                server_pool,
-                user=username,
-                password=password,
-                auto_bind=ldap3.AUTO_BIND_TLS_BEFORE_BIND,
-                read_only=True,
-                receive_timeout=self.server_receive_timeout)
-        except ldap3.core.exceptions.LDAPBindError as exc:
-            msg = '\n{exc_type}: {exc_msg}'.format(
-                exc_type=exc.__class__.__name__,
-                exc_msg=exc.args[0] if exc.args else '')
-            self.log.error("Failed to connect to ldap: %s", msg)
-            return None
-        return conn
+        owner = self._executor_owner or self
+        if not owner.executor_max_queue:
+            return False
+        return owner._executor_pending >= owner.executor_max_queue
 
-    def get_nested_groups(self, conn, group):
+    def shutdown(self, wait=True):
         """
-        Recursively search group for nested memberships
+        Release resources held by the authenticator
         """
-        nested_groups = list()
-        conn.search(
-            search_base=self.group_search_base,
-            search_filter=self.group_search_filter.format(group=group),
-            search_scope=ldap3.SUBTREE)
-        if conn.response:
-            for nested_group in conn.response:
-                nested_groups.extend([nested_group['dn']])
-                groups = self.get_nested_groups(conn, nested_group['dn'])
-                nested_groups.extend(groups)
-        nested_groups = list(set(nested_groups))
-        return nested_groups
+        if 'executor' in self._trait_values:
+            self.executor.shutdown(wait=wait)
+        if 'service_pool' in self._trait_values:
+            self.service_pool.close()
+        if 'async_engine' in self._trait_values:
+            self.async_engine.close()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=wait)
+        if self._home_dir_executor is not None:
+            self._home_dir_executor.shutdown(wait=wait)
+        if self._authorization_index_callback is not None:
+            self._authorization_index_callback.stop()
+        if 'standby_connections' in self._trait_values:
+            self.standby_connections.close()
+        if self._standby_callback is not None:
+            self._standby_callback.stop()
+        if 'domain_profiles' in self._trait_values:
+            for profile in self.domain_profiles:
+                profile.authenticator.shutdown(wait=wait)
+        if 'user_cache' in self._trait_values:
+            self.user_cache.close()
 
+    service_pool_min_size = Int(
+        default_value=1,
+        config=True,
+        help="""
+        Minimum number of connections bound as 'bind_user_dn' kept open for
+        ldap searches. They are opened at startup (defaults to 1).
+        """
+    )
 
-    @gen.coroutine
-    def authenticate(self, handler, data):
+    service_pool_max_size = Int(
+        default_value=10,
+        config=True,
+        help="""
+        Maximum number of connections bound as 'bind_user_dn' kept open for
+        ldap searches (defaults to 10).
+        """
+    )
 
-        # define vars
-        username = data['username']
-        password = data['password']
-        server_pool = self.create_ldap_server_pool_obj()
-        conn_servers = list()
+    service_pool_idle_timeout = Int(
+        default_value=300,
+        config=True,
+        help="""
+        Number of seconds a pooled connection may stay unused before it is
+        closed. Connections up to 'service_pool_min_size' are never closed for
+        being idle. Set to 0 to disable (defaults to 300).
+        """
+    )
 
-        # validate credentials
-        username = self.normalize_username(username)
-        if not self.validate_username(username):
-            self.log.error('Unsupported username supplied')
-            return None
-        if password is None or password.strip() == '':
-            self.log.error('Empty password supplied')
-            return None
+    service_pool_health_check_interval = Int(
+        default_value=60,
+        config=True,
+        help="""
+        Number of seconds a pooled connection may stay unused before it is
+        probed for liveness on its next use. Dead connections are replaced with
+        newly bound ones. Set to 0 to disable (defaults to 60).
+        """
+    )
 
-        # cast server_hosts to list
-        if isinstance(self.server_hosts, str):
-            self.server_hosts = self.server_hosts.split()
+    service_pool_acquire_timeout = Int(
+        allow_none=True,
+        default_value=None,
+        config=True,
+        help="""
+        Timeout in seconds to wait for a free pooled connection before
+        raising an exception (defaults to None).
+        """
+    )
 
-        # validate hosts and populate server_pool object
-        for host in self.server_hosts:
-            host = host.strip().lower()
-            if not self.validate_host(host):
-                self.log.warning("Host '%s' not supplied in approved format. Removing host from Server Pool", host)
-                break
-            server = self.create_ldap_server_obj(host)
-            server_pool.add(server)
-            conn_servers.extend([host])
+    service_pool = Any(
+        help="""
+        Pool of connections bound as 'bind_user_dn' used for ldap searches
+        """
+    )
 
-        # verify ldap connection object parameters are defined
-        if len(server_pool.servers) < 1:
-            self.log.error("No hosts provided. ldap connection requires at least 1 host to connect to.")
-            return None
-        if not self.bind_user_dn or self.bind_user_dn.strip() == '':
-            self.log.error("'bind_user_dn' config value undefined. requried for ldap connection")
-            return None
-        if not self.bind_user_password or self.bind_user_password.strip() == '':
-            self.log.error("'bind_user_password' config value undefined. requried for ldap connection")
-            return None
+    @default('service_pool')
+    def _default_service_pool(self):
+        return LDAPConnectionPool(
+            self.create_service_connection,
+            min_size=self.service_pool_min_size,
+            max_size=self.service_pool_max_size,
+            idle_timeout=self.service_pool_idle_timeout,
+            health_check_interval=self.service_pool_health_check_interval,
+            acquire_timeout=self.service_pool_acquire_timeout,
+            log=self.log)
 
-        # verify ldap search object parameters are defined
-        if not self.user_search_base or self.user_search_base.strip() == '':
-            self.log.error("'user_search_base' config value undefined. requried for ldap search")
-            return None
-        if not self.user_search_filter or self.user_search_filter.strip() == '':
-            self.log.error("'user_search_filter' config value undefined. requried for ldap search")
-            return None
+    @gen.coroutine
+    def prefill_service_pool(self):
+        """
+        Open 'service_pool_min_size' connections bound as 'bind_user_dn'
+        """
+        yield self.run_ldap(self.service_pool.prefill)
 
-        # open ldap connection and authenticate
-        self.log.debug("Attempting ldap connection to %s with user '%s'", conn_servers, self.bind_user_dn)
-        conn = self.ldap_connection(
-            server_pool,
-            self.bind_user_dn,
-            self.bind_user_password)
+    ldap_engine = Unicode(
+        default_value='thread',
+        config=True,
+        help="""
+        How ldap searches and binds of logins, nested group expansion and
+        batch user checks are run. 'thread' runs them on blocking connections
+        on the ldap executor, one operation per connection and thread at a
+        time. 'async' runs them from the event loop, pipelining any number of
+        outstanding operations over a few shared connections. Operations of
+        the 'async' engine time out after 'server_receive_timeout' seconds
+        (defaults to 'thread').
+        """
+    )
 
-        # proceed if connection has been established
-        if not conn or not conn.bind():
-            self.log.error(
-                "Could not establish ldap connection to %s using '%s' and supplied bind_user_password.",
-                conn_servers, self.bind_user_dn)
-            return None
+    ldap_engine_connections = Int(
+        default_value=2,
+        config=True,
+        help="""
+        Maximum number of connections bound as 'bind_user_dn' the 'async'
+        ldap_engine pipelines searches over (defaults to 2).
+        """
+    )
+
+    ldap_engine_bind_connections = Int(
+        default_value=4,
+        config=True,
+        help="""
+        Maximum number of connections the 'async' ldap_engine verifies user
+        passwords on. Binds on a connection run one at a time, so this limits
+        the number of concurrent password checks (defaults to 4).
+        """
+    )
+
+    async_engine = Any(
+        help="""
+        AsyncLDAPEngine used when ldap_engine is 'async'
+        """
+    )
+
+    @default('async_engine')
+    def _default_async_engine(self):
+        return AsyncLDAPEngine(
+            self.create_engine_service_connection,
+            self.open_engine_connection,
+            self.executor,
+            self.server_operation,
+            connections=self.ldap_engine_connections,
+            bind_connections=self.ldap_engine_bind_connections,
+            timeout=self.server_receive_timeout,
+            log=self.log)
+
+    pipeline_user_bind = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        Verify the user's password at the same time as searching for the
+        user and checking its group memberships, when the user's dn is known
+        from the user cache or 'user_dn_template'. Logins then take about as
+        long as the slower of the two instead of their sum. Denied logins
+        report the same reason as without pipelining, but the password is
+        also checked for users who turn out not to be permitted
+        (defaults to False).
+        """
+    )
+
+    user_dn_template = Unicode(
+        config=True,
+        help="""
+        Template of user dns used by 'pipeline_user_bind' for users not in the
+        user cache, e.g. 'uid={username},ou=people,dc=example,dc=com'. The
+        escaped username is substituted for '{username}'. If the dn found by
+        the user search differs, the password is verified again against the
+        found dn (defaults to None).
+        """
+    )
+
+    login_concurrency_limit = Int(
+        default_value=10,
+        config=True,
+        help="""
+        Maximum number of logins authenticated against ldap at the same time.
+        Further logins wait in a queue. Set to 0 for no limit (defaults to 10).
+        """
+    )
+
+    login_queue_limit = Int(
+        default_value=100,
+        config=True,
+        help="""
+        Maximum number of logins waiting for a free slot once
+        'login_concurrency_limit' is reached. Further logins are rejected
+        immediately. Set to 0 for no limit (defaults to 100).
+        """
+    )
+
+    login_queue_timeout = Int(
+        default_value=30,
+        config=True,
+        help="""
+        Timeout in seconds a login may wait in the queue before it is
+        rejected. Set to 0 to wait indefinitely (defaults to 30).
+        """
+    )
+
+    login_throttle_window = Int(
+        default_value=60,
+        config=True,
+        help="""
+        Number of seconds over which the login throttle limits attempts and
+        failed logins per username and per client ip. The throttle is off
+        unless one of the 'login_throttle_*_attempts' or
+        'login_throttle_*_failures' limits is set (defaults to 60).
+        """
+    )
+
+    login_throttle_username_attempts = Int(
+        default_value=0,
+        config=True,
+        help="""
+        Maximum number of login attempts per username within
+        'login_throttle_window' seconds. Further attempts are rejected
+        without contacting ldap. Set to 0 for no limit (defaults to 0).
+        """
+    )
+
+    login_throttle_username_failures = Int(
+        default_value=0,
+        config=True,
+        help="""
+        Maximum number of failed logins per username within
+        'login_throttle_window' seconds. Further attempts are rejected
+        without contacting ldap, sparing the account from being locked out
+        by the ldap server. The limit refills gradually, allowing another
+        attempt every 'login_throttle_window' / limit seconds. A successful
+        login resets the count. Set to 0 for no limit (defaults to 0).
+        """
+    )
+
+    login_throttle_ip_attempts = Int(
+        default_value=0,
+        config=True,
+        help="""
+        Maximum number of login attempts per client ip within
+        'login_throttle_window' seconds. Users sharing a NAT or proxy share
+        this limit. The client ip is taken from the X-Forwarded-For header,
+        so proxies in front of configurable-http-proxy have to be listed in
+        'JupyterHub.trusted_downstream_ips'. Set to 0 for no limit (defaults
+        to 0).
+        """
+    )
+
+    login_throttle_ip_failures = Int(
+        default_value=0,
+        config=True,
+        help="""
+        Maximum number of failed logins per client ip within
+        'login_throttle_window' seconds. The limit refills gradually like
+        'login_throttle_username_failures', but successful logins from the
+        client ip do not reset the count. Like 'login_throttle_ip_attempts'
+        it relies on the client ip taken from the X-Forwarded-For header. Set
+        to 0 for no limit (defaults to 0).
+        """
+    )
+
+    login_throttle_maxsize = Int(
+        default_value=10000,
+        config=True,
+        help="""
+        Maximum number of usernames and of client ips tracked by the login
+        throttle. The least recently seen are forgotten first (defaults to
+        10000).
+        """
+    )
+
+    username_throttle = Any(
+        help="""
+        Login throttle keyed by username
+        """
+    )
+
+    @default('username_throttle')
+    def _default_username_throttle(self):
+        return LoginThrottle(
+            self.login_throttle_username_attempts,
+            self.login_throttle_username_failures,
+            self.login_throttle_window,
+            maxsize=self.login_throttle_maxsize)
+
+    ip_throttle = Any(
+        help="""
+        Login throttle keyed by client ip
+        """
+    )
+
+    @default('ip_throttle')
+    def _default_ip_throttle(self):
+        return LoginThrottle(
+            self.login_throttle_ip_attempts,
+            self.login_throttle_ip_failures,
+            self.login_throttle_window,
+            maxsize=self.login_throttle_maxsize)
+
+    authorization_index_enabled = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        Keep an in-memory index of all members of 'allowed_groups', built at
+        startup and kept current by polling for modified entries. Indexed
+        users only need their password verified at login. Users not in the
+        index are looked up in ldap as usual (defaults to False).
+        """
+    )
+
+    authorization_index_sync_interval = Int(
+        default_value=60,
+        config=True,
+        help="""
+        Number of seconds between polls for users and groups modified since
+        the last sync of the authorization index (defaults to 60).
+        """
+    )
+
+    authorization_index_rebuild_interval = Int(
+        default_value=3600,
+        config=True,
+        help="""
+        Number of seconds after which the authorization index is rebuilt from
+        scratch. Deleted users are only removed from the index by a rebuild
+        (defaults to 3600).
+        """
+    )
+
+    authorization_index_path = Unicode(
+        allow_none=True,
+        default_value=None,
+        config=True,
+        help="""
+        File the authorization index is saved to after every change and loaded
+        from at startup, so a restart only needs an incremental sync
+        (defaults to None).
+        """
+    )
+
+    authorization_index_page_size = Int(
+        default_value=1000,
+        config=True,
+        help="""
+        Number of entries requested per page while building and syncing the
+        authorization index and while checking users in batches
+        (defaults to 1000).
+        """
+    )
+
+    authorized_users_batch_size = Int(
+        default_value=100,
+        config=True,
+        help="""
+        Maximum number of usernames combined into a single user search when
+        checking many users at once (defaults to 100).
+        """
+    )
+
+    login_trace_sample_rate = Float(
+        default_value=0.0,
+        config=True,
+        help="""
+        Fraction of logins and user home directory provisionings traced,
+        recording the timeline of their phases, ldap operations and
+        subprocess calls. Tracing is opt-in, set to 1 to trace every login
+        (defaults to 0).
+        """
+    )
+
+    login_trace_threshold = Float(
+        default_value=5.0,
+        config=True,
+        help="""
+        Minimum number of seconds a traced login or provisioning has to take
+        to be kept for the admin API at /hub/api/ldap/traces. Set to 0 to
+        keep all traces (defaults to 5.0).
+        """
+    )
+
+    login_trace_buffer_size = Int(
+        default_value=100,
+        config=True,
+        help="""
+        Maximum number of traces kept in memory. The oldest traces are
+        dropped first (defaults to 100).
+        """
+    )
+
+    login_traces = Any(
+        help="""
+        TraceBuffer of slow traced logins and provisionings
+        """
+    )
+
+    @default('login_traces')
+    def _default_login_traces(self):
+        return TraceBuffer(self.login_trace_buffer_size)
+
+    def start_trace(self, kind, username):
+        """
+        Return a new Trace, or None if it is sampled out
+        """
+        rate = self.login_trace_sample_rate
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return None
+        return Trace(kind, username)
+
+    def finish_trace(self, login):
+        """
+        Keep the trace of login if it took at least 'login_trace_threshold'
+        seconds
+        """
+        trace = login.trace
+        if trace is None:
+            return
+        trace.finish(login.result, login.operations)
+        if trace.duration >= self.login_trace_threshold:
+            self.login_traces.add(trace)
+
+    _authorization_index = None
+    _authorization_index_sync = None
+    _authorization_index_callback = None
+    _standby_callback = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.ldap_engine == 'thread' and self.service_pool_min_size > 0:
+            # open the first pooled connections as soon as the hub's event loop runs
+            IOLoop.current().add_callback(self.prefill_service_pool)
+        if self.authorization_index_enabled:
+            # build the index as soon as the hub's event loop runs
+            IOLoop.current().add_callback(self.start_authorization_index)
+        if self.server_standby_connections:
+            IOLoop.current().add_callback(self.start_standby_connections)
+        if self.server_info_path:
+            IOLoop.current().add_callback(self.load_server_info)
+
+    _login_semaphore = None
+    _logins_active = 0
+    _logins_waiting = 0
+    _login_futures = None
+    _login_secret = None
+
+    username_pattern = Unicode(
+        config=True,
+        help="""
+        Regular expression pattern that all valid usernames must match. If a
+        username does not match the pattern specified here, authentication will
+        not be attempted. If not set, allow any username (defaults to None).
+        """
+    )
+
+    username_regex = Any(
+        help="""
+        Compiled regex kept in sync with `username_pattern`
+        """
+    )
+
+    @observe('username_pattern')
+    def _username_pattern_changed(self, change):
+        if not change['new']:
+            self.username_regex = None
+        self.username_regex = re.compile(change['new'])
+
+    def normalize_username(self, username):
+        """
+        Normalize username for ldap query
+
+        modifications:
+         - format to lowercase
+         - escape filter characters (ldap3)
+        """
+        username = username.lower()
+        username = escape_filter_chars(username)
+        return username
+
+    def validate_username(self, username):
+        """
+        Validate a normalized username
+        Return True if username is valid, False otherwise.
+        """
+        if '/' in username:
+            # / is not allowed in usernames
+            return False
+        if not username:
+            # empty usernames are not allowed
+            return False
+        if not self.username_regex:
+            return True
+        return bool(self.username_regex.match(username))
+
+    def validate_host(self, host):
+        """
+        Validate hostname
+        Return True if host is valid, False otherwise.
+        """
+        if bool(HOST_IP_REGEX.match(host)):
+            # using ipv4 address
+            valid = True
+        elif bool(HOST_NAME_REGEX.match(host)):
+            # using a hostname address
+            valid = True
+        elif bool(HOST_URL_REGEX.match(host)):
+            # using host url address
+            valid = True
         else:
-            self.log.debug(
-                "Successfully established connection to %s with user '%s'",
-                conn_servers, self.bind_user_dn)
+            # unsupported host format
+            valid = False
+        return valid
+
+    def get_server_hosts(self):
+        """
+        Return list of validated ldap server hosts
+        """
+        server_hosts = self.server_hosts
+        if isinstance(server_hosts, str):
+            server_hosts = server_hosts.split()
+
+        hosts = list()
+        for host in server_hosts:
+            host = host.strip().lower()
+            if not self.validate_host(host):
+                self.log.warning("Host '%s' not supplied in approved format. Removing host from Server Pool", host)
+                continue
+            hosts.append(host)
+        return hosts
+
+    def create_ldap_server_pool_obj(self, ldap_servers=None):
+        """
+        Create ldap3 ServerPool Object
+        """
+        pool_strategy = self.server_pool_strategy.upper()
+        server_pool = ldap3.ServerPool(
+            ldap_servers,
+            # servers are ordered by ldap_connection when choosing the fastest
+            pool_strategy=ldap3.FIRST if pool_strategy == 'FASTEST' else pool_strategy,
+            active=self.server_pool_active,
+            exhaust=self.server_pool_exhaust
+        )
+        return server_pool
+
+    def create_ldap_server_obj(self, host):
+        """
+        Create ldap3 Server Object
+        """
+        server = ldap3.Server(
+            host,
+            port=self.server_port,
+            use_ssl=self.server_use_ssl,
+            connect_timeout=self.server_connect_timeout,
+            tls=ResumingTls() if self.server_tls_session_reuse else None,
+            get_info=getattr(ldap3, self.server_get_info.upper(), ldap3.NONE)
+        )
+        if self._server_info is not None:
+            server.attach_dsa_info(self._server_info[0])
+            server.attach_schema_info(self._server_info[1])
+        return server
+
+    def build_auth_plan(self):
+        """
+        Compile configuration into an AuthPlan
+        """
+        error = None
+        server_hosts = self.get_server_hosts()
+        allowed_groups = self.allowed_groups
+        if isinstance(allowed_groups, str):
+            allowed_groups = [allowed_groups] if allowed_groups.strip() else []
+
+        # verify ldap connection object parameters are defined
+        if len(server_hosts) < 1:
+            error = "No hosts provided. ldap connection requires at least 1 host to connect to."
+        elif not self.bind_user_dn or self.bind_user_dn.strip() == '':
+            error = "'bind_user_dn' config value undefined. requried for ldap connection"
+        elif not self.bind_user_password or self.bind_user_password.strip() == '':
+            error = "'bind_user_password' config value undefined. requried for ldap connection"
+
+        # verify ldap search object parameters are defined
+        elif not self.user_search_base or self.user_search_base.strip() == '':
+            error = "'user_search_base' config value undefined. requried for ldap search"
+        elif not self.user_search_filter or self.user_search_filter.strip() == '':
+            error = "'user_search_filter' config value undefined. requried for ldap search"
+        elif not self.filter_template_valid(self.user_search_filter, 'username'):
+            error = "'user_search_filter' config value may only contain the '{username}' substitution key"
+        elif not self.filter_template_valid(self.group_search_filter, 'group'):
+            error = "'group_search_filter' config value may only contain the '{group}' substitution key"
+        elif self.server_get_info.upper() not in SERVER_GET_INFO:
+            error = "'server_get_info' config value must be one of {}".format(', '.join(SERVER_GET_INFO))
+        elif self.user_dn_template and not self.filter_template_valid(self.user_dn_template, 'username'):
+            error = "'user_dn_template' config value may only contain the '{username}' substitution key"
+        elif self.nested_groups_strategy not in NESTED_GROUPS_STRATEGIES:
+            error = "'nested_groups_strategy' config value must be one of {}".format(
+                ', '.join(NESTED_GROUPS_STRATEGIES))
+        elif self.ldap_engine not in LDAP_ENGINES:
+            error = "'ldap_engine' config value must be one of {}".format(', '.join(LDAP_ENGINES))
+
+        user_attribute = self.user_attribute
+        if not user_attribute:
+            match = USER_ATTRIBUTE_REGEX.search(self.user_search_filter or '')
+            user_attribute = match.group(1) if match else None
+
+        plan = AuthPlan(
+            error=error,
+            server_hosts=tuple(server_hosts),
+            server_pool=self.create_ldap_server_pool_obj(
+                [self.create_ldap_server_obj(host) for host in server_hosts]),
+            server_pool_strategy=self.server_pool_strategy.upper(),
+            user_search_base=self.user_search_base,
+            user_search_filter=self.user_search_filter,
+            user_membership_attribute=self.user_membership_attribute,
+            group_search_base=self.group_search_base,
+            group_search_filter=self.group_search_filter,
+            allowed_groups=tuple(allowed_groups),
+            permitted_groups=frozenset(allowed_groups),
+            nested_groups_strategy=self.nested_groups_strategy,
+            filter_by_group=self.filter_by_group,
+            allow_nested_groups=self.allow_nested_groups,
+            nested_groups_max_depth=self.nested_groups_max_depth,
+            server_side_group_filter=self.server_side_group_filter,
+            user_attribute=user_attribute,
+            user_dn_template=self.user_dn_template,
+            fingerprint=None,
+        )
+        return plan._replace(fingerprint=self.plan_fingerprint(plan))
+
+    @staticmethod
+    def plan_fingerprint(plan):
+        """
+        Return short hash of the plan settings that determine search results
+        and authorization decisions
+        """
+        settings = json.dumps([
+            plan.server_hosts, plan.user_search_base, plan.user_search_filter,
+            plan.user_membership_attribute, plan.group_search_base,
+            plan.group_search_filter, plan.allowed_groups,
+            plan.nested_groups_strategy, plan.filter_by_group,
+            plan.allow_nested_groups, plan.nested_groups_max_depth,
+            plan.server_side_group_filter, plan.user_attribute])
+        return hashlib.sha256(settings.encode('utf8')).hexdigest()[:16]
+
+    @staticmethod
+    def filter_template_valid(template, key):
+        """
+        Return True if search filter template only substitutes `key`
+        """
+        try:
+            fields = [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+        except ValueError:
+            return False
+        return all(field == key for field in fields)
+
+    auth_plan = Any(
+        help="""
+        AuthPlan compiled from configuration, rebuilt when configuration changes
+        """
+    )
+
+    @default('auth_plan')
+    def _default_auth_plan(self):
+        return self.build_auth_plan()
+
+    @observe(*AUTH_PLAN_TRAITS, *SERVER_SELECTOR_TRAITS)
+    def _auth_plan_config_changed(self, change):
+        if change.name in SERVER_SELECTOR_TRAITS:
+            if 'server_selector' in self._trait_values:
+                self.server_selector = self._default_server_selector()
+            return
+        if 'auth_plan' not in self._trait_values:
+            return
+        self.auth_plan = self.build_auth_plan()
+        if 'service_pool' in self._trait_values:
+            self.service_pool.clear()
+        if 'async_engine' in self._trait_values:
+            self.async_engine.clear()
+        if 'standby_connections' in self._trait_values:
+            self.standby_connections.clear()
+            if self._standby_callback is not None:
+                self.standby_connections.fill(self.auth_plan.server_pool.servers)
+
+    def ldap_connection(self, server_pool, username, password):
+        """
+        Create ldaps Connection Object
+        """
+        if self.auth_plan.server_pool_strategy == 'FASTEST':
+            return self.fastest_server_connection(server_pool.servers, username, password)
+        conn = ldap3.Connection(
+            server_pool,
+            user=username,
+            password=password,
+            read_only=True,
+            auto_range=False,
+            receive_timeout=self.server_receive_timeout)
+        # bind as AUTO_BIND_TLS_BEFORE_BIND would, keeping conn to record the
+        # server the pool picked
+        start = time.monotonic()
+        try:
+            conn.open(read_server_info=False)
+            if not conn.start_tls(read_server_info=False):
+                raise ldap3.core.exceptions.LDAPStartTLSError(
+                    'automatic start_tls befored bind not successful - {}'.format(conn.last_error))
+            bound = conn.bind(read_server_info=True)
+        except ldap3.core.exceptions.LDAPException:
+            record_operation(self.server_label(conn), 'bind', time.monotonic() - start, failed=True)
+            conn.unbind()
+            raise
+        # a rejected password is a working server, not a server error
+        record_operation(self.server_label(conn), 'bind', time.monotonic() - start)
+        if not bound:
+            self.log.error(
+                "Failed to connect to ldap: %s",
+                '\nLDAPBindError: automatic bind not successful - ' + (conn.last_error or ''))
+            conn.unbind()
+            return None
+        self.save_tls_session(conn)
+        return conn
+
+    @staticmethod
+    def save_tls_session(conn):
+        """
+        Keep the TLS session of a bound connection for resumption
+        """
+        tls = getattr(conn.server, 'tls', None)
+        if isinstance(tls, ResumingTls):
+            tls.save_session(conn)
+
+    @staticmethod
+    def server_label(conn):
+        """
+        Return host of the server conn is connected to
+        """
+        return getattr(conn.server, 'host', None) or 'unknown'
+
+    @contextmanager
+    def server_operation(self, conn, operation, login=None, search=None):
+        """
+        Record duration and failure of an ldap operation on conn. Searches
+        pass their Connection.search keyword arguments as `search` for login
+        traces.
+        """
+        host = self.server_label(conn)
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as exc:
+            duration = time.monotonic() - start
+            record_operation(host, operation, duration, failed=True, login=login, search=search)
+            if isinstance(exc, SERVER_FAILURES):
+                self.server_selector.record(host, duration, failed=True, operation=True)
+            raise
+        duration = time.monotonic() - start
+        size = len(conn.response) if search is not None and isinstance(conn.response, list) else None
+        record_operation(host, operation, duration, login=login, search=search, size=size)
+        self.server_selector.record(host, duration, operation=True)
+
+    _hedge_executor = None
+
+    def fastest_server_connection(self, servers, username, password):
+        """
+        Connect to the fastest available server and bind as username.
+        Return None if the server rejects the credentials.
+        """
+        selector = self.server_selector
+        for server in selector.due_probes(servers):
+            self.submit_connect(self.probe_server, server)
+        conn = self.open_fastest_connection(selector.ordered(servers), username, password)
+        try:
+            with self.server_operation(conn, 'bind'):
+                bound = conn.bind(read_server_info=True)
+        except ldap3.core.exceptions.LDAPException:
+            conn.unbind()
+            raise
+        if not bound:
+            self.log.error("Failed to connect to ldap: %s", '\nLDAPBindError: ' + (conn.last_error or ''))
+            conn.unbind()
+            return None
+        self.save_tls_session(conn)
+        return conn
+
+    def open_fastest_connection(self, servers, username, password):
+        """
+        Open an unbound connection to the first server of servers that
+        accepts it. With 'server_hedge_delay' set, the next server is tried
+        in parallel when a server has not connected within that delay.
+        """
+        last_exc = ldap3.core.exceptions.LDAPSocketOpenError('no ldap server available')
+        servers = list(servers)
+        if not self.server_hedge_delay or len(servers) < 2:
+            for server in servers:
+                try:
+                    return self.open_server_connection(server, username, password)
+                except ldap3.core.exceptions.LDAPException as exc:
+                    last_exc = exc
+            raise last_exc
+
+        pending = set()
+        while pending or servers:
+            if servers and len(pending) < 2:
+                pending.add(self.submit_connect(
+                    self.open_server_connection, servers.pop(0), username, password, login=current_login()))
+            done, pending = wait(
+                pending,
+                timeout=self.server_hedge_delay if servers else None,
+                return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    conn = future.result()
+                except ldap3.core.exceptions.LDAPException as exc:
+                    last_exc = exc
+                    continue
+                for loser in pending:
+                    loser.add_done_callback(self._discard_connection)
+                return conn
+        raise last_exc
+
+    def submit_connect(self, func, *args, login=None):
+        """
+        Run func on the executor reserved for server connects and probes.
+        Ldap operations of the call are attributed to the LoginRecord
+        `login`, so only pass it for connects the login waits for.
+        """
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=max(self.executor_max_workers, 2))
+        return self._hedge_executor.submit(call_with_login, login, func, *args)
+
+    @staticmethod
+    def _discard_connection(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().unbind()
+
+    def open_server_connection(self, server, username, password, probe=False):
+        """
+        Open connection to server and start TLS without binding. Pass `probe`
+        if the connect is the circuit probe of server.
+        """
+        conn = ldap3.Connection(
+            server,
+            user=username,
+            password=password,
+            read_only=True,
+            auto_range=False,
+            receive_timeout=self.server_receive_timeout)
+        start = time.monotonic()
+        try:
+            conn.open(read_server_info=False)
+            if not conn.start_tls(read_server_info=False):
+                raise ldap3.core.exceptions.LDAPStartTLSError(
+                    'automatic start_tls befored bind not successful - {}'.format(conn.last_error))
+        except ldap3.core.exceptions.LDAPException as exc:
+            duration = time.monotonic() - start
+            record_operation(server.host, 'connect', duration, failed=True)
+            self.server_selector.record(server.host, duration, failed=True, probe=probe)
+            self.log.warning("Failed to connect to ldap server '%s': %s: %s", server.host, exc.__class__.__name__, exc)
+            conn.unbind()
+            raise
+        duration = time.monotonic() - start
+        record_operation(server.host, 'connect', duration)
+        self.server_selector.record(server.host, duration, probe=probe)
+        return conn
+
+    def probe_server(self, server):
+        """
+        Probe a server skipped after repeated failures
+        """
+        try:
+            conn = self.open_server_connection(server, None, None, probe=True)
+        except ldap3.core.exceptions.LDAPException:
+            return
+        conn.unbind()
+        self.log.info("ldap server '%s' is reachable again", server.host)
+
+    def create_service_connection(self):
+        """
+        Create ldap Connection Object bound as 'bind_user_dn'
+        """
+        with PHASE_DURATION_SECONDS.labels(phase='service_bind').time():
+            return self.ldap_connection(self.auth_plan.server_pool, self.bind_user_dn, self.bind_user_password)
+
+    def open_engine_connection(self, username=None, password=None):
+        """
+        Open connection for the async engine and bind as username, or leave
+        it unbound for user binds if username is None. With the 'FASTEST'
+        server_pool_strategy servers are tried in the order of the server
+        selector, moving on to the next server on server failures.
+        """
+        plan = self.auth_plan
+        if plan.server_pool_strategy != 'FASTEST':
+            return self.open_engine_server_connection(plan.server_pool, username, password)
+        selector = self.server_selector
+        for server in selector.due_probes(plan.server_pool.servers):
+            self.submit_connect(self.probe_server, server)
+        last_exc = ldap3.core.exceptions.LDAPSocketOpenError('no ldap server available')
+        for server in selector.ordered(plan.server_pool.servers):
+            try:
+                return self.open_engine_server_connection(server, username, password, selector)
+            except SERVER_FAILURES as exc:
+                last_exc = exc
+        raise last_exc
+
+    def open_engine_server_connection(self, server, username, password, selector=None):
+        """
+        Open connection for the async engine to server, a Server or
+        ServerPool, and bind as username unless it is None. Connects to a
+        single server are recorded with `selector` if given.
+        """
+        conn = engine_connection(
+            server,
+            user=username,
+            password=password,
+            read_only=True,
+            auto_range=False)
+        start = time.monotonic()
+        try:
+            conn.open(read_server_info=False)
+            if not conn.start_tls(read_server_info=False):
+                raise ldap3.core.exceptions.LDAPStartTLSError(
+                    'automatic start_tls befored bind not successful - {}'.format(conn.last_error))
+            connected = time.monotonic()
+            if username is not None and not conn.bind(read_server_info=True):
+                raise ldap3.core.exceptions.LDAPBindError(
+                    'automatic bind not successful - {}'.format(conn.last_error))
+        except ldap3.core.exceptions.LDAPException as exc:
+            duration = time.monotonic() - start
+            record_operation(self.server_label(conn), 'connect', duration, failed=True)
+            if selector is not None and isinstance(exc, SERVER_FAILURES):
+                selector.record(server.host, duration, failed=True)
+            conn.unbind()
+            raise
+        record_operation(self.server_label(conn), 'connect', time.monotonic() - start)
+        if selector is not None:
+            selector.record(server.host, connected - start)
+        if username is not None:
+            self.save_tls_session(conn)
+        return conn
+
+    def create_engine_service_connection(self):
+        """
+        Open connection for the async engine bound as 'bind_user_dn'
+        """
+        with PHASE_DURATION_SECONDS.labels(phase='service_bind').time():
+            return self.open_engine_connection(self.bind_user_dn, self.bind_user_password)
+
+    def run_search_steps(self, conn, steps, *args):
+        """
+        Run the searches of the steps generator steps(*args) on conn and
+        return its result.
+
+        Step generators hold the search logic shared by both ldap engines.
+        They yield keyword arguments of Connection.search and are sent the
+        (response, result) of each search.
+        """
+        searches = steps(*args)
+        try:
+            search = next(searches)
+            while True:
+                with self.server_operation(conn, 'search', search=search):
+                    conn.search(**search)
+                search = searches.send((conn.response or [], conn.result or {}))
+        except StopIteration as stop:
+            return stop.value
+
+    def run_searches(self, steps, *args, login=None):
+        """
+        Run the searches of the steps generator steps(*args) with connections
+        bound as 'bind_user_dn' on the configured ldap_engine and return a
+        future of its result
+        """
+        if self.ldap_engine == 'async':
+            return self.async_engine.run(steps(*args), login=login)
+        return self.run_ldap(self.service_pool.run, self.run_search_steps, steps, *args, login=login)
+
+    def lookup_user(self, conn, plan, user_search_filter):
+        """
+        Search for user entries matching user_search_filter
+        """
+        return self.run_search_steps(conn, self.lookup_user_steps, plan, user_search_filter)
 
-            # compile list of permitted groups
-            permitted_groups = copy.deepcopy(self.allowed_groups)
-            if self.allow_nested_groups:
-                for group in self.allowed_groups:
-                    nested_groups = self.get_nested_groups(conn, group)
-                permitted_groups.extend(nested_groups)
-
-            # format user search filter
-            auth_user_search_filter = self.user_search_filter.format(
-                username=username)
-
-            # search for authenticating user in ldap
-            self.log.debug("Attempting LDAP search using search_filter '%s'.", auth_user_search_filter)
-            conn.search(
-                search_base=self.user_search_base,
-                search_filter=auth_user_search_filter,
-                search_scope=ldap3.SUBTREE,
-                attributes=self.user_membership_attribute,
-                paged_size=2)
-
-            # handle abnormal search results
-            if not conn.response or 'attributes' not in conn.response[0].keys():
-                self.log.error(
-                    "LDAP search '%s' found %i result(s).",
-                    auth_user_search_filter, len(conn.response))
-                return None
-            elif len(conn.response) > 1:
-                self.log.error(
-                    "LDAP search '%s' found %i result(s). Please narrow search to 1 result.",
-                    auth_user_search_filter, len(conn.response))
-                return None
+    def lookup_user_steps(self, plan, user_search_filter):
+        """
+        Search steps of lookup_user
+        """
+        response, _ = yield dict(
+            search_base=plan.user_search_base,
+            search_filter=user_search_filter,
+            search_scope=ldap3.SUBTREE,
+            attributes=plan.user_membership_attribute,
+            paged_size=2)
+        return tuple(entry for entry in response if entry.get('type') == 'searchResEntry')
+
+    def lookup_user_dn_steps(self, plan, user_search_filter):
+        """
+        Search steps of lookup_user reading no attributes, only the dn
+        """
+        response, _ = yield dict(
+            search_base=plan.user_search_base,
+            search_filter=user_search_filter,
+            search_scope=ldap3.SUBTREE,
+            attributes=ldap3.NO_ATTRIBUTES,
+            paged_size=2)
+        return tuple(entry for entry in response if entry.get('type') == 'searchResEntry')
+
+    @staticmethod
+    def format_user_search_filter(plan, username, login=None):
+        """
+        Return user search filter of username. Traces of login record the
+        filter template instead.
+        """
+        user_search_filter = plan.user_search_filter.format(username=username)
+        if login is not None and login.trace is not None:
+            login.trace.template(user_search_filter, plan.user_search_filter)
+        return user_search_filter
+
+    @gen.coroutine
+    def search_user(self, plan, username, user_search_filter, login=None):
+        """
+        Search for user entries and store the result in the user cache
+        """
+        response = yield self.run_searches(self.lookup_user_steps, plan, user_search_filter, login=login)
+        self.cache_user_response(plan, username, response)
+        return response
+
+    def cache_user_response(self, plan, username, response):
+        """
+        Store the user search response of username in the user cache
+        """
+        if plan is self.auth_plan:
+            ttl = self.user_cache_ttl if len(response) == 1 else self.user_cache_negative_ttl
+            self.user_cache.set(self.cache_key(plan, 'user', username), response, ttl=ttl)
+
+    def verify_user_credentials(self, plan, user_dn, password):
+        """
+        Bind as authenticating user on a dedicated short-lived connection,
+        taken from the standby connections if one is ready.
+        Return True if the supplied password is valid, False otherwise.
+        """
+        conn = self.take_standby_connection(plan)
+        if conn is not None:
+            conn.user = user_dn
+            conn.password = password
+            conn.authentication = ldap3.SIMPLE
+            try:
+                with self.server_operation(conn, 'bind'):
+                    bound = conn.bind(read_server_info=False)
+            except ldap3.core.exceptions.LDAPCommunicationError as exc:
+                self.log.debug("Standby connection to '%s' failed: %s", self.server_label(conn), exc)
             else:
-                self.log.debug("LDAP search '%s' found %i result(s).", auth_user_search_filter, len(conn.response))
-
-                # copy response to var
-                search_response = copy.deepcopy(conn.response[0])
-
-                # get authenticating user's ldap attributes
-                if not search_response['dn'] or search_response['dn'].strip == '':
-                    self.log.error(
-                        "Search results for user '%s' returned 'dn' attribute with undefined or null value.",
-                        username)
-                    conn.unbind()
-                    return None
-                else:
-                    self.log.debug(
-                        "Search results for user '%s' returned 'dn' attribute as '%s'",
-                        username, search_response['dn'])
-                    auth_user_dn = search_response['dn']
-                if not search_response['attributes'][self.user_membership_attribute]:
-                    self.log.error(
-                        "Search results for user '%s' returned '%s' attribute with undefned or null value.",
-                        username, self.user_membership_attribute)
-                    conn.unbind()
-                    return None
+                if bound:
+                    self.save_tls_session(conn)
                 else:
-                    self.log.debug(
-                        "Search results for user '%s' returned '%s' attribute as %s",
-                        username, self.user_membership_attribute,
-                        search_response['attributes'][self.user_membership_attribute])
-                    auth_user_memberships = search_response['attributes'][self.user_membership_attribute]
-
-                # is authenticating user a member of permitted_groups
-                allowed_memberships = list(set(auth_user_memberships).intersection(permitted_groups))
-                if bool(allowed_memberships) or not self.filter_by_group:
-                    self.log.debug(
-                        "User '%s' found in the following allowed ldap groups %s. Proceeding with authentication.",
-                        username, allowed_memberships)
-
-                    # rebind ldap connection with authenticating user, gather results, and close connection
-                    conn.rebind(
-                        user=auth_user_dn,
-                        password=password)
-                    auth_bound = copy.deepcopy(conn.bind())
-                    conn.unbind()
-                    if not auth_bound:
-                        self.log.error(
-                            "Could not establish ldap connection to %s using '%s' and supplied bind_user_password.",
-                            conn_servers, self.bind_user_dn)
-                        auth_response = None
+                    self.log.error("Failed to connect to ldap: %s", '\nLDAPBindError: ' + (conn.last_error or ''))
+                return bound
+            finally:
+                conn.unbind()
+        conn = self.ldap_connection(plan.server_pool, user_dn, password)
+        if not conn:
+            return False
+        conn.unbind()
+        return True
+
+    @gen.coroutine
+    def load_server_info(self):
+        """
+        Load the server information snapshot from 'server_info_path',
+        reading and saving it first if there is none, and attach it to the
+        ldap3 Server objects
+        """
+        path = self.server_info_path
+        if self.auth_plan.error:
+            return
+        try:
+            info = yield self.run_ldap(self.read_server_info_snapshot, path)
+        except (OSError, ValueError, KeyError, TypeError, ldap3.core.exceptions.LDAPException) as exc:
+            self.log.warning("Failed to load ldap server information from '%s': %s", path, exc)
+            info = None
+        if info is None:
+            try:
+                info = yield self.run_ldap(self.download_server_info, self.auth_plan)
+                yield self.run_ldap(self.write_server_info_snapshot, path, info)
+            except (OSError, ldap3.core.exceptions.LDAPException) as exc:
+                self.log.warning(
+                    "Failed to save ldap server information to '%s': %s: %s", path, exc.__class__.__name__, exc)
+                return
+            self.log.info("Saved ldap server information to '%s'", path)
+        self._server_info = info
+        for server in self.auth_plan.server_pool.servers:
+            server.attach_dsa_info(info[0])
+            server.attach_schema_info(info[1])
+
+    @staticmethod
+    def read_server_info_snapshot(path):
+        """
+        Return (DsaInfo, SchemaInfo) read from the snapshot at path, or None
+        if there is no snapshot
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return DsaInfo.from_json(data['dsa_info']), SchemaInfo.from_json(data['schema'])
+
+    @staticmethod
+    def write_server_info_snapshot(path, info):
+        """
+        Write (DsaInfo, SchemaInfo) to path, replacing any previous snapshot
+        atomically
+        """
+        data = {'dsa_info': info[0].to_json(), 'schema': info[1].to_json()}
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def download_server_info(self, plan):
+        """
+        Read root DSE and schema from the first server of plan that returns
+        them, bound as 'bind_user_dn'
+        """
+        last_exc = ldap3.core.exceptions.LDAPSocketOpenError('no ldap server available')
+        for host in plan.server_hosts:
+            server = self.create_ldap_server_obj(host)
+            server.get_info = ldap3.ALL
+            try:
+                conn = ldap3.Connection(
+                    server,
+                    user=self.bind_user_dn,
+                    password=self.bind_user_password,
+                    auto_bind=ldap3.AUTO_BIND_TLS_BEFORE_BIND,
+                    read_only=True,
+                    receive_timeout=self.server_receive_timeout)
+            except ldap3.core.exceptions.LDAPException as exc:
+                last_exc = exc
+                continue
+            conn.unbind()
+            if server.info is not None and server.schema is not None:
+                return server.info, server.schema
+            last_exc = ldap3.core.exceptions.LDAPInfoError("no server information returned by '{}'".format(host))
+        raise last_exc
+
+    def take_standby_connection(self, plan):
+        """
+        Return a standby connection to the server a new connection would be
+        opened to, or None
+        """
+        if not self.server_standby_connections or self._standby_callback is None:
+            return None
+        servers = plan.server_pool.servers
+        if plan.server_pool_strategy == 'FASTEST':
+            servers = self.server_selector.ordered(servers)
+        return self.standby_connections.take(servers)
+
+    def start_standby_connections(self):
+        """
+        Open 'server_standby_connections' connections to every server and
+        replace them every 'server_standby_max_age' seconds
+        """
+        if self._standby_callback is not None:
+            return
+        servers = self.auth_plan.server_pool.servers
+        self._standby_callback = PeriodicCallback(
+            lambda: self.standby_connections.recycle(self.auth_plan.server_pool.servers),
+            max(self.server_standby_max_age, 1) * 1000 / 2)
+        self._standby_callback.start()
+        self.standby_connections.fill(servers)
+
+    def paged_search(self, conn, search_base, search_filter, attributes):
+        """
+        Search subtree in pages of 'authorization_index_page_size' entries
+        and yield the result entries
+        """
+        cookie = None
+        while True:
+            search = self.paged_search_request(search_base, search_filter, attributes, cookie)
+            with self.server_operation(conn, 'search', search=search):
+                conn.search(**search)
+            for entry in conn.response or []:
+                if entry.get('type') == 'searchResEntry':
+                    yield entry
+            cookie = self.paged_search_cookie(conn.result)
+            if not cookie:
+                break
+
+    def paged_search_steps(self, search_base, search_filter, attributes):
+        """
+        Search steps of paged_search, returning list of all result entries
+        """
+        entries = list()
+        cookie = None
+        while True:
+            response, result = yield self.paged_search_request(search_base, search_filter, attributes, cookie)
+            entries.extend(entry for entry in response if entry.get('type') == 'searchResEntry')
+            cookie = self.paged_search_cookie(result)
+            if not cookie:
+                return entries
+
+    def paged_search_request(self, search_base, search_filter, attributes, cookie=None):
+        """
+        Return search of the page following cookie
+        """
+        return dict(
+            search_base=search_base,
+            search_filter=search_filter,
+            search_scope=ldap3.SUBTREE,
+            attributes=attributes,
+            paged_size=self.authorization_index_page_size,
+            paged_cookie=cookie)
+
+    @staticmethod
+    def paged_search_cookie(result):
+        """
+        Return cookie of the next page from a search result, or None
+        """
+        controls = (result or {}).get('controls') or {}
+        return controls.get(PAGED_RESULTS_CONTROL, {}).get('value', {}).get('cookie')
+
+    def index_members(self, conn, plan, groups=None, matching_rule=None, since=None):
+        """
+        Return dict of normalized usernames and dns of users that are members
+        of groups, or of all users if groups is None. With `since` set, only
+        users modified since that generalized time are returned.
+        """
+        user_search_filter = plan.user_search_filter.format(username='*')
+        modified_filter = '(modifyTimestamp>={})'.format(since) if since else ''
+        membership_filters = [''] if groups is None else self.membership_filters(plan, groups, matching_rule)
+        members = dict()
+        for membership_filter in membership_filters:
+            search_filter = '(&{}{}{})'.format(user_search_filter, modified_filter, membership_filter)
+            for entry in self.paged_search(conn, plan.user_search_base, search_filter, [plan.user_attribute]):
+                value = entry.get('attributes', {}).get(plan.user_attribute)
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                if value:
+                    members[self.normalize_username(str(value))] = entry['dn']
+        return members
+
+    def sync_index_members(self, conn, plan, groups, matching_rule, since):
+        """
+        Return members of groups and all users modified since `since`
+        """
+        members = self.index_members(conn, plan, groups, matching_rule, since)
+        modified = self.index_members(conn, plan, None, None, since)
+        return members, modified
+
+    def modified_groups(self, conn, plan, since):
+        """
+        Return dict of lowercase dns and modifyTimestamp of groups modified
+        since `since`
+        """
+        if plan.group_search_base:
+            searches = [(plan.group_search_base, ldap3.SUBTREE)]
+        else:
+            searches = [(group, ldap3.BASE) for group in plan.allowed_groups]
+        stamps = dict()
+        for search_base, search_scope in searches:
+            with self.server_operation(conn, 'search'):
+                conn.search(
+                    search_base=search_base,
+                    search_filter='(modifyTimestamp>={})'.format(since),
+                    search_scope=search_scope,
+                    attributes=['modifyTimestamp'])
+            for entry in conn.response or []:
+                if entry.get('type') != 'searchResEntry':
+                    continue
+                stamp = (entry.get('raw_attributes', {}).get('modifyTimestamp') or [b''])[0]
+                stamps[entry['dn'].lower()] = stamp.decode('utf8') if isinstance(stamp, bytes) else str(stamp)
+        return stamps
+
+    def indexed_user_dn(self, plan, username):
+        """
+        Return dn of username if found in the authorization index of plan
+        """
+        if not self.authorization_index_enabled or not plan.filter_by_group:
+            return None
+        self.start_authorization_index()
+        index = self._authorization_index
+        if index is None or index.fingerprint != plan.fingerprint:
+            return None
+        user_dn = index.get(username)
+        CACHE_REQUESTS.labels(cache='authorization_index', result='miss' if user_dn is None else 'hit').inc()
+        return user_dn
+
+    def start_authorization_index(self):
+        """
+        Load the authorization index snapshot and start syncing the index
+        every 'authorization_index_sync_interval' seconds
+        """
+        if self._authorization_index_callback is not None:
+            return
+        self._authorization_index_callback = PeriodicCallback(
+            self.refresh_authorization_index,
+            max(self.authorization_index_sync_interval, 1) * 1000)
+        self._authorization_index_callback.start()
+        IOLoop.current().add_callback(self.load_authorization_index)
+
+    @gen.coroutine
+    def load_authorization_index(self):
+        """
+        Load the authorization index from 'authorization_index_path' and sync it
+        """
+        if self.authorization_index_path:
+            try:
+                index = yield self.run_ldap(AuthorizationIndex.load, self.authorization_index_path)
+            except (OSError, ValueError, KeyError) as exc:
+                self.log.warning("Failed to load authorization index from '%s': %s", self.authorization_index_path, exc)
+                index = None
+            if index is not None and index.fingerprint == self.auth_plan.fingerprint:
+                self._authorization_index = index
+                self.log.info(
+                    "Loaded authorization index of %i users from '%s'", len(index), self.authorization_index_path)
+        yield self.refresh_authorization_index()
+
+    def refresh_authorization_index(self):
+        """
+        Build or sync the authorization index. Concurrent calls share a single refresh.
+        """
+        if self._authorization_index_sync is None or self._authorization_index_sync.done():
+            self._authorization_index_sync = self._refresh_authorization_index()
+        return self._authorization_index_sync
+
+    @gen.coroutine
+    def _refresh_authorization_index(self):
+        plan = self.auth_plan
+        if plan.error or not plan.filter_by_group:
+            return
+        if not plan.user_attribute:
+            self.log.error(
+                "Authorization index requires 'user_attribute' when it cannot be inferred from 'user_search_filter'")
+            return
+        in_chain = plan.allow_nested_groups and plan.nested_groups_strategy == 'in_chain'
+        matching_rule = IN_CHAIN_MATCHING_RULE if in_chain else None
+        index = self._authorization_index
+        if index is not None and index.fingerprint != plan.fingerprint:
+            index = None
+        since = index.watermark if index is not None else generalized_time(SYNC_OVERLAP)
+        watermark = generalized_time(SYNC_OVERLAP)
+        try:
+            # groups seen with the same stamp were handled by a previous sync
+            stamps = yield self.run_ldap(self.service_pool.run, self.modified_groups, plan, since)
+            seen = index.group_stamps if index is not None else stamps
+            modified = set(dn for dn, stamp in stamps.items() if seen.get(dn) != stamp)
+            known_groups = index.groups if index is not None else plan.permitted_groups
+            if modified.intersection(group.lower() for group in known_groups):
+                self.invalidate_permitted_groups()
+            permitted_groups = yield self.load_permitted_groups(plan)
+            groups = frozenset(plan.allowed_groups if in_chain else permitted_groups)
+            rebuild = (
+                index is None
+                or index.groups != groups
+                or modified.intersection(group.lower() for group in groups)
+                or time.time() - index.built >= self.authorization_index_rebuild_interval)
+            if rebuild:
+                start = time.monotonic()
+                members = yield self.run_ldap(self.service_pool.run, self.index_members, plan, groups, matching_rule)
+                index = AuthorizationIndex(plan.fingerprint, groups, members, watermark=watermark, group_stamps=stamps)
+                self._authorization_index = index
+                self.log.info(
+                    "Built authorization index of %i users in %.1f seconds", len(index), time.monotonic() - start)
+            else:
+                members, modified_users = yield self.run_ldap(
+                    self.service_pool.run, self.sync_index_members, plan, groups, matching_rule, since)
+                for username in set(modified_users).union(members):
+                    if username in members:
+                        index.add(username, members[username])
                     else:
-                        self.log.info("User '%s' sucessfully authenticated against ldap server %r.", username, conn_servers)
-                        auth_response = username
-                else:
-                    self.log.error("User '%s' is not a member of any permitted groups %s", username, permitted_groups)
-                    auth_response = None
+                        index.discard(username)
+                index.watermark = watermark
+                index.group_stamps = stamps
+                self.log.debug(
+                    "Synced %i modified users into authorization index of %i users", len(modified_users), len(index))
+        except ldap3.core.exceptions.LDAPException as exc:
+            self.log.error("Failed to sync authorization index: %s: %s", exc.__class__.__name__, exc)
+            return
+        if self.authorization_index_path:
+            try:
+                yield self.run_ldap(index.dump, self.authorization_index_path)
+            except OSError as exc:
+                self.log.warning("Failed to save authorization index to '%s': %s", self.authorization_index_path, exc)
+
+    def search_users(self, conn, plan, usernames, permitted_groups, in_chain=False):
+        """
+        Check usernames with a single OR-combined user search. Returns list
+        of UserAuthorization in the order of usernames.
+        """
+        return self.run_search_steps(conn, self.search_users_steps, plan, usernames, permitted_groups, in_chain)
+
+    def search_users_steps(self, plan, usernames, permitted_groups, in_chain=False):
+        """
+        Search steps of search_users
+        """
+        user_filters = ''.join(plan.user_search_filter.format(username=username) for username in usernames)
+        search_filter = '(|{})'.format(user_filters)
+        attributes = [plan.user_attribute]
+        if plan.filter_by_group and not in_chain:
+            attributes.append(plan.user_membership_attribute)
+        entries = collections.defaultdict(list)
+        matches = yield from self.paged_search_steps(plan.user_search_base, search_filter, attributes)
+        for entry in matches:
+            value = entry.get('attributes', {}).get(plan.user_attribute)
+            if isinstance(value, list):
+                value = value[0] if value else None
+            if value:
+                entries[self.normalize_username(str(value))].append(entry)
+
+        # resolve nested membership server side with a second search
+        in_chain_dns = set()
+        if plan.filter_by_group and in_chain and entries:
+            membership_filters = self.membership_filters(plan, plan.allowed_groups, IN_CHAIN_MATCHING_RULE)
+            search_filter = '(&(|{}){})'.format(user_filters, '(|{})'.format(''.join(membership_filters)))
+            matches = yield from self.paged_search_steps(plan.user_search_base, search_filter, ldap3.NO_ATTRIBUTES)
+            in_chain_dns.update(entry['dn'].lower() for entry in matches)
+
+        results = list()
+        for username in usernames:
+            found = entries.get(username, [])
+            if len(found) != 1:
+                results.append(UserAuthorization(username, None, False))
+                continue
+            entry = found[0]
+            if not plan.filter_by_group:
+                authorized = True
+            elif in_chain:
+                authorized = entry['dn'].lower() in in_chain_dns
+            elif self.ranged_attribute(entry, plan.user_membership_attribute):
+                membership = yield from self.find_permitted_membership_steps(plan, entry, permitted_groups)
+                authorized = membership is not None
+            else:
+                memberships = entry['attributes'].get(plan.user_membership_attribute) or []
+                authorized = not permitted_groups.isdisjoint(memberships)
+            results.append(UserAuthorization(username, entry['dn'], authorized))
+        return results
+
+    def _authorized_user_batches(self, usernames):
+        """
+        Yield normalized, validated batches of at most
+        'authorized_users_batch_size' usernames and the invalid usernames
+        """
+        batch_size = max(self.authorized_users_batch_size, 1)
+        batch = list()
+        for username in usernames:
+            username = self.normalize_username(username.strip())
+            if not self.validate_username(username):
+                yield None, username
+                continue
+            batch.append(username)
+            if len(batch) >= batch_size:
+                yield batch, None
+                batch = list()
+        if batch:
+            yield batch, None
+
+    def batch_plan(self):
+        """
+        Return auth plan used to check users in batches. Raises ValueError if
+        the plan cannot check users.
+        """
+        plan = self.auth_plan
+        if plan.error:
+            raise ValueError(plan.error)
+        if not plan.user_attribute:
+            raise ValueError("'user_attribute' is required when it cannot be inferred from 'user_search_filter'")
+        return plan
+
+    def batch_settings(self):
+        """
+        Return auth plan, permitted groups and whether nested membership is
+        resolved server side for blocking batch checks
+        """
+        plan = self.batch_plan()
+        in_chain = plan.allow_nested_groups and plan.nested_groups_strategy == 'in_chain'
+        cached = self._permitted_groups_cache
+        if not self.expands_nested_groups(plan):
+            permitted_groups = plan.permitted_groups
+        elif cached and cached[0] is plan:
+            permitted_groups = cached[1]
+        else:
+            permitted_groups = self.service_pool.run(self.get_permitted_groups, plan)
+        return plan, permitted_groups, in_chain
+
+    @gen.coroutine
+    def load_batch_settings(self):
+        """
+        Return auth plan, permitted groups and whether nested membership is
+        resolved server side for batch checks run from the event loop
+        """
+        plan = self.batch_plan()
+        in_chain = plan.allow_nested_groups and plan.nested_groups_strategy == 'in_chain'
+        permitted_groups = yield self.load_permitted_groups(plan)
+        return plan, permitted_groups, in_chain
+
+    def iter_authorized_users(self, usernames):
+        """
+        Check whether each of usernames is permitted to log in without
+        requiring passwords. Blocking; yields a UserAuthorization per
+        username as soon as its batch search returns. Usernames may be any
+        iterable, e.g. lines of a file. With 'domains' set, usernames are
+        checked against the domains they are routed to.
+        """
+        if self.domains:
+            for result in self.iter_domain_authorized_users(usernames):
+                yield result
+            return
+        plan, permitted_groups, in_chain = self.batch_settings()
+        for batch, invalid in self._authorized_user_batches(usernames):
+            if batch is None:
+                yield UserAuthorization(invalid, None, False)
+                continue
+            for result in self.service_pool.run(self.search_users, plan, batch, permitted_groups, in_chain):
+                yield result
+
+    @gen.coroutine
+    def check_authorized_users(self, usernames, callback=None):
+        """
+        Check whether each of usernames is permitted to log in, running one
+        batch search at a time on the ldap executor. Calls `callback` with
+        the list of UserAuthorization of every batch as it completes, and
+        returns dict of normalized usernames and whether they are permitted.
+        With 'domains' set, usernames are checked against the domains they
+        are routed to.
+        """
+        if self.domains:
+            settings = dict()
+        else:
+            settings = yield self.load_batch_settings()
+        authorized = dict()
+        for batch, invalid in self._authorized_user_batches(usernames):
+            if batch is None:
+                results = [UserAuthorization(invalid, None, False)]
+            elif self.domains:
+                results = yield self.check_domain_batch(batch, settings)
+            else:
+                plan, permitted_groups, in_chain = settings
+                results = yield self.run_searches(self.search_users_steps, plan, batch, permitted_groups, in_chain)
+            for result in results:
+                authorized[result.username] = result.authorized
+            if callback is not None:
+                callback(results)
+        return authorized
+
+    def _deny(self, login, result, msg, *args):
+        """
+        Log reason an authentication attempt was denied and record its result
+        """
+        self.log.error(msg, *args)
+        login.result = result
+        return None
+
+    @gen.coroutine
+    def authenticate(self, handler, data):
+
+        # define vars
+        username = data['username']
+        password = data['password']
+
+        # validate credentials
+        username = self.normalize_username(username)
+        if not self.validate_username(username):
+            self.log.error('Unsupported username supplied')
+            LOGIN_RESULTS.labels(result='invalid_username').inc()
+            return None
+        if password is None or password.strip() == '':
+            self.log.error('Empty password supplied')
+            LOGIN_RESULTS.labels(result='empty_password').inc()
+            return None
+
+        # reject attempts over the throttle limits before any ldap work. Both
+        # limits are checked before taking tokens, so an attempt rejected for
+        # its client ip does not use up the attempts of the username.
+        client_ip = handler.request.remote_ip if handler is not None else None
+        if not self.username_throttle.check(username):
+            return self._throttle(username, 'username', username)
+        if client_ip and not self.ip_throttle.check(client_ip):
+            return self._throttle(username, 'ip', client_ip)
+        self.username_throttle.allow(username)
+        if client_ip:
+            self.ip_throttle.allow(client_ip)
+
+        # share in-flight authentication of identical credentials
+        if self._login_futures is None:
+            self._login_futures = dict()
+            self._login_secret = os.urandom(32)
+        key = (username, hmac.new(self._login_secret, password.encode('utf8'), hashlib.sha256).digest())
+        future = self._login_futures.get(key)
+        if future is None:
+            future = self.admit_login(username, password, client_ip)
+            self._login_futures[key] = future
+            IOLoop.current().add_future(future, lambda f: self._login_futures.pop(key, None))
+        else:
+            self.log.debug("Joining in-flight authentication of user '%s'", username)
+        auth_response = yield future
+        return auth_response
+
+    def _throttle(self, username, key, value):
+        """
+        Log and record an attempt rejected by the login throttle
+        """
+        self.log.warning("Login throttle limit for %s '%s' reached. Rejecting authentication of user '%s'.",
+                         key, value, username)
+        THROTTLED_LOGINS.labels(key=key).inc()
+        LOGIN_RESULTS.labels(result='throttled').inc()
+        return None
 
-                permitted_groups = None
+    def record_throttle_result(self, username, client_ip, result):
+        """
+        Count failed logins towards the login throttle limits of username and
+        client_ip, or reset those of username after a successful login
+        """
+        if result == 'success':
+            # a client ip's failures are never reset, otherwise logins to an
+            # account of its own would let a client guess other passwords
+            self.username_throttle.succeeded(username)
+        elif result in THROTTLE_FAILURE_RESULTS:
+            self.username_throttle.failed(username)
+            if client_ip:
+                self.ip_throttle.failed(client_ip)
+
+    @gen.coroutine
+    def admit_login(self, username, password, client_ip=None):
+        """
+        Authenticate user once a slot below 'login_concurrency_limit' is free.
+        Rejects the attempt if 'login_queue_limit' logins are already waiting.
+        """
+        login = LoginRecord(username, trace=self.start_trace('login', username))
+        try:
+            if not self.login_concurrency_limit:
+                auth_response = yield self.authenticate_ldap_user(username, password, login)
                 return auth_response
+            if self._login_semaphore is None:
+                self._login_semaphore = locks.Semaphore(self.login_concurrency_limit)
+            if self._logins_active >= self.login_concurrency_limit:
+                if self.login_queue_limit and self._logins_waiting >= self.login_queue_limit:
+                    return self._deny(
+                        login, 'rejected',
+                        "Login queue limit of %i reached. Rejecting authentication of user '%s'.",
+                        self.login_queue_limit, username)
+            self._logins_waiting += 1
+            try:
+                timeout = self.login_queue_timeout and timedelta(seconds=self.login_queue_timeout)
+                yield self._login_semaphore.acquire(timeout=timeout or None)
+            except gen.TimeoutError:
+                return self._deny(
+                    login, 'rejected',
+                    "Timed out after %i seconds waiting for a login slot. Rejecting authentication of user '%s'.",
+                    self.login_queue_timeout, username)
+            finally:
+                self._logins_waiting -= 1
+            self._logins_active += 1
+            try:
+                auth_response = yield self.authenticate_ldap_user(username, password, login)
+            finally:
+                self._logins_active -= 1
+                self._login_semaphore.release()
+            return auth_response
+        finally:
+            self.record_throttle_result(username, client_ip, login.result)
+            login.finish()
+            self.finish_trace(login)
+
+    @gen.coroutine
+    def authenticate_ldap_user(self, username, password, login=None):
+        """
+        Authenticate normalized username and password against ldap
+        """
+        login = login or LoginRecord(username)
+        if self.domains:
+            auth_response = yield self.authenticate_domain_user(username, password, login)
+            return auth_response
+
+        # verify configuration compiled into a usable plan
+        plan = self.auth_plan
+        if plan.error:
+            return self._deny(login, 'config_error', plan.error)
+        conn_servers = list(plan.server_hosts)
+
+        # reject attempt if the ldap executor is saturated
+        if self.executor_full():
+            return self._deny(
+                login, 'rejected',
+                "ldap executor queue limit of %i reached. Rejecting authentication of user '%s'.",
+                self.executor_max_queue, username)
+
+        # users in the authorization index only need their password verified
+        auth_user_dn = self.indexed_user_dn(plan, username)
+        if auth_user_dn:
+            self.log.debug("User '%s' found in authorization index. Proceeding with authentication.", username)
+            auth_response = yield self.verify_user(login, plan, username, auth_user_dn, password)
+            return auth_response
+
+        # verify the password while authorizing the user if its dn is known
+        bind = None
+        bind_dn = self.pipelined_user_dn(plan, username) if self.pipeline_user_bind else None
+        if bind_dn:
+            self.log.debug("Verifying password of user '%s' as '%s' while authorizing.", username, bind_dn)
+            bind = self.start_user_bind(plan, bind_dn, password, login)
+
+        # format user search filter
+        auth_user_search_filter = self.format_user_search_filter(plan, username, login)
+
+        # compile list of permitted groups and search for authenticating user
+        # in ldap using pooled connections bound as 'bind_user_dn'
+        in_chain = plan.filter_by_group and plan.allow_nested_groups and plan.nested_groups_strategy == 'in_chain'
+        server_side = plan.filter_by_group and (in_chain or plan.server_side_group_filter)
+        authorized = False
+        denied_by_server = False
+        try:
+            with login.phase('group_expansion'):
+                permitted_groups = yield self.load_permitted_groups(plan, login)
+            with login.phase('user_search'):
+                response = None
+                if server_side:
+                    # only searches matching the membership filter are cached
+                    response = self.user_cache.get(self.cache_key(plan, 'membership', username))
+                    CACHE_REQUESTS.labels(cache='membership', result='miss' if response is None else 'hit').inc()
+                    authorized = response is not None
+                if response is None and not in_chain:
+                    response = self.user_cache.get(self.cache_key(plan, 'user', username))
+                    CACHE_REQUESTS.labels(cache='user', result='miss' if response is None else 'hit').inc()
+                if response is not None:
+                    self.log.debug("Using cached LDAP search results for user '%s'.", username)
+                elif server_side:
+                    groups = plan.allowed_groups if in_chain else permitted_groups
+                    self.log.debug(
+                        "Attempting LDAP search using search_filter '%s' and membership of %i permitted group(s).",
+                        auth_user_search_filter, len(groups))
+                    response = yield self.run_searches(
+                        self.search_user_in_groups_steps,
+                        plan,
+                        auth_user_search_filter,
+                        groups,
+                        IN_CHAIN_MATCHING_RULE if in_chain else None,
+                        login=login)
+                    authorized = bool(response)
+                    if authorized:
+                        self.user_cache.set(self.cache_key(plan, 'membership', username), response)
+                    else:
+                        # search again without membership filter to report why it failed.
+                        # The server already checked membership, so only the dn is read.
+                        denied_by_server = True
+                        response = yield self.run_searches(
+                            self.lookup_user_dn_steps, plan, auth_user_search_filter, login=login)
+                        if not response:
+                            self.cache_user_response(plan, username, response)
+                if response is None:
+                    self.log.debug("Attempting LDAP search using search_filter '%s'.", auth_user_search_filter)
+                    response = yield self.search_user(plan, username, auth_user_search_filter, login=login)
+        except ldap3.core.exceptions.LDAPBindError:
+            return self._deny(
+                login, 'service_bind_failed',
+                "Could not establish ldap connection to %s using '%s' and supplied bind_user_password.",
+                conn_servers, self.bind_user_dn)
+        except ldap3.core.exceptions.LDAPException as exc:
+            return self._deny(
+                login, 'server_down',
+                "ldap search against %s failed: %s: %s", conn_servers, exc.__class__.__name__, exc)
+
+        # handle abnormal search results
+        if not response or 'attributes' not in response[0].keys():
+            return self._deny(
+                login, 'no_such_user',
+                "LDAP search '%s' found %i result(s).",
+                auth_user_search_filter, len(response))
+        elif len(response) > 1:
+            return self._deny(
+                login, 'ambiguous_user',
+                "LDAP search '%s' found %i result(s). Please narrow search to 1 result.",
+                auth_user_search_filter, len(response))
+        self.log.debug("LDAP search '%s' found %i result(s).", auth_user_search_filter, len(response))
+        search_response = response[0]
+
+        # get authenticating user's ldap attributes
+        if not search_response['dn'] or search_response['dn'].strip() == '':
+            return self._deny(
+                login, 'invalid_user_entry',
+                "Search results for user '%s' returned 'dn' attribute with undefined or null value.",
+                username)
+        self.log.debug(
+            "Search results for user '%s' returned 'dn' attribute as '%s'",
+            username, search_response['dn'])
+        auth_user_dn = search_response['dn']
+        if denied_by_server:
+            return self._deny(
+                login, 'not_in_group',
+                "User '%s' is not a member of any permitted groups %s", username, sorted(groups))
+        ranged_attribute = None if authorized else self.ranged_attribute(
+            search_response, plan.user_membership_attribute)
+        if authorized or ranged_attribute:
+            auth_user_memberships = None
+        elif not search_response['attributes'][plan.user_membership_attribute]:
+            return self._deny(
+                login, 'invalid_user_entry',
+                "Search results for user '%s' returned '%s' attribute with undefned or null value.",
+                username, plan.user_membership_attribute)
+        else:
+            self.log.debug(
+                "Search results for user '%s' returned '%s' attribute as %s",
+                username, plan.user_membership_attribute,
+                search_response['attributes'][plan.user_membership_attribute])
+            auth_user_memberships = search_response['attributes'][plan.user_membership_attribute]
+
+        # is authenticating user a member of permitted_groups
+        auth_user_groups = ()
+        if authorized:
+            self.log.debug(
+                "User '%s' matched membership search of allowed ldap groups. Proceeding with authentication.",
+                username)
+            # the server checked membership, the user's groups are not known
+            auth_user_groups = None
+        elif ranged_attribute:
+            self.log.debug(
+                "Search results for user '%s' returned ranged '%s' attribute. Reading remaining values on demand.",
+                username, ranged_attribute)
+            if plan.filter_by_group:
+                try:
+                    with login.phase('membership_check'):
+                        allowed_membership = yield self.run_searches(
+                            self.find_permitted_membership_steps,
+                            plan,
+                            search_response,
+                            permitted_groups,
+                            login=login)
+                except ldap3.core.exceptions.LDAPException as exc:
+                    return self._deny(
+                        login, 'server_down',
+                        "ldap search against %s failed: %s: %s", conn_servers, exc.__class__.__name__, exc)
+                if allowed_membership is None:
+                    return self._deny(
+                        login, 'not_in_group',
+                        "User '%s' is not a member of any permitted groups %s", username, sorted(permitted_groups))
+                self.log.debug(
+                    "User '%s' found in allowed ldap group '%s'. Proceeding with authentication.",
+                    username, allowed_membership)
+                auth_user_groups = (allowed_membership,)
+        else:
+            allowed_memberships = list(permitted_groups.intersection(auth_user_memberships))
+            if not allowed_memberships and plan.filter_by_group:
+                return self._deny(
+                    login, 'not_in_group',
+                    "User '%s' is not a member of any permitted groups %s", username, sorted(permitted_groups))
+            self.log.debug(
+                "User '%s' found in the following allowed ldap groups %s. Proceeding with authentication.",
+                username, allowed_memberships)
+            auth_user_groups = allowed_memberships
+
+        # bind as authenticating user on a separate connection
+        if bind is not None and auth_user_dn.lower() != bind_dn.lower():
+            self.log.debug("User '%s' found as '%s' instead of '%s'.", username, auth_user_dn, bind_dn)
+            bind = None
+        auth_response = yield self.verify_user(
+            login, plan, username, auth_user_dn, password, auth_user_groups, bind=bind)
+        return auth_response
+
+    def pipelined_user_dn(self, plan, username):
+        """
+        Return dn of username from the user cache or 'user_dn_template', or
+        None if it is not known before the user search
+        """
+        response = self.user_cache.get(self.cache_key(plan, 'user', username))
+        if response is not None and len(response) == 1 and response[0].get('dn'):
+            return response[0]['dn']
+        if plan.user_dn_template:
+            # undo the filter escaping of normalize_username
+            username = unescape_filter_chars(username).decode('utf8')
+            return plan.user_dn_template.format(username=escape_rdn(username))
+        return None
+
+    def start_user_bind(self, plan, user_dn, password, login=None):
+        """
+        Start verifying the password of user_dn and return a future of
+        whether it is valid
+        """
+        if self.ldap_engine == 'async':
+            future = self.async_engine.bind(user_dn, password, login=login)
+        else:
+            future = self.run_ldap(self.verify_user_credentials, plan, user_dn, password, login=login)
+        # results of binds discarded after a denied authorization are never read
+        IOLoop.current().add_future(future, lambda f: f.exception())
+        return future
+
+    @gen.coroutine
+    def verify_user(self, login, plan, username, auth_user_dn, password, groups=None, bind=None):
+        """
+        Verify password of authorized user and record the login result.
+        `bind` is a future of a password verification already started by
+        start_user_bind. Returns the user's dn and a fingerprint of its
+        permitted `groups` as auth_state for refresh_user, or no fingerprint
+        if groups is None because authorization did not read them.
+        """
+        conn_servers = list(plan.server_hosts)
+        try:
+            with login.phase('user_bind'):
+                if bind is None:
+                    bind = self.start_user_bind(plan, auth_user_dn, password, login)
+                auth_bound = yield bind
+        except ldap3.core.exceptions.LDAPException as exc:
+            return self._deny(
+                login, 'server_down',
+                "ldap bind against %s failed: %s: %s", conn_servers, exc.__class__.__name__, exc)
+        if not auth_bound:
+            return self._deny(
+                login, 'bad_password',
+                "Could not establish ldap connection to %s using '%s' and supplied password.",
+                conn_servers, auth_user_dn)
+        self.log.info("User '%s' sucessfully authenticated against ldap server %r.", username, conn_servers)
+        login.result = 'success'
+        return {
+            'name': username,
+            'auth_state': {
+                'dn': auth_user_dn,
+                'membership': None if groups is None else self.membership_fingerprint(groups),
+            },
+        }
@@ -0,0 +1,434 @@
+"""
+Resolution of the group memberships permitting users to log in
+"""
+
+import collections
+import hashlib
+import time
+from functools import partial
+import ldap3
+from ldap3.utils.conv import escape_filter_chars
+from tornado import gen
+from tornado.ioloop import IOLoop
+from traitlets import Any, Bool, Int
+from traitlets.config import LoggingConfigurable
+from ldapauthenticator.metrics import CACHE_REQUESTS
+
+# Active Directory LDAP_MATCHING_RULE_IN_CHAIN
+IN_CHAIN_MATCHING_RULE = '1.2.840.113556.1.4.1941'
+NESTED_GROUPS_STRATEGIES = ('recursive', 'in_chain')
+
+UserAuthorization = collections.namedtuple('UserAuthorization', ['username', 'dn', 'authorized'])
+UserAuthorization.__doc__ = """
+Result of checking whether a user is permitted to log in
+"""
+
+
+class MembershipMixin(LoggingConfigurable):
+    """
+    Nested group expansion of allowed_groups, membership checks of user
+    entries and re-validation of logged in users. Mixed into
+    LDAPAuthenticator, whose auth plan holds the group settings.
+    """
+
+    permitted_groups_cache_ttl = Int(
+        default_value=300,
+        config=True,
+        help="""
+        Number of seconds the nested group expansion of allowed_groups is
+        reused between logins before it is refreshed. Set to 0 to expand
+        groups on every login (defaults to 300).
+        """
+    )
+
+    permitted_groups_cache_stale_ttl = Int(
+        default_value=3600,
+        config=True,
+        help="""
+        Number of seconds past 'permitted_groups_cache_ttl' an expired nested
+        group expansion may still be used while it is refreshed in the
+        background (defaults to 3600).
+        """
+    )
+
+    permitted_groups_refresh_backoff = Int(
+        default_value=30,
+        config=True,
+        help="""
+        Number of seconds after a failed background refresh of an expired
+        nested group expansion during which logins keep using the expired
+        expansion without starting another refresh (defaults to 30).
+        """
+    )
+
+    permitted_groups_timer = Any(
+        default_value=time.monotonic,
+        help="""
+        Clock measuring the age of cached nested group expansions
+        """
+    )
+
+    refresh_user_membership = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        Re-validate the group membership of logged in users every
+        'Authenticator.auth_refresh_age' seconds with a single read of the
+        user entry. Users no longer permitted have to log in again. Enable
+        'Authenticator.enable_auth_state' to skip the user search needed
+        to find the user's dn (defaults to False).
+        """
+    )
+
+    def get_nested_groups(self, conn, group):
+        """
+        Search group for nested memberships
+        """
+        return list(self.resolve_nested_groups(conn, [group]))
+
+    def resolve_nested_groups(self, conn, groups, plan=None):
+        """
+        Search groups for nested memberships on conn
+        """
+        return self.run_search_steps(conn, self.resolve_nested_groups_steps, groups, plan)
+
+    def resolve_nested_groups_steps(self, groups, plan=None):
+        """
+        Breadth-first search of groups for nested memberships
+
+        Each nesting level is fetched with OR-combined group searches of at
+        most 'group_search_batch_size' groups. Every group is searched once,
+        so cyclic and diamond shaped hierarchies terminate. Returns the set
+        of nested group dns, excluding `groups` themselves.
+        """
+        plan = plan or self.auth_plan
+        batch_size = max(self.group_search_batch_size, 1)
+        visited = set(groups)
+        frontier = list(visited)
+        depth = 0
+        while frontier:
+            if plan.nested_groups_max_depth and depth >= plan.nested_groups_max_depth:
+                self.log.debug("Nested group search stopped at maximum depth of %i", depth)
+                break
+            depth += 1
+            next_frontier = list()
+            for i in range(0, len(frontier), batch_size):
+                group_filters = [
+                    plan.group_search_filter.format(group=escape_filter_chars(group))
+                    for group in frontier[i:i + batch_size]]
+                if len(group_filters) == 1:
+                    search_filter = group_filters[0]
+                else:
+                    search_filter = '(|{})'.format(''.join(group_filters))
+                response, _ = yield dict(
+                    search_base=plan.group_search_base,
+                    search_filter=search_filter,
+                    search_scope=ldap3.SUBTREE,
+                    attributes=ldap3.NO_ATTRIBUTES)
+                for entry in response:
+                    nested_group = entry.get('dn')
+                    if entry.get('type') != 'searchResEntry' or not nested_group or nested_group in visited:
+                        continue
+                    visited.add(nested_group)
+                    next_frontier.append(nested_group)
+            frontier = next_frontier
+        return visited.difference(groups)
+
+    def get_permitted_groups(self, conn, plan):
+        """
+        Compile set of permitted groups, including nested groups if enabled
+        """
+        return self.run_search_steps(conn, self.get_permitted_groups_steps, plan)
+
+    def get_permitted_groups_steps(self, plan):
+        """
+        Search steps of get_permitted_groups
+        """
+        if not self.expands_nested_groups(plan):
+            return plan.permitted_groups
+        nested_groups = yield from self.resolve_nested_groups_steps(plan.allowed_groups, plan)
+        return plan.permitted_groups.union(nested_groups)
+
+    @staticmethod
+    def expands_nested_groups(plan):
+        """
+        Return True if nested groups of allowed_groups are searched for
+        rather than ignored or resolved by the server
+        """
+        return plan.allow_nested_groups and plan.nested_groups_strategy != 'in_chain'
+
+    _permitted_groups_cache = None
+    _permitted_groups_refresh = None
+    _permitted_groups_failure = None
+
+    @gen.coroutine
+    def load_permitted_groups(self, plan, login=None):
+        """
+        Return permitted groups for plan, reusing cached nested group expansions.
+        An expansion the caller has to wait for is attributed to `login`.
+        """
+        if not self.expands_nested_groups(plan):
+            return plan.permitted_groups
+        cached = self._permitted_groups_cache
+        if not (cached and cached[0] is plan) and self.permitted_groups_cache_ttl:
+            # reuse expansion stored by another hub process or before a restart
+            shared = self.user_cache.get(self.cache_key(plan, 'permitted_groups'))
+            if shared is not None:
+                permitted_groups, stored = shared
+                cached = self._permitted_groups_cache = (
+                    plan, frozenset(permitted_groups), self.permitted_groups_timer() - max(time.time() - stored, 0))
+        if cached and cached[0] is plan and self.permitted_groups_cache_ttl:
+            now = self.permitted_groups_timer()
+            age = now - cached[2]
+            if age < self.permitted_groups_cache_ttl:
+                CACHE_REQUESTS.labels(cache='permitted_groups', result='hit').inc()
+                return cached[1]
+            if age < self.permitted_groups_cache_ttl + self.permitted_groups_cache_stale_ttl:
+                CACHE_REQUESTS.labels(cache='permitted_groups', result='stale').inc()
+                failure = self._permitted_groups_failure
+                if failure and failure[0] is plan and now - failure[1] < self.permitted_groups_refresh_backoff:
+                    self.log.debug("Using expired nested group expansion, its last refresh failed")
+                else:
+                    self.log.debug("Refreshing expired nested group expansion in the background")
+                    self.refresh_permitted_groups(plan)
+                return cached[1]
+        CACHE_REQUESTS.labels(cache='permitted_groups', result='miss').inc()
+        permitted_groups = yield self.refresh_permitted_groups(plan, login)
+        return permitted_groups
+
+    def refresh_permitted_groups(self, plan=None, login=None):
+        """
+        Expand nested groups of allowed_groups and cache the result. Concurrent
+        refreshes for the same plan share a single expansion.
+        """
+        plan = plan or self.auth_plan
+        refresh = self._permitted_groups_refresh
+        if refresh and refresh[0] is plan:
+            return refresh[1]
+        future = self.run_searches(self.get_permitted_groups_steps, plan, login=login)
+        self._permitted_groups_refresh = (plan, future)
+        IOLoop.current().add_future(future, partial(self._permitted_groups_refreshed, plan))
+        return future
+
+    def _permitted_groups_refreshed(self, plan, future):
+        if self._permitted_groups_refresh and self._permitted_groups_refresh[1] is future:
+            self._permitted_groups_refresh = None
+        if future.exception():
+            self.log.error("Failed to expand nested groups of allowed_groups: %s", future.exception())
+            self._permitted_groups_failure = (plan, self.permitted_groups_timer())
+            return
+        self._permitted_groups_failure = None
+        if plan is self.auth_plan:
+            self._permitted_groups_cache = (plan, future.result(), self.permitted_groups_timer())
+            ttl = self.permitted_groups_cache_ttl
+            if ttl:
+                self.user_cache.set(
+                    self.cache_key(plan, 'permitted_groups'),
+                    (sorted(future.result()), time.time()),
+                    ttl=ttl + self.permitted_groups_cache_stale_ttl)
+
+    def invalidate_permitted_groups(self):
+        """
+        Discard cached nested group expansion of allowed_groups
+        """
+        self._permitted_groups_cache = None
+        self._permitted_groups_failure = None
+        self.user_cache.pop(self.cache_key(self.auth_plan, 'permitted_groups'))
+
+    @staticmethod
+    def ranged_attribute(entry, attribute):
+        """
+        Return name of the range retrieval variant of attribute in entry
+        (e.g. 'memberOf;range=0-1499'), or None if the attribute is complete
+        """
+        prefix = attribute.lower() + ';range='
+        for name in entry['attributes'].keys():
+            if name.lower().startswith(prefix):
+                return name
+        return None
+
+    @staticmethod
+    def membership_range_search(plan, entry, ranged):
+        """
+        Return search for the range retrieval page of user entry following
+        the page in attribute `ranged`, or None if it was the last page
+        """
+        high = ranged.partition(';range=')[2].partition('-')[2]
+        if high == '*':
+            return None
+        return dict(
+            search_base=entry['dn'],
+            search_filter='(objectClass=*)',
+            search_scope=ldap3.BASE,
+            attributes=['{};range={}-*'.format(plan.user_membership_attribute, int(high) + 1)])
+
+    def find_permitted_membership(self, conn, plan, entry, permitted_groups):
+        """
+        Return first membership of user entry found in permitted_groups, or
+        None. Stops reading range retrieval pages at the first match.
+        """
+        return self.run_search_steps(conn, self.find_permitted_membership_steps, plan, entry, permitted_groups)
+
+    def find_permitted_membership_steps(self, plan, entry, permitted_groups):
+        """
+        Search steps of find_permitted_membership
+        """
+        attribute = plan.user_membership_attribute
+        values = list(entry['attributes'].get(attribute) or [])
+        page = entry
+        while True:
+            ranged = self.ranged_attribute(page, attribute)
+            if ranged:
+                values.extend(page['attributes'][ranged] or [])
+            for group in values:
+                if group in permitted_groups:
+                    return group
+            search = ranged and self.membership_range_search(plan, entry, ranged)
+            if not search:
+                return None
+            response, _ = yield search
+            if not response:
+                return None
+            page, values = response[0], []
+
+    def membership_filters(self, plan, groups, matching_rule=None):
+        """
+        Return OR-combined group membership filters, chunked to at most
+        'group_search_batch_size' groups each
+        """
+        if matching_rule:
+            attribute = '{}:{}:'.format(plan.user_membership_attribute, matching_rule)
+        else:
+            attribute = plan.user_membership_attribute
+        groups = list(groups)
+        batch_size = max(self.group_search_batch_size, 1)
+        filters = list()
+        for i in range(0, len(groups), batch_size):
+            filters.append('(|{})'.format(''.join(
+                '({}={})'.format(attribute, escape_filter_chars(group))
+                for group in groups[i:i + batch_size])))
+        return filters
+
+    def search_user_in_groups(self, conn, plan, user_search_filter, groups, matching_rule=None):
+        """
+        Search for user matching user_search_filter that is also a member of
+        one of groups. Returns response entries of the first matching search.
+        """
+        return self.run_search_steps(
+            conn, self.search_user_in_groups_steps, plan, user_search_filter, groups, matching_rule)
+
+    def search_user_in_groups_steps(self, plan, user_search_filter, groups, matching_rule=None):
+        """
+        Search steps of search_user_in_groups
+        """
+        for membership_filter in self.membership_filters(plan, groups, matching_rule):
+            response, _ = yield dict(
+                search_base=plan.user_search_base,
+                search_filter='(&{}{})'.format(user_search_filter, membership_filter),
+                search_scope=ldap3.SUBTREE,
+                attributes=ldap3.NO_ATTRIBUTES,
+                paged_size=2)
+            response = [entry for entry in response if entry.get('type') == 'searchResEntry']
+            if response:
+                return response
+        return list()
+
+    @staticmethod
+    def membership_fingerprint(groups):
+        """
+        Return short hash of a user's permitted group memberships
+        """
+        groups = '\n'.join(sorted(group.lower() for group in groups))
+        return hashlib.sha256(groups.encode('utf8')).hexdigest()[:16]
+
+    def read_user_membership(self, conn, plan, user_dn, permitted_groups, in_chain=False):
+        """
+        Read user entry with a single BASE search. Returns the user's
+        permitted group memberships, an empty tuple if the user is permitted
+        but its memberships are resolved server side, or None if the user no
+        longer exists or is not permitted.
+        """
+        return self.run_search_steps(
+            conn, self.read_user_membership_steps, plan, user_dn, permitted_groups, in_chain)
+
+    def read_user_membership_steps(self, plan, user_dn, permitted_groups, in_chain=False):
+        """
+        Search steps of read_user_membership
+        """
+        search_filter = '(objectClass=*)'
+        attributes = ldap3.NO_ATTRIBUTES
+        if plan.filter_by_group and in_chain:
+            membership_filters = self.membership_filters(plan, plan.allowed_groups, IN_CHAIN_MATCHING_RULE)
+            search_filter = '(|{})'.format(''.join(membership_filters))
+        elif plan.filter_by_group:
+            attributes = [plan.user_membership_attribute]
+        response, _ = yield dict(
+            search_base=user_dn,
+            search_filter=search_filter,
+            search_scope=ldap3.BASE,
+            attributes=attributes)
+        entries = [entry for entry in response if entry.get('type') == 'searchResEntry']
+        if not entries:
+            return None
+        if not plan.filter_by_group or in_chain:
+            return ()
+        entry = entries[0]
+        if self.ranged_attribute(entry, plan.user_membership_attribute):
+            allowed_membership = yield from self.find_permitted_membership_steps(plan, entry, permitted_groups)
+            return None if allowed_membership is None else (allowed_membership,)
+        memberships = entry['attributes'].get(plan.user_membership_attribute) or []
+        return tuple(permitted_groups.intersection(memberships)) or None
+
+    @gen.coroutine
+    def refresh_user(self, user, handler=None):
+        """
+        Re-validate group membership of a logged in user with a single read
+        of the user entry. Returns False once the user no longer exists or
+        is no longer a member of a permitted group.
+        """
+        if not self.refresh_user_membership:
+            return True
+        if self.domains:
+            result = yield self.refresh_domain_user(user, handler)
+            return result
+        plan = self.auth_plan
+        if plan.error:
+            return True
+        auth_state = (yield user.get_auth_state()) or {}
+        user_dn = auth_state.get('dn')
+        in_chain = plan.allow_nested_groups and plan.nested_groups_strategy == 'in_chain'
+        try:
+            permitted_groups = yield self.load_permitted_groups(plan)
+            if not user_dn:
+                # auth_state is not persisted, find dn with a user search
+                response = self.user_cache.get(self.cache_key(plan, 'user', user.name))
+                if response is None:
+                    user_search_filter = plan.user_search_filter.format(username=user.name)
+                    response = yield self.search_user(plan, user.name, user_search_filter)
+                if len(response) != 1:
+                    self.log.warning("User '%s' no longer found in ldap. Requiring new login.", user.name)
+                    return False
+                user_dn = response[0]['dn']
+            groups = yield self.run_searches(
+                self.read_user_membership_steps, plan, user_dn, permitted_groups, in_chain)
+        except ldap3.core.exceptions.LDAPException as exc:
+            # keep users logged in while the directory is unavailable
+            self.log.warning(
+                "Could not refresh user '%s': %s: %s", user.name, exc.__class__.__name__, exc)
+            return True
+        if groups is None:
+            self.log.warning(
+                "User '%s' no longer exists or is not a member of any permitted groups. Requiring new login.",
+                user.name)
+            self.evict_user(user.name)
+            return False
+        membership = self.membership_fingerprint(groups)
+        if not self.enable_auth_state:
+            return True
+        if auth_state.get('dn'):
+            # logins authorized without reading the user's groups record none
+            recorded = auth_state.get('membership')
+            if recorded is None or recorded == membership:
+                return True
+            self.log.debug("Permitted group memberships of user '%s' changed.", user.name)
+        return {'auth_state': dict(auth_state, dn=user_dn, membership=membership)}
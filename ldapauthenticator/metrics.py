@@ -0,0 +1,143 @@
+"""
+Prometheus metrics for LDAPAuthenticator
+
+Metrics are registered with the default prometheus_client registry, which is
+the registry JupyterHub exposes on its /metrics endpoint.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram
+
+PHASE_DURATION_SECONDS = Histogram(
+    'ldapauthenticator_phase_duration_seconds',
+    'Duration of LDAPAuthenticator authentication phases',
+    ['phase'],
+)
+
+LOGIN_RESULTS = Counter(
+    'ldapauthenticator_logins_total',
+    'Authentication attempts handled by LDAPAuthenticator by result',
+    ['result'],
+)
+
+SERVER_OPERATION_DURATION_SECONDS = Histogram(
+    'ldapauthenticator_server_operation_duration_seconds',
+    'Duration of ldap operations by server and operation',
+    ['server', 'operation'],
+)
+
+SERVER_ERRORS = Counter(
+    'ldapauthenticator_server_errors_total',
+    'Failed ldap operations by server and operation',
+    ['server', 'operation'],
+)
+
+OPERATIONS_PER_LOGIN = Histogram(
+    'ldapauthenticator_operations_per_login',
+    'Number of ldap operations performed for a single login',
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 100),
+)
+
+CACHE_REQUESTS = Counter(
+    'ldapauthenticator_cache_requests_total',
+    'LDAPAuthenticator cache lookups by cache and result',
+    ['cache', 'result'],
+)
+
+TLS_HANDSHAKES = Counter(
+    'ldapauthenticator_tls_handshakes_total',
+    'TLS handshakes with ldap servers by server and whether the session was resumed',
+    ['server', 'resumed'],
+)
+
+THROTTLED_LOGINS = Counter(
+    'ldapauthenticator_throttled_logins_total',
+    'Login attempts rejected by the login throttle before contacting ldap by throttle key',
+    ['key'],
+)
+
+_local = threading.local()
+
+
+class LoginRecord(object):
+    """
+    Timing and ldap operation count of a single login, and its Trace if the
+    login is traced
+    """
+
+    def __init__(self, username, trace=None):
+        self.username = username
+        self.operations = 0
+        self.result = 'error'
+        self.trace = trace
+        self.start = time.monotonic()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Record duration of an authentication phase
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            PHASE_DURATION_SECONDS.labels(phase=name).observe(duration)
+            if self.trace is not None:
+                self.trace.add('phase', duration, phase=name)
+
+    def finish(self):
+        """
+        Record login result, total duration and operation count
+        """
+        LOGIN_RESULTS.labels(result=self.result).inc()
+        PHASE_DURATION_SECONDS.labels(phase='total').observe(time.monotonic() - self.start)
+        OPERATIONS_PER_LOGIN.observe(self.operations)
+
+
+def current_login():
+    """
+    Return LoginRecord of the login served by the current executor thread
+    """
+    return getattr(_local, 'login', None)
+
+
+def call_with_login(login, func, *args, **kwargs):
+    """
+    Call func with login set as the current LoginRecord of this thread
+    """
+    _local.login = login
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.login = None
+
+
+def record_operation(server, operation, duration, failed=False, login=None, search=None, size=None):
+    """
+    Record ldap operation against server in login, or the current login,
+    and metrics. Traced logins also record the Connection.search keyword
+    arguments `search` and the number of entries returned.
+    """
+    login = login or current_login()
+    if login is not None:
+        login.operations += 1
+        if login.trace is not None:
+            if search is not None:
+                login.trace.add_search(server, duration, search, size=size, failed=failed)
+            else:
+                login.trace.add(operation, duration, server=server, failed=failed or None)
+    SERVER_OPERATION_DURATION_SECONDS.labels(server=server, operation=operation).observe(duration)
+    if failed:
+        SERVER_ERRORS.labels(server=server, operation=operation).inc()
+
+
+def record_subprocess(command, duration, returncode):
+    """
+    Record subprocess call in the trace of the current login
+    """
+    login = current_login()
+    if login is not None and login.trace is not None:
+        login.trace.add('subprocess', duration, command=' '.join(command), returncode=returncode)
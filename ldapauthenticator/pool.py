@@ -0,0 +1,363 @@
+"""
+Pools of ldap connections shared between authentication requests
+"""
+
+import collections
+import threading
+import time
+import ldap3
+from ldap3.core.exceptions import LDAPBindError, LDAPCommunicationError, LDAPException
+
+
+class LDAPPoolTimeoutError(LDAPException):
+    """
+    Raised when no pooled connection became available in time
+    """
+
+
+class LDAPConnectionPool(object):
+    """
+    Thread-safe pool of ldap connections created by `factory`.
+
+    Connections are handed out exclusively, so a connection is only ever used
+    by one thread at a time. Idle connections above `min_size` are closed once
+    they have been unused for `idle_timeout` seconds, and connections idle for
+    longer than `health_check_interval` seconds are probed before reuse.
+    Idle times are measured with `timer`.
+    """
+
+    def __init__(self, factory, min_size=0, max_size=10, idle_timeout=300,
+                 health_check_interval=60, acquire_timeout=None, log=None, timer=time.monotonic):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.log = log
+        self.timer = timer
+        self._idle = collections.deque()
+        self._size = 0
+        self._generation = 0
+        self._generations = dict()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        """
+        Number of open connections, idle or checked out
+        """
+        return self._size
+
+    def _create(self):
+        """
+        Create a new bound connection
+        """
+        generation = self._generation
+        try:
+            conn = self.factory()
+        except LDAPBindError:
+            conn = None
+        except LDAPException:
+            # e.g. server unreachable, reported as is
+            self._discard_slot()
+            raise
+        if conn is None:
+            self._discard_slot()
+            raise LDAPBindError('unable to open a bound pooled ldap connection')
+        self._generations[id(conn)] = generation
+        return conn
+
+    def _discard_slot(self):
+        """
+        Give up the capacity reserved for a connection that failed to open
+        """
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _close(self, conn):
+        """
+        Close connection ignoring errors
+        """
+        self._generations.pop(id(conn), None)
+        try:
+            conn.unbind()
+        except LDAPException:
+            pass
+
+    def _evict_idle(self, now):
+        """
+        Remove connections idle longer than idle_timeout while keeping
+        min_size connections around. Must be called with the lock held.
+        """
+        expired = list()
+        if not self.idle_timeout:
+            return expired
+        while self._idle and self._size > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            expired.append(conn)
+        return expired
+
+    def healthy(self, conn):
+        """
+        Probe connection with a rootDSE read. Return True if connection is usable.
+        """
+        if conn.closed or not conn.bound:
+            return False
+        try:
+            return bool(conn.search('', '(objectClass=*)', search_scope=ldap3.BASE, attributes=[ldap3.NO_ATTRIBUTES]))
+        except LDAPException:
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Check out a connection, creating one if the pool has spare capacity
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        expired = list()
+        try:
+            with self._cond:
+                if self._closed:
+                    raise LDAPException('ldap connection pool is closed')
+                while True:
+                    now = self.timer()
+                    expired.extend(self._evict_idle(now))
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise LDAPPoolTimeoutError(
+                            'no pooled ldap connection available after %s seconds' % timeout)
+                    self._cond.wait(remaining)
+        finally:
+            for stale in expired:
+                self._close(stale)
+        if conn is None:
+            return self._create()
+        if not self.health_check_interval or now - last_used < self.health_check_interval or self.healthy(conn):
+            return conn
+        # connection went stale (e.g. server restarted), replace it
+        if self.log:
+            self.log.debug("Discarding unhealthy pooled ldap connection to %s", conn.server)
+        self._close(conn)
+        return self._create()
+
+    def release(self, conn, discard=False):
+        """
+        Return connection to the pool, closing it if `discard` is True
+        """
+        with self._cond:
+            stale = self._generations.get(id(conn)) != self._generation
+            if discard or stale or self._closed or conn.closed:
+                self._size -= 1
+                close = True
+            else:
+                self._idle.append((conn, self.timer()))
+                close = False
+            self._cond.notify()
+        if close:
+            self._close(conn)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call func(conn, *args, **kwargs) with a pooled connection. Connections
+        failing with a communication error are discarded and the call is
+        retried once on a fresh connection.
+        """
+        for attempt in (1, 2):
+            conn = self.acquire()
+            try:
+                result = func(conn, *args, **kwargs)
+            except LDAPCommunicationError:
+                self.release(conn, discard=True)
+                if attempt == 2:
+                    raise
+                continue
+            except Exception:
+                self.release(conn, discard=True)
+                raise
+            self.release(conn)
+            return result
+
+    def prefill(self):
+        """
+        Open connections until min_size connections exist
+        """
+        conns = list()
+        try:
+            while self._size < self.min_size:
+                conns.append(self.acquire(timeout=0))
+        except LDAPException:
+            pass
+        for conn in conns:
+            self.release(conn)
+
+    def clear(self):
+        """
+        Close all idle connections. Checked out connections are closed on release.
+        """
+        with self._cond:
+            self._generation += 1
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def close(self):
+        """
+        Close the pool and all idle connections
+        """
+        with self._cond:
+            self._closed = True
+        self.clear()
+
+
+class StandbyConnections(object):
+    """
+    Thread-safe sets of opened, unbound connections per server that are
+    ready to bind as an authenticating user.
+
+    `factory(server)` opens a connection and is run in the background with
+    `submit(func, *args)` until every server has `size` connections ready
+    or opening. Each connection is handed out once. Connections older than
+    `max_age` seconds are closed instead, so servers do not drop them for
+    being idle while they wait.
+    """
+
+    def __init__(self, factory, submit, size=2, max_age=60, timer=time.monotonic):
+        self.factory = factory
+        self.submit = submit
+        self.size = size
+        self.max_age = max_age
+        self.timer = timer
+        self._ready = collections.defaultdict(collections.deque)
+        self._opening = collections.Counter()
+        self._generation = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(server):
+        return (server.host, server.port)
+
+    def _close(self, conn):
+        """
+        Close connection ignoring errors
+        """
+        try:
+            conn.unbind()
+        except LDAPException:
+            pass
+
+    def ready(self, server):
+        """
+        Number of connections to server ready to be handed out
+        """
+        with self._lock:
+            return len(self._ready[self._key(server)])
+
+    def take(self, servers):
+        """
+        Return a ready connection to the first of servers that has one, or
+        None, and open replacements in the background
+        """
+        conn = None
+        expired = list()
+        with self._lock:
+            now = self.timer()
+            for server in servers:
+                ready = self._ready[self._key(server)]
+                while ready and conn is None:
+                    candidate, opened = ready.popleft()
+                    if now - opened < self.max_age:
+                        conn = candidate
+                    else:
+                        expired.append(candidate)
+                if conn is not None:
+                    break
+        for stale in expired:
+            self._close(stale)
+        self.fill(servers)
+        return conn
+
+    def fill(self, servers):
+        """
+        Open connections in the background until each of servers has `size`
+        connections ready or opening
+        """
+        opening = list()
+        with self._lock:
+            if self._closed:
+                return
+            for server in servers:
+                key = self._key(server)
+                missing = self.size - len(self._ready[key]) - self._opening[key]
+                for _ in range(max(missing, 0)):
+                    self._opening[key] += 1
+                    opening.append(server)
+            generation = self._generation
+        for server in opening:
+            self.submit(self._open, server, generation)
+
+    def _open(self, server, generation):
+        key = self._key(server)
+        try:
+            conn = self.factory(server)
+        except LDAPException:
+            conn = None
+        with self._lock:
+            self._opening[key] -= 1
+            if conn is not None and generation == self._generation and not self._closed:
+                self._ready[key].append((conn, self.timer()))
+                conn = None
+        if conn is not None:
+            self._close(conn)
+
+    def recycle(self, servers):
+        """
+        Close connections older than `max_age` and open replacements
+        """
+        expired = list()
+        with self._lock:
+            now = self.timer()
+            for ready in self._ready.values():
+                while ready and now - ready[0][1] >= self.max_age:
+                    expired.append(ready.popleft()[0])
+        for stale in expired:
+            self._close(stale)
+        self.fill(servers)
+
+    def clear(self):
+        """
+        Close all ready connections. Connections still opening are closed
+        once open.
+        """
+        with self._lock:
+            self._generation += 1
+            ready = [conn for conns in self._ready.values() for conn, _ in conns]
+            self._ready.clear()
+        for conn in ready:
+            self._close(conn)
+
+    def close(self):
+        """
+        Close all connections and stop opening new ones
+        """
+        with self._lock:
+            self._closed = True
+        self.clear()
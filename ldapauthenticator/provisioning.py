@@ -0,0 +1,202 @@
+"""
+Local user accounts and home directories of ldap users
+"""
+
+import os
+import pipes
+import pwd
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, STDOUT
+from jupyterhub import orm
+from jupyterhub.traitlets import Command
+from tornado import gen, locks
+from tornado.ioloop import IOLoop
+from traitlets import Any, Bool, Int, default
+from traitlets.config import LoggingConfigurable
+from ldapauthenticator.cache import TTLCache
+from ldapauthenticator.metrics import CACHE_REQUESTS, LoginRecord, call_with_login, record_subprocess
+
+
+class ProvisioningMixin(LoggingConfigurable):
+    """
+    Verification that users added to the hub exist locally, creating their
+    home directories on a thread pool of its own. Mixed into
+    LDAPAuthenticator before Authenticator, whose add_user it extends.
+    """
+
+    create_user_home_dir = Bool(
+        default_value=False,
+        config=True,
+        help="""
+        If set to True, will attempt to create a user's home directory
+        locally if that directory does not exist already.
+        """
+    )
+
+    create_user_home_dir_cmd = Command(
+        config=True,
+        help="""
+        Command to create a users home directory.
+        """
+    )
+
+    @default('create_user_home_dir_cmd')
+    def _default_create_user_home_dir_cmd(self):
+        if sys.platform == 'linux':
+            home_dir_cmd = ['mkhomedir_helper']
+        else:
+            self.log.debug("Not sure how to create a home directory on '%s' system", sys.platform)
+            home_dir_cmd = ['']
+        return home_dir_cmd
+
+    home_dir_concurrency = Int(
+        default_value=4,
+        config=True,
+        help="""
+        Maximum number of user home directory checks and creations run
+        concurrently, on threads of their own. With 'create_user_home_dir'
+        enabled, missing home directories of all users of the hub database
+        are created concurrently up to this limit at startup (defaults to 4).
+        """
+    )
+
+    passwd_cache_ttl = Int(
+        default_value=300,
+        config=True,
+        help="""
+        Number of seconds local passwd lookups of users are cached. Set to 0
+        to disable caching (defaults to 300).
+        """
+    )
+
+    passwd_cache = Any(
+        help="""
+        Cache of local passwd entries keyed by username
+        """
+    )
+
+    @default('passwd_cache')
+    def _default_passwd_cache(self):
+        return TTLCache(maxsize=self.user_cache_size, ttl=self.passwd_cache_ttl)
+
+    _home_dir_semaphore = None
+    _home_dir_futures = None
+    _home_dir_executor = None
+    _started_provisionings = None
+    _database_users_provisioned = False
+
+    @gen.coroutine
+    def add_user(self, user):
+        if not self._database_users_provisioned:
+            self._database_users_provisioned = True
+            self.provision_database_users()
+        future = None
+        if self._started_provisionings:
+            future = self._started_provisionings.pop(user.name, None)
+        if future is None:
+            future = self.provision_user_home_dir(user.name)
+        yield future
+        yield gen.maybe_future(super().add_user(user))
+
+    def provision_database_users(self):
+        """
+        Start provisioning the home directories of all users of the hub
+        database. JupyterHub adds the users of its database one at a time at
+        startup, so the first add_user call starts all of them at once.
+        """
+        db = getattr(self.parent, 'db', None)
+        if self.create_user_home_dir and db is not None:
+            blocked_users = self.blocked_users
+            self.start_provisioning(
+                name for name, in db.query(orm.User.name) if name not in blocked_users)
+
+    def start_provisioning(self, usernames):
+        """
+        Start provisioning the home directories of usernames concurrently,
+        bounded by 'home_dir_concurrency'. The next add_user call of each user
+        waits for its provisioning instead of starting a new one.
+        """
+        if self._started_provisionings is None:
+            self._started_provisionings = dict()
+        for username in usernames:
+            if username not in self._started_provisionings:
+                self._started_provisionings[username] = self.provision_user_home_dir(username)
+
+    def provision_user_home_dir(self, username):
+        """
+        Verify user exists locally and create home directory if needed.
+        Concurrent calls for the same user share a single provisioning.
+        """
+        if self._home_dir_futures is None:
+            self._home_dir_futures = dict()
+            self._home_dir_semaphore = locks.Semaphore(max(self.home_dir_concurrency, 1))
+        future = self._home_dir_futures.get(username)
+        if future is None:
+            future = self._provision_user_home_dir(username)
+            self._home_dir_futures[username] = future
+            IOLoop.current().add_future(future, lambda f: self._home_dir_futures.pop(username, None))
+        return future
+
+    @gen.coroutine
+    def _provision_user_home_dir(self, username):
+        login = LoginRecord(username, trace=self.start_trace('add_user', username))
+        try:
+            with (yield self._home_dir_semaphore.acquire()):
+                user_exists = yield self.run_home_dir(self.user_home_dir_exists, username, login=login)
+                if not user_exists:
+                    if self.create_user_home_dir:
+                        yield self.run_home_dir(self.add_user_home_dir, username, login=login)
+                    else:
+                        raise KeyError("Domain user '%s' does not exists locally." % username)
+            login.result = 'success'
+        finally:
+            self.finish_trace(login)
+
+    def run_home_dir(self, func, *args, login=None):
+        """
+        Run blocking home directory call on the executor reserved for
+        provisioning, so it neither delays ldap operations nor counts
+        towards 'executor_max_queue'
+        """
+        if self._home_dir_executor is None:
+            self._home_dir_executor = ThreadPoolExecutor(max_workers=max(self.home_dir_concurrency, 1))
+        return self._home_dir_executor.submit(call_with_login, login, func, *args)
+
+    def getpwnam(self, username):
+        """
+        Return local passwd entry of user, using cached entries
+        """
+        user = self.passwd_cache.get(username)
+        CACHE_REQUESTS.labels(cache='passwd', result='miss' if user is None else 'hit').inc()
+        if user is None:
+            user = pwd.getpwnam(username)
+            self.passwd_cache.set(username, user)
+        return user
+
+    def user_home_dir_exists(self, username):
+        """
+        Verify user home directory exists
+        """
+        user = self.getpwnam(username)
+        home_dir = user[5]
+        return bool(os.path.isdir(home_dir))
+
+    def add_user_home_dir(self, username):
+        """
+        Creates user home directory. The command may run for seconds, e.g.
+        copying skeleton files to network storage, and communicate() holds
+        its thread until it exits, so it runs on the provisioning executor
+        of run_home_dir rather than the ldap executor, whose threads logins
+        wait for.
+        """
+        cmd = [arg.replace('USERNAME', username) for arg in self.create_user_home_dir_cmd] + [username]
+        self.log.info("Creating '%s' user home directory using command '%s'", username, ' '.join(map(pipes.quote, cmd)))
+        start = time.monotonic()
+        create_dir = Popen(cmd, stdout=PIPE, stderr=STDOUT)
+        output = create_dir.communicate()[0]
+        record_subprocess(cmd, time.monotonic() - start, create_dir.returncode)
+        if create_dir.returncode:
+            err = output.decode('utf8', 'replace')
+            raise RuntimeError("Failed to create system user %s: %s" % (username, err))
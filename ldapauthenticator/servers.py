@@ -0,0 +1,126 @@
+"""
+Latency and failure tracking used to pick ldap servers
+"""
+
+import threading
+import time
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPResponseTimeoutError, LDAPStartTLSError
+
+# exceptions indicating the server, not the request, is at fault
+SERVER_FAILURES = (LDAPCommunicationError, LDAPResponseTimeoutError, LDAPStartTLSError)
+
+
+class ServerStats(object):
+    """
+    Latency averages and circuit state of a single ldap server
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.connect_latency = None
+        self.operation_latency = None
+        self.failures = 0
+        self.backoff = 0
+        self.open_until = None
+        self.probing = False
+
+    @property
+    def expected_latency(self):
+        """
+        Estimated cost of connecting to and querying the server. Servers
+        without measurements are estimated at 0 so they get measured.
+        """
+        return (self.connect_latency or 0.0) + (self.operation_latency or 0.0)
+
+
+class ServerSelector(object):
+    """
+    Thread-safe tracker ordering ldap servers by observed latency.
+
+    Keeps an exponentially weighted moving average of connect and operation
+    latency per host. After `failure_threshold` consecutive failures the
+    circuit of a host opens and it is skipped for `backoff` seconds. Once
+    that time passes a single probe is allowed, and every failed probe
+    doubles the backoff up to `max_backoff` seconds.
+    """
+
+    def __init__(self, decay=0.3, failure_threshold=3, backoff=5, max_backoff=300, timer=time.monotonic):
+        self.decay = decay
+        self.failure_threshold = max(failure_threshold, 1)
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self.timer = timer
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def stats(self, host):
+        """
+        Return ServerStats of host
+        """
+        with self._lock:
+            return self._get(host)
+
+    def _get(self, host):
+        stats = self._stats.get(host)
+        if stats is None:
+            stats = self._stats[host] = ServerStats(host)
+        return stats
+
+    def _average(self, current, duration):
+        if current is None:
+            return duration
+        return self.decay * duration + (1 - self.decay) * current
+
+    def record(self, host, duration, failed=False, operation=False, probe=False):
+        """
+        Record a connect, or an operation if `operation` is True, against
+        host. Pass `probe` for the result of a probe started by due_probes,
+        other results leave the probe in flight.
+        """
+        with self._lock:
+            stats = self._get(host)
+            if probe:
+                stats.probing = False
+            if failed:
+                stats.failures += 1
+                if probe or (stats.open_until is None and stats.failures >= self.failure_threshold):
+                    if stats.backoff:
+                        stats.backoff = min(stats.backoff * 2, self.max_backoff)
+                    else:
+                        stats.backoff = self.initial_backoff
+                    stats.open_until = self.timer() + stats.backoff
+                return
+            if operation:
+                stats.operation_latency = self._average(stats.operation_latency, duration)
+            else:
+                stats.connect_latency = self._average(stats.connect_latency, duration)
+            stats.failures = 0
+            stats.backoff = 0
+            stats.open_until = None
+
+    def ordered(self, servers):
+        """
+        Return servers with closed circuits ordered by expected latency,
+        followed by servers with open circuits as a last resort
+        """
+        with self._lock:
+            stats = [(self._get(server.host), i, server) for i, server in enumerate(servers)]
+        closed = sorted((s.expected_latency, i, server) for s, i, server in stats if s.open_until is None)
+        opened = sorted((s.open_until, i, server) for s, i, server in stats if s.open_until is not None)
+        return [server for _, _, server in closed + opened]
+
+    def due_probes(self, servers):
+        """
+        Return servers whose circuit backoff has passed and mark them as
+        being probed, so only one probe per server is in flight until its
+        result is recorded with `probe`
+        """
+        now = self.timer()
+        due = list()
+        with self._lock:
+            for server in servers:
+                stats = self._get(server.host)
+                if stats.open_until is not None and stats.open_until <= now and not stats.probing:
+                    stats.probing = True
+                    due.append(server)
+        return due
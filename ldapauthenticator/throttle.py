@@ -0,0 +1,105 @@
+"""
+Throttling of login attempts before they reach ldap
+"""
+
+import collections
+import threading
+import time
+
+
+class LoginThrottle(object):
+    """
+    Thread-safe token buckets limiting login attempts and failed logins per
+    key, e.g. a username or client ip.
+
+    Every attempt takes one of `attempts` tokens and every failed login one
+    of `failures` tokens. Both refill evenly over `window` seconds. Attempts
+    are rejected while either bucket of their key is empty. A limit of 0
+    disables its bucket. At most `maxsize` keys are tracked; the least
+    recently used key is evicted, forgetting its attempts.
+    """
+
+    def __init__(self, attempts, failures, window, maxsize=10000, timer=time.monotonic):
+        self.attempts = attempts
+        self.failures = failures
+        self.window = max(window, 1)
+        self.maxsize = maxsize
+        self.timer = timer
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _bucket(self, key):
+        """
+        Return refilled [attempt tokens, failure tokens, time] of key,
+        tracking key as most recently used
+        """
+        now = self.timer()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.attempts, self.failures, now]
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            elapsed = now - bucket[2]
+            bucket[0] = min(self.attempts, bucket[0] + elapsed * self.attempts / self.window)
+            bucket[1] = min(self.failures, bucket[1] + elapsed * self.failures / self.window)
+            bucket[2] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _allows(self, bucket):
+        return not (self.failures and bucket[1] < 1) and not (self.attempts and bucket[0] < 1)
+
+    def check(self, key):
+        """
+        Return False if an attempt of key has to be rejected, without taking
+        a token
+        """
+        if not (self.attempts or self.failures) or self.maxsize <= 0:
+            return True
+        with self._lock:
+            return self._allows(self._bucket(key))
+
+    def allow(self, key):
+        """
+        Take an attempt token of key. Return False if the attempt has to be
+        rejected.
+        """
+        if not (self.attempts or self.failures) or self.maxsize <= 0:
+            return True
+        with self._lock:
+            bucket = self._bucket(key)
+            if not self._allows(bucket):
+                return False
+            if self.attempts:
+                bucket[0] -= 1
+            return True
+
+    def failed(self, key):
+        """
+        Take a failure token of key
+        """
+        if not self.failures or self.maxsize <= 0:
+            return
+        with self._lock:
+            bucket = self._bucket(key)
+            bucket[1] = max(bucket[1] - 1, 0)
+
+    def succeeded(self, key):
+        """
+        Forget failed logins of key
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[1] = self.failures
+
+    def clear(self):
+        """
+        Forget all keys
+        """
+        with self._lock:
+            self._buckets.clear()
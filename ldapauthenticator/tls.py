@@ -0,0 +1,95 @@
+"""
+TLS configuration resuming sessions across ldap connections
+"""
+
+import ssl
+import threading
+from ldap3 import Tls
+from ldap3.core.tls import check_hostname
+from ldapauthenticator.metrics import TLS_HANDSHAKES
+
+
+class ResumingTls(Tls):
+    """
+    ldap3 Tls wrapping all sockets to a server with one SSLContext and
+    offering the last session negotiated with the server for resumption, so
+    new connections complete StartTLS with an abbreviated handshake.
+
+    Use a separate instance per server.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Tls.__init__(self, *args, **kwargs)
+        self.session = None
+        self._context = None
+        self._lock = threading.Lock()
+
+    def ssl_context(self):
+        """
+        Return SSLContext shared by all connections, created on first use
+        """
+        with self._lock:
+            if self._context is None:
+                self._context = self._create_context()
+            return self._context
+
+    def _create_context(self):
+        # same settings as the context ldap3 creates for every socket
+        if self.version is None:
+            context = ssl.create_default_context(
+                ssl.Purpose.SERVER_AUTH,
+                cafile=self.ca_certs_file,
+                capath=self.ca_certs_path,
+                cadata=self.ca_certs_data)
+        else:
+            context = ssl.SSLContext(self.version)
+            if self.ca_certs_file or self.ca_certs_path or self.ca_certs_data:
+                context.load_verify_locations(self.ca_certs_file, self.ca_certs_path, self.ca_certs_data)
+            elif self.validate != ssl.CERT_NONE:
+                context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+        if self.certificate_file:
+            context.load_cert_chain(
+                self.certificate_file, keyfile=self.private_key_file, password=self.private_key_password)
+        context.check_hostname = False
+        context.verify_mode = self.validate
+        for option in self.ssl_options:
+            context.options |= option
+        if self.ciphers:
+            try:
+                context.set_ciphers(self.ciphers)
+            except ssl.SSLError:
+                pass
+        return context
+
+    def wrap_socket(self, connection, do_handshake=False):
+        """
+        Add TLS to the connection socket, resuming the last saved session
+        """
+        wrapped_socket = self.ssl_context().wrap_socket(
+            connection.socket,
+            server_side=False,
+            do_handshake_on_connect=do_handshake,
+            server_hostname=self.sni,
+            session=self.session)
+        if do_handshake and self.validate in (ssl.CERT_REQUIRED, ssl.CERT_OPTIONAL):
+            check_hostname(wrapped_socket, connection.server.host, self.valid_names)
+        connection.socket = wrapped_socket
+        if do_handshake:
+            TLS_HANDSHAKES.labels(
+                server=connection.server.host,
+                resumed='true' if wrapped_socket.session_reused else 'false').inc()
+            self.save_session(connection)
+
+    def save_session(self, connection):
+        """
+        Keep TLS session of connection for resumption by later connections.
+        TLS 1.3 sessions only become resumable once the server's session
+        ticket arrived with the first response after the handshake.
+        """
+        sock = getattr(connection, 'socket', None)
+        if not isinstance(sock, ssl.SSLSocket):
+            return
+        session = sock.session
+        if session is None or (sock.version() == 'TLSv1.3' and not session.has_ticket):
+            return
+        self.session = session
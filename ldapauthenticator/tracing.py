@@ -0,0 +1,119 @@
+"""
+Timelines of slow logins kept for inspection by admins
+"""
+
+import collections
+import threading
+import time
+from datetime import datetime, timezone
+
+# longer search filters are truncated in traces
+MAX_FILTER_LENGTH = 200
+
+
+class Trace(object):
+    """
+    Timeline of the phases, ldap operations and subprocess calls of a single
+    login or user provisioning.
+
+    Events may be added from the event loop and from executor threads.
+    """
+
+    def __init__(self, kind, username):
+        self.kind = kind
+        self.username = username
+        self.result = None
+        self.operations = 0
+        self.duration = None
+        self.events = list()
+        self.templates = list()
+        self.created = time.time()
+        self.start = time.monotonic()
+
+    def add(self, event, duration, **fields):
+        """
+        Add event that took `duration` seconds and just ended. Fields that
+        are None are left out.
+        """
+        fields = {key: value for key, value in fields.items() if value is not None}
+        fields['event'] = event
+        fields['start_ms'] = round((time.monotonic() - duration - self.start) * 1000, 3)
+        fields['duration_ms'] = round(duration * 1000, 3)
+        self.events.append(fields)
+
+    def template(self, value, template):
+        """
+        Record `value` in search filters as the `template` it was formatted
+        from, so user input is only kept in the username of the trace
+        """
+        self.templates.append((value, template))
+
+    def add_search(self, server, duration, search, size=None, failed=False):
+        """
+        Add ldap search with the base and filter of the Connection.search
+        keyword arguments `search`
+        """
+        search_filter = search.get('search_filter') or ''
+        for value, template in self.templates:
+            search_filter = search_filter.replace(value, template)
+        if len(search_filter) > MAX_FILTER_LENGTH:
+            search_filter = search_filter[:MAX_FILTER_LENGTH] + '...'
+        self.add(
+            'search', duration, server=server, base=search.get('search_base'), filter=search_filter,
+            size=size, failed=failed or None)
+
+    def finish(self, result, operations=0):
+        """
+        Record result and total duration
+        """
+        self.result = result
+        self.operations = operations
+        self.duration = time.monotonic() - self.start
+
+    def as_dict(self):
+        """
+        Return JSON serializable trace
+        """
+        return {
+            'kind': self.kind,
+            'username': self.username,
+            'result': self.result,
+            'started': datetime.fromtimestamp(self.created, timezone.utc).isoformat(),
+            'duration_ms': None if self.duration is None else round(self.duration * 1000, 3),
+            'operations': self.operations,
+            'events': sorted(self.events, key=lambda event: event['start_ms']),
+        }
+
+
+class TraceBuffer(object):
+    """
+    Thread-safe ring buffer keeping the last `size` traces
+    """
+
+    def __init__(self, size=100):
+        self._traces = collections.deque(maxlen=max(size, 0))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._traces)
+
+    def add(self, trace):
+        """
+        Keep trace, dropping the oldest trace if full
+        """
+        with self._lock:
+            self._traces.append(trace)
+
+    def traces(self):
+        """
+        Return kept traces, newest first
+        """
+        with self._lock:
+            return list(reversed(self._traces))
+
+    def clear(self):
+        """
+        Drop all traces
+        """
+        with self._lock:
+            self._traces.clear()
@@ -13,8 +13,8 @@ DESCRIPTION = 'LDAP Authenticator for JupyterHub'
 AUTHOR = 'Ryan Hansohn'
 EMAIL = 'info@imnorobot.com'
 URL = 'https://github.com/hansohn/jupyterhub-ldap-authenticator'
-REQUIRES_PYTHON = '~=3.4'
-REQUIRED = ['ldap3', 'jupyterhub', 'traitlets']
+REQUIRES_PYTHON = '>=3.6'
+REQUIRED = ['ldap3', 'jupyterhub>=2.0', 'prometheus_client', 'traitlets']
 KEYWORDS = ['ldap', 'authenticator', 'authentication', 'jupyterhub', 'jupyter']
 
 # ------------------------------------------------------------------------------
@@ -47,6 +47,11 @@ setup_args = dict(
     url=URL,
     packages=find_packages(exclude=('tests',)),
     install_requires=REQUIRED,
+    entry_points={
+        'console_scripts': [
+            'jupyterhub-ldap-check-users = ldapauthenticator.cli:main',
+        ],
+    },
     include_package_data=True,
     license='MIT',
     keywords=KEYWORDS,
@@ -0,0 +1,211 @@
+"""
+Fixtures serving LDAPAuthenticator from an in-memory directory
+"""
+
+import asyncio
+import re
+from types import SimpleNamespace
+import ldap3
+import pytest
+from ldap3.operation.search import MATCH_EXTENSIBLE
+from ldap3.strategy.mockSync import MockSyncStrategy
+from ldap3.utils.conv import to_unicode
+from prometheus_client import REGISTRY
+from tornado.ioloop import IOLoop
+from ldapauthenticator import LDAPAuthenticator
+from ldapauthenticator.ldapauthenticator import IN_CHAIN_MATCHING_RULE
+
+BASE_DN = 'dc=example,dc=com'
+USER_BASE_DN = 'ou=users,' + BASE_DN
+GROUP_BASE_DN = 'ou=groups,' + BASE_DN
+SERVICE_DN = 'cn=svc,' + BASE_DN
+SERVICE_PASSWORD = 'svc-password'
+PASSWORD = 'password'
+HUB_GROUP_DN = 'cn=hub,' + GROUP_BASE_DN
+NESTED_GROUP_DN = 'cn=nested,' + GROUP_BASE_DN
+DEEP_GROUP_DN = 'cn=deep,' + GROUP_BASE_DN
+OTHER_GROUP_DN = 'cn=other,' + GROUP_BASE_DN
+
+# settings of an authenticator using the directory fixture
+DIRECTORY_SETTINGS = dict(
+    server_hosts=['ldap.example.com'],
+    bind_user_dn=SERVICE_DN,
+    bind_user_password=SERVICE_PASSWORD,
+    user_search_base=USER_BASE_DN,
+    user_search_filter='(&(objectClass=person)(uid={username}))',
+    group_search_base=GROUP_BASE_DN,
+    group_search_filter='(&(objectClass=group)(memberOf={group}))',
+    allowed_groups=[HUB_GROUP_DN],
+)
+
+# extensible match as rendered into the search request by MOCK_SYNC
+MOCK_EXTENSIBLE_MATCH = re.compile(
+    r'ExtensibleMatch:\n matchingRule=(?P<rule>[^\n]*)\n type=(?P<attr>[^\n]*)\n'
+    r' matchValue=(?P<value>[^\n]*)\n dnAttributes=\w+\n')
+
+
+class FakeClock(object):
+    """
+    Timer advanced by hand
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class InChainMockStrategy(MockSyncStrategy):
+    """
+    MOCK_SYNC strategy that also evaluates Active Directory's
+    LDAP_MATCHING_RULE_IN_CHAIN by following memberOf values
+    """
+
+    def _execute_search(self, request):
+        # MOCK_SYNC passes extensible matches on as their repr, restore them
+        request['filter'] = MOCK_EXTENSIBLE_MATCH.sub(
+            lambda match: '{attr}:{rule}:={value}'.format(**match.groupdict()), request['filter'])
+        return super()._execute_search(request)
+
+    def evaluate_filter_node(self, node, candidates):
+        if node.tag != MATCH_EXTENSIBLE or node.assertion['matchingRule'] != IN_CHAIN_MATCHING_RULE:
+            return super().evaluate_filter_node(node, candidates)
+        node.matched = set()
+        node.unmatched = set()
+        group = to_unicode(node.assertion['value']).lower()
+        for candidate in candidates:
+            if group in self.nested_values(candidate, node.assertion['attr']):
+                node.matched.add(candidate)
+            else:
+                node.unmatched.add(candidate)
+
+    def nested_values(self, dn, attribute):
+        """
+        Return lowercase dns reachable from dn through attribute
+        """
+        found = set()
+        pending = [dn]
+        while pending:
+            entry = self.connection.server.dit.get(pending.pop())
+            for value in (entry or {}).get(attribute, ()):
+                value = to_unicode(value).lower()
+                if value not in found:
+                    found.add(value)
+                    pending.append(value)
+        return found
+
+
+class MockLDAPAuthenticator(LDAPAuthenticator):
+    """
+    LDAPAuthenticator bound to an in-memory directory, recording the filter
+    of every search
+    """
+
+    directory = None
+    search_filters = None
+
+    def ldap_connection(self, server_pool, username, password):
+        conn = ldap3.Connection(
+            self.directory,
+            user=username,
+            password=password,
+            client_strategy=ldap3.MOCK_SYNC,
+            read_only=True,
+            auto_range=False)
+        conn.strategy.__class__ = InChainMockStrategy
+        search = conn.search
+
+        def recorded_search(search_base, search_filter, *args, **kwargs):
+            self.search_filters.append(search_filter)
+            return search(search_base, search_filter, *args, **kwargs)
+
+        conn.search = recorded_search
+        return conn if conn.bind() else None
+
+
+def authenticate(io_loop, authenticator, username, password=PASSWORD, client_ip=None):
+    """
+    Return result of authenticating username with password, sent from
+    client_ip if given
+    """
+    handler = None if client_ip is None else SimpleNamespace(request=SimpleNamespace(remote_ip=client_ip))
+    return io_loop.run_sync(lambda: authenticator.authenticate(
+        handler, {'username': username, 'password': password}))
+
+
+def login_results(result):
+    """
+    Return number of logins with result so far
+    """
+    return REGISTRY.get_sample_value('ldapauthenticator_logins_total', {'result': result}) or 0.0
+
+
+@pytest.fixture
+def io_loop():
+    """
+    Current IOLoop of a new asyncio event loop
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield IOLoop.current()
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def clock():
+    """
+    FakeClock starting at 0
+    """
+    return FakeClock()
+
+
+@pytest.fixture
+def directory():
+    """
+    Directory where alice is a member of the hub group, bob of a group
+    nested in it, dave of a group nested two levels deep and carol of an
+    unrelated group
+    """
+    server = ldap3.Server('mock-ldap')
+    conn = ldap3.Connection(server, client_strategy=ldap3.MOCK_SYNC)
+    add = conn.strategy.add_entry
+    add(SERVICE_DN, {'objectClass': 'person', 'cn': 'svc', 'userPassword': SERVICE_PASSWORD})
+    add(HUB_GROUP_DN, {'objectClass': 'group', 'cn': 'hub'})
+    add(NESTED_GROUP_DN, {'objectClass': 'group', 'cn': 'nested', 'memberOf': [HUB_GROUP_DN]})
+    add(DEEP_GROUP_DN, {'objectClass': 'group', 'cn': 'deep', 'memberOf': [NESTED_GROUP_DN]})
+    add(OTHER_GROUP_DN, {'objectClass': 'group', 'cn': 'other'})
+    members = (('alice', HUB_GROUP_DN), ('bob', NESTED_GROUP_DN), ('carol', OTHER_GROUP_DN), ('dave', DEEP_GROUP_DN))
+    for username, group in members:
+        add('uid={},{}'.format(username, USER_BASE_DN), {
+            'objectClass': 'person', 'uid': username, 'userPassword': PASSWORD, 'memberOf': [group]})
+    return server
+
+
+@pytest.fixture
+def make_authenticator(io_loop, directory):
+    """
+    Return factory of MockLDAPAuthenticators for directory, configured with
+    DIRECTORY_SETTINGS unless `defaults` is False, shut down after the test
+    """
+    authenticators = list()
+
+    def make(defaults=True, **config):
+        settings = dict(DIRECTORY_SETTINGS) if defaults else dict()
+        settings.update(config)
+        authenticator = MockLDAPAuthenticator(**settings)
+        authenticator.directory = directory
+        authenticator.search_filters = list()
+        for profile in authenticator.domain_profiles:
+            profile.authenticator.directory = directory
+            profile.authenticator.search_filters = authenticator.search_filters
+        authenticators.append(authenticator)
+        return authenticator
+
+    yield make
+    for authenticator in authenticators:
+        authenticator.shutdown()
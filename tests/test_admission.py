@@ -0,0 +1,88 @@
+"""
+Coalescing of concurrent identical logins and login admission control
+"""
+
+from tornado import gen, locks
+from conftest import PASSWORD, login_results
+
+
+def user_searches(authenticator, username):
+    return [f for f in authenticator.search_filters if 'uid={}'.format(username) in f]
+
+
+def login(authenticator, username, password=PASSWORD):
+    return authenticator.authenticate(None, {'username': username, 'password': password})
+
+
+def test_identical_logins_share_one_directory_round_trip(io_loop, make_authenticator):
+    authenticator = make_authenticator()
+    successes = login_results('success')
+    results = io_loop.run_sync(lambda: gen.multi([login(authenticator, 'alice') for _ in range(10)]))
+    assert [result['name'] for result in results] == ['alice'] * 10
+    assert len(user_searches(authenticator, 'alice')) == 1
+    assert login_results('success') == successes + 1
+
+
+def test_different_password_does_not_join_the_login(io_loop, make_authenticator):
+    authenticator = make_authenticator()
+    bad_passwords = login_results('bad_password')
+    results = io_loop.run_sync(lambda: gen.multi([
+        login(authenticator, 'alice'), login(authenticator, 'alice', 'wrong'), login(authenticator, 'alice')]))
+    assert results[0]['name'] == 'alice' and results[2] is results[0]
+    assert results[1] is None
+    assert login_results('bad_password') == bad_passwords + 1
+
+
+def blocked(authenticator):
+    """
+    Make ldap authentication of authenticator wait until the returned event
+    is set
+    """
+    release = locks.Event()
+    authenticate_ldap_user = authenticator.authenticate_ldap_user
+
+    @gen.coroutine
+    def wait_for_release(username, password, login=None):
+        yield release.wait()
+        response = yield authenticate_ldap_user(username, password, login)
+        return response
+
+    authenticator.authenticate_ldap_user = wait_for_release
+    return release
+
+
+def test_queue_overflow_rejects_the_login(io_loop, make_authenticator):
+    authenticator = make_authenticator(allow_nested_groups=True, login_concurrency_limit=1, login_queue_limit=1)
+    release = blocked(authenticator)
+    rejected = login_results('rejected')
+
+    @gen.coroutine
+    def overflow():
+        active, waiting = login(authenticator, 'alice'), login(authenticator, 'bob')
+        # active holds the only slot and waiting fills the queue
+        response = yield login(authenticator, 'dave')
+        assert response is None
+        assert login_results('rejected') == rejected + 1
+        release.set()
+        responses = yield [active, waiting]
+        return responses
+
+    active, waiting = io_loop.run_sync(overflow, timeout=5)
+    assert active['name'] == 'alice' and waiting['name'] == 'bob'
+
+
+def test_queue_timeout_rejects_the_login(io_loop, make_authenticator):
+    authenticator = make_authenticator(allow_nested_groups=True, login_concurrency_limit=1, login_queue_timeout=1)
+    release = blocked(authenticator)
+    rejected = login_results('rejected')
+
+    @gen.coroutine
+    def time_out():
+        active = login(authenticator, 'alice')
+        response = yield login(authenticator, 'bob')
+        release.set()
+        yield active
+        return response
+
+    assert io_loop.run_sync(time_out, timeout=5) is None
+    assert login_results('rejected') == rejected + 1
@@ -0,0 +1,132 @@
+"""
+User cache entries, their versioning by the configuration and their storage
+"""
+
+import json
+import sqlite3
+import time
+import pytest
+from ldap3.utils.ciDict import CaseInsensitiveDict
+from conftest import authenticate, login_results
+from ldapauthenticator.cache import SQLiteCache
+
+
+def user_searches(authenticator, username):
+    return [f for f in authenticator.search_filters if '(uid={})'.format(username) in f]
+
+
+def test_unknown_user_is_cached_until_evicted(io_loop, make_authenticator):
+    authenticator = make_authenticator(user_cache_negative_ttl=60)
+    key = authenticator.cache_key(authenticator.auth_plan, 'user', 'ghost')
+    unknown = login_results('no_such_user')
+    assert authenticate(io_loop, authenticator, 'ghost') is None
+    assert authenticator.user_cache.get(key) == ()
+    assert len(user_searches(authenticator, 'ghost')) == 1
+
+    # the empty search result is reused
+    assert authenticate(io_loop, authenticator, 'ghost') is None
+    assert len(user_searches(authenticator, 'ghost')) == 1
+    assert login_results('no_such_user') == unknown + 2
+
+    authenticator.evict_user('ghost')
+    assert authenticator.user_cache.get(key) is None
+    assert authenticate(io_loop, authenticator, 'ghost') is None
+    assert len(user_searches(authenticator, 'ghost')) == 2
+
+
+def test_negative_caching_can_be_disabled(io_loop, make_authenticator):
+    authenticator = make_authenticator(user_cache_negative_ttl=0)
+    for _ in range(2):
+        assert authenticate(io_loop, authenticator, 'ghost') is None
+    assert len(user_searches(authenticator, 'ghost')) == 2
+    assert authenticator.user_cache.get(authenticator.cache_key(authenticator.auth_plan, 'user', 'ghost')) is None
+
+
+@pytest.mark.parametrize('change', [
+    dict(allow_nested_groups=False),
+    dict(nested_groups_max_depth=0),
+    dict(server_side_group_filter=True),
+    dict(filter_by_group=False),
+])
+def test_authorization_settings_change_fingerprint(make_authenticator, change):
+    settings = dict(allow_nested_groups=True, nested_groups_max_depth=10)
+    fingerprint = make_authenticator(**settings).auth_plan.fingerprint
+    settings.update(change)
+    assert make_authenticator(**settings).auth_plan.fingerprint != fingerprint
+
+
+def test_shared_cache_misses_after_limiting_nesting_depth(io_loop, make_authenticator, tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    unlimited = make_authenticator(allow_nested_groups=True, cache_backend='sqlite', cache_path=cache_path)
+    assert authenticate(io_loop, unlimited, 'dave')['name'] == 'dave'
+
+    # restarted hub with a stricter configuration sharing the cache
+    limited = make_authenticator(
+        allow_nested_groups=True, nested_groups_max_depth=1, cache_backend='sqlite', cache_path=cache_path)
+    assert authenticate(io_loop, limited, 'dave') is None
+    assert authenticate(io_loop, limited, 'bob')['name'] == 'bob'
+
+
+def test_fingerprint_follows_configuration_changes(make_authenticator):
+    authenticator = make_authenticator(allow_nested_groups=True)
+    fingerprint = authenticator.auth_plan.fingerprint
+    authenticator.allow_nested_groups = False
+    assert authenticator.auth_plan.fingerprint != fingerprint
+
+
+def test_sqlite_cache_stores_json_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    response = [{
+        'dn': 'uid=alice,ou=people,dc=example,dc=com',
+        'raw_dn': b'uid=alice,ou=people,dc=example,dc=com',
+        'attributes': CaseInsensitiveDict({'memberOf': ['cn=hub,ou=groups,dc=example,dc=com']}),
+    }]
+    first = SQLiteCache(path, poll_interval=0.05)
+    second = SQLiteCache(path, poll_interval=0.05)
+    try:
+        first.set('user', response)
+        first.set('groups', frozenset(['cn=hub', 'cn=admins']))
+        first.flush()
+        with sqlite3.connect(path) as conn:
+            stored = dict(conn.execute('SELECT key, value FROM json_entries'))
+        assert json.loads(stored['groups']) == {'__set__': ['cn=admins', 'cn=hub']}
+
+        second.flush()
+        cached = second.get('user')
+        assert cached == response
+        assert cached[0]['raw_dn'] == response[0]['raw_dn']
+        assert cached[0]['attributes']['memberof'] == response[0]['attributes']['memberOf']
+        assert second.get('groups') == frozenset(['cn=hub', 'cn=admins'])
+
+        # removals reach the other process
+        second.pop('user')
+        second.flush()
+        first.flush()
+        assert first.get('user') is None
+    finally:
+        first.close()
+        second.close()
+
+    # entries are loaded again after a restart
+    restarted = SQLiteCache(path, poll_interval=0.05)
+    restarted.flush()
+    assert restarted.get('groups') == frozenset(['cn=hub', 'cn=admins'])
+    restarted.close()
+
+
+def test_sqlite_cache_does_not_wait_for_a_locked_database(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = SQLiteCache(path, poll_interval=0.05)
+    cache.flush()
+    lock = sqlite3.connect(path, isolation_level=None)
+    lock.execute('BEGIN EXCLUSIVE')
+    try:
+        started = time.monotonic()
+        cache.set('user', ['uid=alice'])
+        assert cache.get('user') == ['uid=alice']
+        assert cache.pop('user') == ['uid=alice']
+        assert time.monotonic() - started < 1
+    finally:
+        lock.rollback()
+        lock.close()
+        cache.close()
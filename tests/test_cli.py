@@ -0,0 +1,79 @@
+"""
+Command line check of usernames against a config file
+"""
+
+import pytest
+from ldap3.core.exceptions import LDAPSocketOpenError
+from tornado.ioloop import IOLoop
+from conftest import DIRECTORY_SETTINGS, USER_BASE_DN, MockLDAPAuthenticator
+from ldapauthenticator import cli
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    """
+    Return factory of config files with DIRECTORY_SETTINGS and `settings`
+    """
+    def write(**settings):
+        path = tmp_path / 'jupyterhub_config.py'
+        lines = ['c.LDAPAuthenticator.{} = {!r}'.format(name, value)
+                 for name, value in dict(DIRECTORY_SETTINGS, **settings).items()]
+        path.write_text('\n'.join(lines) + '\n')
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def check(directory, monkeypatch):
+    """
+    Run the command line check against directory, returning its exit status
+    """
+    class DirectoryAuthenticator(MockLDAPAuthenticator):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.directory = directory
+            self.search_filters = list()
+
+    monkeypatch.setattr(cli, 'LDAPAuthenticator', DirectoryAuthenticator)
+
+    def run(*argv):
+        try:
+            return cli.main(list(argv))
+        except SystemExit as exc:
+            return exc.code
+    return run
+
+
+def test_prints_status_of_each_user(check, config_file, capsys):
+    assert check('-f', config_file(), 'alice', 'carol', 'nobody') == cli.EXIT_DENIED
+    assert capsys.readouterr().out.splitlines() == [
+        'alice\tpermitted\tuid=alice,' + USER_BASE_DN,
+        'carol\tdenied\tuid=carol,' + USER_BASE_DN,
+        'nobody\tnot_found\t',
+    ]
+    assert check('-f', config_file(), '--denied', 'alice') == cli.EXIT_PERMITTED
+    assert capsys.readouterr().out == ''
+
+
+def test_ldap_error_is_reported_in_one_line(check, config_file, capsys, monkeypatch):
+    def unreachable(self, server_pool, username, password):
+        raise LDAPSocketOpenError('unable to open socket')
+
+    monkeypatch.setattr(MockLDAPAuthenticator, 'ldap_connection', unreachable)
+    assert check('-f', config_file(), 'alice') == cli.EXIT_LDAP_ERROR
+    assert capsys.readouterr().err == 'ldap error: LDAPSocketOpenError: unable to open socket\n'
+
+
+def test_configuration_error_is_reported(check, config_file, capsys):
+    assert check('-f', config_file(user_search_base=''), 'alice') == cli.EXIT_CONFIG_ERROR
+    assert capsys.readouterr().err.startswith('error: ')
+
+
+def test_schedules_no_background_work(check, config_file, monkeypatch):
+    scheduled = list()
+    monkeypatch.setattr(IOLoop, 'add_callback', lambda self, callback, *args, **kwargs: scheduled.append(callback))
+    config = config_file(
+        service_pool_min_size=2, authorization_index_enabled=True, server_standby_connections=2,
+        server_info_path='server_info.json')
+    assert check('-f', config, 'alice') == cli.EXIT_PERMITTED
+    assert scheduled == []
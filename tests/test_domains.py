@@ -0,0 +1,160 @@
+"""
+Usernames routed to the profiles of separate ldap domains
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from tornado import gen
+from conftest import DIRECTORY_SETTINGS, HUB_GROUP_DN, OTHER_GROUP_DN, PASSWORD, authenticate, login_results
+
+# two domains sharing the directory fixture, without global settings
+DOMAINS = {
+    'hub': dict(DIRECTORY_SETTINGS, allowed_groups=[HUB_GROUP_DN], username_regex='^(alice|bob)$'),
+    'other': dict(DIRECTORY_SETTINGS, allowed_groups=[OTHER_GROUP_DN], username_regex='^carol$'),
+}
+USERNAMES = ['alice', 'carol', 'dave', 'nobody']
+EXPECTED = {'alice': True, 'carol': True, 'dave': False, 'nobody': False}
+
+
+def test_login_uses_routed_domain(io_loop, make_authenticator):
+    authenticator = make_authenticator(defaults=False, domains=DOMAINS)
+    assert authenticator.auth_plan.error
+    assert authenticate(io_loop, authenticator, 'carol')['auth_state']['domain'] == 'other'
+    assert authenticate(io_loop, authenticator, 'alice')['auth_state']['domain'] == 'hub'
+    assert authenticate(io_loop, authenticator, 'dave') is None
+
+
+def test_batch_check_uses_routed_domains(make_authenticator):
+    authenticator = make_authenticator(defaults=False, domains=DOMAINS)
+    results = list(authenticator.iter_authorized_users(USERNAMES))
+    assert [result.username for result in results] == USERNAMES
+    assert dict((result.username, result.authorized) for result in results) == EXPECTED
+    # dave is routed to both domains and found by the first
+    assert [result.dn for result in results if result.username == 'dave'] == [
+        'uid=dave,ou=users,dc=example,dc=com']
+
+
+def test_async_batch_check_uses_routed_domains(io_loop, make_authenticator):
+    authenticator = make_authenticator(defaults=False, domains=DOMAINS)
+    batches = list()
+    authorized = io_loop.run_sync(lambda: authenticator.check_authorized_users(USERNAMES, batches.append))
+    assert authorized == EXPECTED
+    assert [result.username for batch in batches for result in batch] == USERNAMES
+
+
+def test_batch_check_names_unusable_domain(make_authenticator):
+    domains = dict(DOMAINS, broken=dict(username_regex='^nobody$'))
+    authenticator = make_authenticator(defaults=False, domains=domains)
+    with pytest.raises(ValueError, match="domain 'broken'"):
+        list(authenticator.iter_authorized_users(['nobody']))
+
+
+def cached_dave(profile):
+    domain = profile.authenticator
+    return domain.user_cache.get(domain.cache_key(domain.auth_plan, 'user', 'dave'))
+
+
+def test_domain_search_keeps_results_of_running_searches(io_loop, make_authenticator, caplog):
+    authenticator = make_authenticator(defaults=False, domains=DOMAINS)
+    hub, other = profiles = authenticator.route_domains('dave')
+    assert [profile.name for profile in profiles] == ['hub', 'other']
+    started = threading.Event()
+    other_lookup, hub_lookup = other.authenticator.lookup_user_steps, hub.authenticator.lookup_user_steps
+
+    def other_steps(*args):
+        started.set()
+        return (yield from other_lookup(*args))
+
+    def hub_steps(*args):
+        # the search of the other domain has started before hub finds dave
+        started.wait(5)
+        return (yield from hub_lookup(*args))
+
+    other.authenticator.lookup_user_steps = other_steps
+    hub.authenticator.lookup_user_steps = hub_steps
+    assert io_loop.run_sync(lambda: authenticator.find_user_domain(profiles, 'dave')) in profiles
+
+    # the search of the other domain still completes
+    for _ in range(50):
+        if all(cached_dave(profile) for profile in profiles):
+            break
+        io_loop.run_sync(lambda: gen.sleep(0.01))
+    assert all(len(cached_dave(profile)) == 1 for profile in profiles)
+    assert "User 'dave' found in domains" in caplog.text
+
+
+def test_domain_search_cancels_queued_searches(io_loop, make_authenticator):
+    authenticator = make_authenticator(defaults=False, domains=DOMAINS)
+    hub, other = profiles = authenticator.route_domains('dave')
+    other.authenticator.executor = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    other.authenticator.executor.submit(release.wait)
+    try:
+        assert io_loop.run_sync(lambda: authenticator.find_user_domain(profiles, 'dave')) is hub
+    finally:
+        release.set()
+    other.authenticator.executor.shutdown(wait=True)
+    io_loop.run_sync(lambda: gen.sleep(0.01))
+    assert len(authenticator.search_filters) == 1
+    assert cached_dave(other) is None
+
+
+def test_cached_user_is_found_without_searching(io_loop, make_authenticator):
+    authenticator = make_authenticator(defaults=False, domains=DOMAINS)
+    hub, other = profiles = authenticator.route_domains('dave')
+    other.authenticator.cache_user_response(other.authenticator.auth_plan, 'dave', [{'dn': 'uid=dave'}])
+    assert io_loop.run_sync(lambda: authenticator.find_user_domain(profiles, 'dave')) is other
+    assert authenticator.search_filters == []
+
+
+def test_domains_do_not_share_state(make_authenticator, tmp_path):
+    domains = dict(DOMAINS, other=dict(DOMAINS['other'], user_cache_ttl=30))
+    authenticator = make_authenticator(
+        defaults=False, domains=domains, user_cache_ttl=60, cache_backend='sqlite',
+        cache_path=str(tmp_path / 'cache.sqlite'), login_throttle_username_failures=5)
+    hub, other = (profile.authenticator for profile in authenticator.domain_profiles)
+    # global settings of DOMAIN_TRAITS are inherited unless overridden
+    assert (hub.user_cache_ttl, other.user_cache_ttl) == (60, 30)
+    # hub-wide settings and the state of a domain are not
+    for domain in (hub, other):
+        assert domain.cache_backend == 'memory' and domain.login_throttle_username_failures == 0
+        assert domain.executor is authenticator.executor
+    assert hub.user_cache is not other.user_cache
+    assert hub.service_pool is not other.service_pool
+    assert hub.server_selector is not other.server_selector
+    hub.cache_user_response(hub.auth_plan, 'dave', [{'dn': 'uid=dave'}])
+    assert cached_dave(authenticator.domain_profiles[1]) is None
+
+
+def test_hub_wide_settings_are_rejected_per_domain(make_authenticator):
+    domains = dict(DOMAINS, other=dict(DOMAINS['other'], login_throttle_window=10))
+    with pytest.raises(ValueError, match="domain 'other': login_throttle_window cannot be set per domain"):
+        make_authenticator(defaults=False, domains=domains)
+
+
+def test_domain_logins_share_the_executor_queue_limit(io_loop, make_authenticator):
+    authenticator = make_authenticator(defaults=False, domains=DOMAINS, executor_max_queue=1)
+    hub = authenticator.domain_profiles[0].authenticator
+    release = threading.Event()
+    hub_lookup = hub.lookup_user_steps
+
+    def blocked_steps(*args):
+        release.wait(5)
+        return (yield from hub_lookup(*args))
+
+    hub.lookup_user_steps = blocked_steps
+    rejected = login_results('rejected')
+
+    @gen.coroutine
+    def overflow():
+        active = authenticator.authenticate(None, {'username': 'alice', 'password': PASSWORD})
+        # the search of alice in domain hub occupies the only queue slot
+        response = yield authenticator.authenticate(None, {'username': 'carol', 'password': PASSWORD})
+        assert response is None
+        assert login_results('rejected') == rejected + 1
+        release.set()
+        response = yield active
+        return response
+
+    assert io_loop.run_sync(overflow, timeout=5)['name'] == 'alice'
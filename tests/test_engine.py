@@ -0,0 +1,273 @@
+"""
+Async ldap engine against a local ldap server
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import socket
+import threading
+import time
+import ldap3
+import pytest
+from ldap3.core.exceptions import LDAPResponseTimeoutError, LDAPSessionTerminatedByServerError
+from tornado import gen
+from ldapauthenticator.engine import AsyncLDAPEngine, engine_connection
+
+PASSWORD = 'secret'
+
+# seconds before the responder answers searches of these bases, None never
+DELAYS = {'cn=slow': 0.3, 'cn=late': 0.5, 'cn=silent': None}
+
+
+def read_tlv(data, offset=0):
+    """
+    Return (tag, value, end offset) of the BER element at offset
+    """
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    return tag, data[offset:offset + length], offset + length
+
+
+def tlv(tag, value):
+    length = len(value)
+    if length < 0x80:
+        return bytes([tag, length]) + value
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, 'big') + value
+
+
+def message(message_id, tag, value):
+    return tlv(0x30, tlv(0x02, message_id) + tlv(tag, value))
+
+
+def result(code):
+    return tlv(0x0a, bytes([code])) + tlv(0x04, b'') + tlv(0x04, b'')
+
+
+class LDAPResponder(object):
+    """
+    Plain ldap server on localhost answering simple binds, accepting
+    PASSWORD for every dn, and searches with a single entry named after
+    their base. Searches of the bases in DELAYS are answered late or never,
+    of 'cn=drop' by closing the connection. Tracks the largest number of
+    searches outstanding at once on a connection.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.most_outstanding = 0
+        self._lock = threading.Lock()
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def receive(self, sock, buffer):
+        while True:
+            if len(buffer) >= 2:
+                try:
+                    _, _, end = read_tlv(buffer)
+                except IndexError:
+                    end = None
+                if end is not None and end <= len(buffer):
+                    return buffer[:end], buffer[end:]
+            chunk = sock.recv(65536)
+            if not chunk:
+                return None, buffer
+            buffer += chunk
+
+    def serve(self, sock):
+        send_lock = threading.Lock()
+        outstanding = [0]
+
+        def answer(message_id, base):
+            entry = message(message_id, 0x64, tlv(0x04, base) + tlv(0x30, b''))
+            with send_lock:
+                outstanding[0] -= 1
+                try:
+                    sock.sendall(entry + message(message_id, 0x65, result(0)))
+                except OSError:
+                    pass
+
+        buffer = b''
+        try:
+            while True:
+                request, buffer = self.receive(sock, buffer)
+                if request is None:
+                    return
+                _, body, _ = read_tlv(request)
+                _, message_id, offset = read_tlv(body)
+                tag, operation, _ = read_tlv(body, offset)
+                if tag == 0x42:  # unbindRequest
+                    return
+                if tag == 0x60:  # bindRequest
+                    _, _, offset = read_tlv(operation)
+                    _, _, offset = read_tlv(operation, offset)
+                    _, password, _ = read_tlv(operation, offset)
+                    with send_lock:
+                        sock.sendall(message(message_id, 0x61, result(0 if password == PASSWORD.encode() else 49)))
+                elif tag == 0x63:  # searchRequest
+                    _, base, _ = read_tlv(operation)
+                    if base == b'cn=drop':
+                        return
+                    with send_lock:
+                        outstanding[0] += 1
+                        with self._lock:
+                            self.most_outstanding = max(self.most_outstanding, outstanding[0])
+                    delay = DELAYS.get(base.decode(), 0)
+                    if delay is not None:
+                        timer = threading.Timer(delay, answer, (message_id, base))
+                        timer.daemon = True
+                        timer.start()
+                else:
+                    return
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+
+@pytest.fixture
+def responder():
+    responder = LDAPResponder()
+    yield responder
+    responder.close()
+
+
+@pytest.fixture
+def make_engine(responder):
+    """
+    Return factory of AsyncLDAPEngines connecting to responder, closed after
+    the test. Operations are recorded in `engine.operations` as
+    (connection, name) pairs.
+    """
+    executor = ThreadPoolExecutor(4)
+    engines = list()
+
+    def connect(username=None):
+        conn = engine_connection(ldap3.Server('127.0.0.1', port=responder.port), user=username, password=PASSWORD)
+        conn.open(read_server_info=False)
+        if username is not None:
+            assert conn.bind(read_server_info=False)
+        return conn
+
+    def make(**kwargs):
+        operations = list()
+
+        @contextmanager
+        def operation(conn, name, login, search=None):
+            operations.append((conn, name))
+            yield
+
+        engine = AsyncLDAPEngine(
+            lambda: connect('cn=svc,dc=example,dc=com'), connect, executor, operation, **kwargs)
+        engine.operations = operations
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.close()
+    executor.shutdown(wait=True)
+
+
+def entry_dns(response):
+    return [entry['dn'] for entry in response[0]]
+
+
+def test_searches_are_pipelined_on_one_connection(io_loop, responder, make_engine):
+    engine = make_engine(connections=1)
+
+    @gen.coroutine
+    def search():
+        finished = list()
+
+        @gen.coroutine
+        def run(base):
+            response = yield engine.search(search_base=base, search_filter='(objectClass=*)')
+            finished.append(base)
+            return entry_dns(response)
+
+        responses = yield [run('cn=slow'), run('cn=fast'), run('cn=other')]
+        return responses, finished
+
+    responses, finished = io_loop.run_sync(search)
+    assert responses == [['cn=slow'], ['cn=fast'], ['cn=other']]
+    # the slow search did not hold back the searches sent after it
+    assert finished[-1] == 'cn=slow'
+    assert responder.connections == 1
+    assert responder.most_outstanding >= 2
+    assert len({conn for conn, _ in engine.operations}) == 1
+
+
+def test_bind_result(io_loop, make_engine):
+    engine = make_engine(bind_connections=1)
+    assert io_loop.run_sync(lambda: engine.bind('uid=alice,dc=example,dc=com', PASSWORD)) is True
+    assert io_loop.run_sync(lambda: engine.bind('uid=alice,dc=example,dc=com', 'wrong')) is False
+    # both binds ran on the same bind connection, kept for the next bind
+    binds = [conn for conn, name in engine.operations if name == 'bind']
+    assert len(binds) == 2 and binds[0] is binds[1]
+    assert engine.size == 1
+
+
+def test_timeout_abandons_the_message(io_loop, make_engine):
+    engine = make_engine(connections=1, timeout=0.1)
+    with pytest.raises(LDAPResponseTimeoutError):
+        io_loop.run_sync(lambda: engine.search(search_base='cn=late', search_filter='(objectClass=*)'))
+    conn = engine.operations[0][0]
+    assert conn.strategy._abandoned
+
+    # the late response is dropped when it arrives, the connection stays usable
+    time.sleep(0.6)
+    response = io_loop.run_sync(lambda: engine.search(search_base='cn=fast', search_filter='(objectClass=*)'))
+    assert entry_dns(response) == ['cn=fast']
+    assert not conn.strategy._abandoned
+    assert engine.operations[-1][0] is conn
+
+
+def test_closing_fails_outstanding_operations(io_loop, make_engine):
+    engine = make_engine(connections=1)
+
+    @gen.coroutine
+    def close_while_searching():
+        future = engine.search(search_base='cn=silent', search_filter='(objectClass=*)')
+        # the search is retried once on a new connection, close both
+        for attempt in (1, 2):
+            while len(engine.operations) < attempt:
+                yield gen.sleep(0.01)
+            yield gen.sleep(0.05)
+            engine.operations[-1][0].strategy.close()
+        yield future
+
+    with pytest.raises(LDAPSessionTerminatedByServerError):
+        io_loop.run_sync(close_while_searching, timeout=5)
+    assert len({conn for conn, _ in engine.operations}) == 2
+
+
+def test_dropped_connection_fails_the_search(io_loop, responder, make_engine):
+    engine = make_engine(connections=1)
+    with pytest.raises(LDAPSessionTerminatedByServerError):
+        io_loop.run_sync(lambda: engine.search(search_base='cn=drop', search_filter='(objectClass=*)'), timeout=5)
+    # the search was retried once on a new connection
+    assert responder.connections == 2
+    response = io_loop.run_sync(lambda: engine.search(search_base='cn=fast', search_filter='(objectClass=*)'))
+    assert entry_dns(response) == ['cn=fast']
@@ -0,0 +1,79 @@
+"""
+Queue depth limit of the ldap executor and release of its resources
+"""
+
+import atexit
+import threading
+import pytest
+from tornado import gen
+from conftest import PASSWORD, login_results
+
+
+def login(authenticator, username, password=PASSWORD):
+    return authenticator.authenticate(None, {'username': username, 'password': password})
+
+
+def test_background_work_does_not_count_towards_the_limit(io_loop, make_authenticator):
+    authenticator = make_authenticator(executor_max_queue=1, allow_nested_groups=True)
+
+    @gen.coroutine
+    def first_login():
+        # startup fills the service pool while expansions refresh in the background
+        background = [authenticator.prefill_service_pool(), authenticator.refresh_permitted_groups()]
+        assert authenticator._executor_pending == 0
+        response = yield login(authenticator, 'alice')
+        yield background
+        return response
+
+    rejected = login_results('rejected')
+    assert io_loop.run_sync(first_login, timeout=5)['name'] == 'alice'
+    assert login_results('rejected') == rejected
+    assert authenticator._executor_pending == 0
+
+
+def test_full_executor_rejects_the_login(io_loop, make_authenticator):
+    authenticator = make_authenticator(executor_max_queue=1)
+    release = threading.Event()
+    lookup_user_steps = authenticator.lookup_user_steps
+
+    def blocked_steps(plan, user_search_filter):
+        release.wait(5)
+        return (yield from lookup_user_steps(plan, user_search_filter))
+
+    authenticator.lookup_user_steps = blocked_steps
+    rejected = login_results('rejected')
+
+    @gen.coroutine
+    def overflow():
+        active = login(authenticator, 'alice')
+        # the search of alice occupies the only queue slot
+        response = yield login(authenticator, 'bob')
+        assert response is None
+        assert login_results('rejected') == rejected + 1
+        release.set()
+        response = yield active
+        return response
+
+    assert io_loop.run_sync(overflow, timeout=5)['name'] == 'alice'
+    assert authenticator._executor_pending == 0
+
+
+def test_shutdown_releases_executor_and_connections(io_loop, make_authenticator):
+    authenticator = make_authenticator()
+    io_loop.run_sync(lambda: login(authenticator, 'alice'))
+    assert authenticator.service_pool.size > 0
+    authenticator.shutdown()
+    assert authenticator.service_pool.size == 0
+    with pytest.raises(RuntimeError):
+        authenticator.executor.submit(print)
+    # shutting down again is harmless
+    authenticator.shutdown()
+
+
+def test_executor_is_shut_down_at_exit(make_authenticator, monkeypatch):
+    registered = list()
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    authenticator = make_authenticator()
+    assert registered == []
+    authenticator.executor
+    assert registered == [authenticator.shutdown]
@@ -0,0 +1,104 @@
+"""
+Admin API handlers served through a JupyterHub application
+"""
+
+import json
+import pytest
+from jupyterhub import orm, roles
+from jupyterhub.tests.mocking import MockHub
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from traitlets.config import Config
+from conftest import (
+    HUB_GROUP_DN, SERVICE_DN, SERVICE_PASSWORD, USER_BASE_DN, MockLDAPAuthenticator, authenticate)
+from ldapauthenticator.tracing import Trace
+
+
+@pytest.fixture
+def hub(io_loop, directory, tmp_path):
+    """
+    Initialized MockHub using MockLDAPAuthenticator, served on a local port
+    """
+    config = Config()
+    config.JupyterHub.cookie_secret_file = str(tmp_path / 'cookie_secret')
+    config.JupyterHub.authenticator_class = MockLDAPAuthenticator
+    config.LDAPAuthenticator.server_hosts = ['ldap.example.com']
+    config.LDAPAuthenticator.bind_user_dn = SERVICE_DN
+    config.LDAPAuthenticator.bind_user_password = SERVICE_PASSWORD
+    config.LDAPAuthenticator.user_search_base = USER_BASE_DN
+    config.LDAPAuthenticator.user_search_filter = '(uid={username})'
+    config.LDAPAuthenticator.allowed_groups = [HUB_GROUP_DN]
+    config.LDAPAuthenticator.service_pool_min_size = 0
+    app = MockHub(config=config)
+    io_loop.run_sync(app.initialize)
+    app.authenticator.directory = directory
+    app.authenticator.search_filters = list()
+    sock, port = bind_unused_port()
+    server = HTTPServer(app.tornado_application)
+    server.add_sockets([sock])
+    app.test_url = 'http://127.0.0.1:{}{}hub/api/ldap'.format(port, app.base_url)
+    yield app
+    server.stop()
+    app.authenticator.shutdown()
+    app.db_file.close()
+
+
+def api_token(app, name, admin, scopes=None):
+    """
+    Return api token of a new user, limited to scopes if given
+    """
+    user = orm.User(name=name, admin=admin)
+    app.db.add(user)
+    app.db.commit()
+    roles.assign_default_roles(app.db, entity=user)
+    app.users.add(user)
+    return user.new_api_token(scopes=scopes)
+
+
+def request(io_loop, app, path, token, method='GET'):
+    """
+    Return response of an api request authenticated with token
+    """
+    return io_loop.run_sync(lambda: AsyncHTTPClient().fetch(
+        app.test_url + path, method=method, raise_error=False,
+        headers={'Authorization': 'token {}'.format(token)}))
+
+
+def test_admin_lists_traces(io_loop, hub):
+    trace = Trace('login', 'alice')
+    trace.finish('success', operations=2)
+    hub.authenticator.login_traces.add(trace)
+    response = request(io_loop, hub, '/traces', api_token(hub, 'admin', admin=True))
+    assert response.code == 200
+    traces = json.loads(response.body.decode())['traces']
+    assert [(t['username'], t['result']) for t in traces] == [('alice', 'success')]
+
+
+def test_admin_evicts_cached_user(io_loop, hub):
+    authenticator = hub.authenticator
+    user_key = authenticator.cache_key(authenticator.auth_plan, 'user', 'alice')
+    assert authenticate(io_loop, authenticator, 'alice')['name'] == 'alice'
+    assert authenticator.user_cache.get(user_key) is not None
+    searches = len(authenticator.search_filters)
+    assert authenticate(io_loop, authenticator, 'alice')['name'] == 'alice'
+    assert len(authenticator.search_filters) == searches
+    response = request(io_loop, hub, '/cache/users/alice', api_token(hub, 'admin', admin=True), method='DELETE')
+    assert response.code == 204
+    assert authenticator.user_cache.get(user_key) is None
+    assert authenticate(io_loop, authenticator, 'alice')['name'] == 'alice'
+    assert len(authenticator.search_filters) > searches
+
+
+def test_non_admin_is_forbidden(io_loop, hub):
+    token = api_token(hub, 'student', admin=False)
+    assert request(io_loop, hub, '/traces', token).code == 403
+    assert request(io_loop, hub, '/traces', token, method='DELETE').code == 403
+    assert request(io_loop, hub, '/cache/users/alice', token, method='DELETE').code == 403
+
+
+def test_narrowly_scoped_admin_token_is_forbidden(io_loop, hub):
+    token = api_token(hub, 'admin', admin=True, scopes=['read:users:name!user=boss'])
+    assert request(io_loop, hub, '/traces', token).code == 403
+    assert request(io_loop, hub, '/traces', token, method='DELETE').code == 403
+    assert request(io_loop, hub, '/cache/users/alice', token, method='DELETE').code == 403
@@ -0,0 +1,52 @@
+"""
+Nested group membership resolved by the server with LDAP_MATCHING_RULE_IN_CHAIN,
+checked against client-side recursive expansion of the same directory
+"""
+
+import pytest
+from conftest import HUB_GROUP_DN, authenticate, login_results
+from ldapauthenticator.ldapauthenticator import IN_CHAIN_MATCHING_RULE, NESTED_GROUPS_STRATEGIES
+
+IN_CHAIN_FILTER = '(memberOf:{}:={})'.format(IN_CHAIN_MATCHING_RULE, HUB_GROUP_DN)
+
+
+@pytest.fixture(params=NESTED_GROUPS_STRATEGIES)
+def strategy(request):
+    return request.param
+
+
+def searched_in_chain(authenticator):
+    return any(IN_CHAIN_FILTER in search_filter for search_filter in authenticator.search_filters)
+
+
+@pytest.mark.parametrize('username', ['bob', 'dave'])
+def test_nested_group_members_are_authorized(io_loop, make_authenticator, strategy, username):
+    authenticator = make_authenticator(allow_nested_groups=True, nested_groups_strategy=strategy)
+    successes = login_results('success')
+    user = authenticate(io_loop, authenticator, username)
+    assert user['name'] == username
+    assert login_results('success') == successes + 1
+    assert searched_in_chain(authenticator) == (strategy == 'in_chain')
+
+
+def test_users_outside_allowed_groups_are_denied(io_loop, make_authenticator, strategy):
+    authenticator = make_authenticator(allow_nested_groups=True, nested_groups_strategy=strategy)
+    denied = login_results('not_in_group')
+    assert authenticate(io_loop, authenticator, 'carol') is None
+    assert login_results('not_in_group') == denied + 1
+    assert searched_in_chain(authenticator) == (strategy == 'in_chain')
+
+
+def test_in_chain_skips_client_side_group_expansion(io_loop, make_authenticator):
+    authenticator = make_authenticator(allow_nested_groups=True, nested_groups_strategy='in_chain')
+    assert authenticate(io_loop, authenticator, 'alice')['name'] == 'alice'
+    assert not any('objectClass=group' in search_filter for search_filter in authenticator.search_filters)
+
+
+def test_batch_check_matches_login_path(make_authenticator, strategy):
+    authenticator = make_authenticator(allow_nested_groups=True, nested_groups_strategy=strategy)
+    results = {result.username: result.authorized for result in authenticator.iter_authorized_users(
+        ['alice', 'bob', 'carol', 'dave', 'nobody'])}
+    assert results == {'alice': True, 'bob': True, 'carol': False, 'dave': True, 'nobody': False}
+    expanded = any('objectClass=group' in search_filter for search_filter in authenticator.search_filters)
+    assert expanded == (strategy == 'recursive')
@@ -0,0 +1,65 @@
+"""
+Preloaded authorization index kept current by incremental syncs
+"""
+
+import ldap3
+from conftest import HUB_GROUP_DN, OTHER_GROUP_DN, PASSWORD, SERVICE_DN, SERVICE_PASSWORD, USER_BASE_DN, authenticate
+from ldapauthenticator.index import generalized_time
+
+INDEX = dict(allow_nested_groups=True, authorization_index_enabled=True)
+
+
+def refresh(io_loop, authenticator):
+    io_loop.run_sync(authenticator.refresh_authorization_index)
+    return authenticator._authorization_index
+
+
+def user_searches(authenticator, username):
+    return [f for f in authenticator.search_filters if '(uid={})'.format(username) in f]
+
+
+def test_index_holds_members_of_nested_groups(io_loop, make_authenticator):
+    authenticator = make_authenticator(**INDEX)
+    index = refresh(io_loop, authenticator)
+    assert sorted(index._members) == ['alice', 'bob', 'dave']
+    assert index.get('bob') == 'uid=bob,' + USER_BASE_DN
+
+    # indexed users only have their password verified
+    assert authenticate(io_loop, authenticator, 'bob')['name'] == 'bob'
+    assert authenticate(io_loop, authenticator, 'bob', 'wrong') is None
+    assert user_searches(authenticator, 'bob') == []
+    # users missing from the index are looked up as usual
+    assert authenticate(io_loop, authenticator, 'carol') is None
+    assert user_searches(authenticator, 'carol')
+
+
+def test_sync_picks_up_modified_users(io_loop, directory, make_authenticator):
+    authenticator = make_authenticator(**INDEX)
+    index = refresh(io_loop, authenticator)
+    built = index.built
+
+    conn = ldap3.Connection(directory, SERVICE_DN, SERVICE_PASSWORD, client_strategy=ldap3.MOCK_SYNC)
+    conn.bind()
+    now = generalized_time(0)
+    conn.strategy.add_entry('uid=erin,' + USER_BASE_DN, {
+        'objectClass': 'person', 'uid': 'erin', 'userPassword': PASSWORD, 'memberOf': [HUB_GROUP_DN],
+        'modifyTimestamp': now})
+    conn.modify('uid=bob,' + USER_BASE_DN, {
+        'memberOf': [(ldap3.MODIFY_REPLACE, [OTHER_GROUP_DN])], 'modifyTimestamp': [(ldap3.MODIFY_REPLACE, [now])]})
+
+    assert refresh(io_loop, authenticator) is index
+    assert index.built == built
+    assert sorted(index._members) == ['alice', 'dave', 'erin']
+    assert authenticate(io_loop, authenticator, 'erin')['name'] == 'erin'
+    assert user_searches(authenticator, 'erin') == []
+
+
+def test_index_snapshot_is_reloaded(io_loop, make_authenticator, tmp_path):
+    path = str(tmp_path / 'index.json')
+    built = refresh(io_loop, make_authenticator(authorization_index_path=path, **INDEX)).built
+    authenticator = make_authenticator(authorization_index_path=path, **INDEX)
+    io_loop.run_sync(authenticator.load_authorization_index)
+    index = authenticator._authorization_index
+    # the loaded snapshot was synced instead of rebuilt
+    assert index.built == built
+    assert sorted(index._members) == ['alice', 'bob', 'dave']
@@ -0,0 +1,48 @@
+"""
+Breadth-first nested group resolution with cycle detection and a depth limit
+"""
+
+import ldap3
+from conftest import DEEP_GROUP_DN, GROUP_BASE_DN, HUB_GROUP_DN, NESTED_GROUP_DN, USER_BASE_DN, PASSWORD, authenticate
+
+CYCLE_A_DN = 'cn=cycle-a,' + GROUP_BASE_DN
+CYCLE_B_DN = 'cn=cycle-b,' + GROUP_BASE_DN
+
+
+def group_searches(authenticator):
+    return [search_filter for search_filter in authenticator.search_filters if 'objectClass=group' in search_filter]
+
+
+def resolve(authenticator, groups):
+    return authenticator.service_pool.run(
+        authenticator.run_search_steps, authenticator.resolve_nested_groups_steps, groups)
+
+
+def test_cyclic_groups_terminate(io_loop, directory, make_authenticator):
+    add = ldap3.Connection(directory, client_strategy=ldap3.MOCK_SYNC).strategy.add_entry
+    add(CYCLE_A_DN, {'objectClass': 'group', 'cn': 'cycle-a', 'memberOf': [CYCLE_B_DN]})
+    add(CYCLE_B_DN, {'objectClass': 'group', 'cn': 'cycle-b', 'memberOf': [CYCLE_A_DN]})
+    add('uid=erin,' + USER_BASE_DN, {
+        'objectClass': 'person', 'uid': 'erin', 'userPassword': PASSWORD, 'memberOf': [CYCLE_B_DN]})
+    authenticator = make_authenticator(allowed_groups=[CYCLE_A_DN], allow_nested_groups=True)
+
+    assert resolve(authenticator, [CYCLE_A_DN]) == {CYCLE_B_DN}
+    # one search per level: cycle-a finds cycle-b, cycle-b only finds the visited cycle-a
+    assert len(group_searches(authenticator)) == 2
+    assert authenticate(io_loop, authenticator, 'erin')['name'] == 'erin'
+
+
+def test_unlimited_depth_searches_every_level(make_authenticator):
+    authenticator = make_authenticator(allow_nested_groups=True)
+    assert resolve(authenticator, [HUB_GROUP_DN]) == {NESTED_GROUP_DN, DEEP_GROUP_DN}
+    # hub, nested and deep, which has no nested groups
+    assert len(group_searches(authenticator)) == 3
+
+
+def test_max_depth_truncates_resolution(io_loop, make_authenticator):
+    authenticator = make_authenticator(allow_nested_groups=True, nested_groups_max_depth=1)
+    assert resolve(authenticator, [HUB_GROUP_DN]) == {NESTED_GROUP_DN}
+    assert len(group_searches(authenticator)) == 1
+    assert authenticate(io_loop, authenticator, 'bob')['name'] == 'bob'
+    # dave is two levels below the hub group
+    assert authenticate(io_loop, authenticator, 'dave') is None
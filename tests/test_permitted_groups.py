@@ -0,0 +1,124 @@
+"""
+Cached nested group expansion of allowed_groups: expiry, stale-while-revalidate,
+invalidation and back-off after failed refreshes, with a fake clock
+"""
+
+import threading
+import pytest
+from ldap3.core.exceptions import LDAPException
+from tornado import gen
+from conftest import PASSWORD
+
+TTL = 300
+STALE_TTL = 3600
+BACKOFF = 30
+
+
+@pytest.fixture
+def authenticator(make_authenticator, clock):
+    """
+    Authenticator expanding nested groups with a cache measured by clock,
+    counting its expansions in `expansions`
+    """
+    authenticator = make_authenticator(
+        allow_nested_groups=True, permitted_groups_timer=clock, permitted_groups_cache_ttl=TTL,
+        permitted_groups_cache_stale_ttl=STALE_TTL, permitted_groups_refresh_backoff=BACKOFF)
+    authenticator.expansions = 0
+    authenticator.unreachable = False
+    get_permitted_groups_steps = authenticator.get_permitted_groups_steps
+
+    def counted_steps(plan):
+        authenticator.expansions += 1
+        if authenticator.unreachable:
+            raise LDAPException('unable to expand groups')
+        return (yield from get_permitted_groups_steps(plan))
+
+    authenticator.get_permitted_groups_steps = counted_steps
+    return authenticator
+
+
+def login(io_loop, authenticator, username='bob'):
+    """
+    Return result of a login of username after any background refresh it
+    started has finished
+    """
+    @gen.coroutine
+    def login_and_refresh():
+        response = yield authenticator.authenticate(None, {'username': username, 'password': PASSWORD})
+        refresh = authenticator._permitted_groups_refresh
+        if refresh:
+            try:
+                yield refresh[1]
+            except LDAPException:
+                pass
+        return response
+    return io_loop.run_sync(login_and_refresh, timeout=5)
+
+
+def test_expansion_is_reused_until_it_expires(io_loop, authenticator, clock):
+    assert login(io_loop, authenticator)['name'] == 'bob'
+    clock.advance(TTL - 1)
+    assert login(io_loop, authenticator, 'dave')['name'] == 'dave'
+    assert authenticator.expansions == 1
+
+
+def test_expired_expansion_is_used_while_it_is_refreshed(io_loop, authenticator, clock):
+    login(io_loop, authenticator)
+    clock.advance(TTL + 1)
+    release = threading.Event()
+    get_permitted_groups_steps = authenticator.get_permitted_groups_steps
+
+    def blocked_steps(plan):
+        release.wait(5)
+        return (yield from get_permitted_groups_steps(plan))
+
+    authenticator.get_permitted_groups_steps = blocked_steps
+
+    @gen.coroutine
+    def login_during_refresh():
+        response = yield authenticator.authenticate(None, {'username': 'bob', 'password': PASSWORD})
+        # the login did not wait for the refresh it started
+        refresh = authenticator._permitted_groups_refresh
+        assert refresh is not None and not refresh[1].done()
+        release.set()
+        yield refresh[1]
+        return response
+
+    assert io_loop.run_sync(login_during_refresh, timeout=5)['name'] == 'bob'
+    assert authenticator.expansions == 2
+    assert authenticator._permitted_groups_cache[2] == clock.now
+
+
+def test_expansion_past_the_stale_window_is_searched_again(io_loop, authenticator, clock):
+    login(io_loop, authenticator)
+    clock.advance(TTL + STALE_TTL + 1)
+    authenticator.unreachable = True
+    # the login has to wait for the expansion, which fails
+    assert login(io_loop, authenticator) is None
+    assert authenticator.expansions == 2
+
+
+def test_invalidated_expansion_is_searched_again(io_loop, authenticator):
+    login(io_loop, authenticator)
+    authenticator.invalidate_permitted_groups()
+    assert login(io_loop, authenticator)['name'] == 'bob'
+    assert authenticator.expansions == 2
+
+
+def test_failed_refresh_backs_off(io_loop, authenticator, clock):
+    login(io_loop, authenticator)
+    clock.advance(TTL + 1)
+    authenticator.unreachable = True
+    assert login(io_loop, authenticator)['name'] == 'bob'
+    assert authenticator.expansions == 2
+    # logins within the back-off keep the expired expansion without refreshing
+    clock.advance(BACKOFF - 1)
+    for _ in range(3):
+        assert login(io_loop, authenticator)['name'] == 'bob'
+    assert authenticator.expansions == 2
+    clock.advance(2)
+    authenticator.unreachable = False
+    assert login(io_loop, authenticator)['name'] == 'bob'
+    assert authenticator.expansions == 3
+    assert authenticator._permitted_groups_failure is None
+    assert authenticator._permitted_groups_cache[2] == clock.now
@@ -0,0 +1,17 @@
+"""
+Password verification pipelined with the authorization searches
+"""
+
+import ldap3
+from conftest import HUB_GROUP_DN, PASSWORD, USER_BASE_DN, authenticate
+
+
+def test_user_dn_template_escapes_raw_username(io_loop, directory, make_authenticator):
+    conn = ldap3.Connection(directory, client_strategy=ldap3.MOCK_SYNC)
+    conn.strategy.add_entry('uid=a*b,' + USER_BASE_DN, {
+        'objectClass': 'person', 'uid': 'a*b', 'userPassword': PASSWORD, 'memberOf': [HUB_GROUP_DN]})
+    authenticator = make_authenticator(
+        pipeline_user_bind=True, user_dn_template='uid={username},' + USER_BASE_DN)
+    assert authenticator.pipelined_user_dn(authenticator.auth_plan, 'a\\2ab') == 'uid=a*b,' + USER_BASE_DN
+    assert authenticate(io_loop, authenticator, 'a*b')['name'] == 'a\\2ab'
+    assert authenticate(io_loop, authenticator, 'a*b', 'wrong') is None
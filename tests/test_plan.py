@@ -0,0 +1,34 @@
+"""
+Configuration compiled into an immutable auth plan
+"""
+
+from conftest import DEEP_GROUP_DN, HUB_GROUP_DN, NESTED_GROUP_DN, authenticate, login_results
+
+
+def test_plan_is_rebuilt_on_configuration_change(make_authenticator):
+    authenticator = make_authenticator()
+    plan = authenticator.auth_plan
+    assert authenticator.auth_plan is plan
+    authenticator.allowed_groups = [NESTED_GROUP_DN]
+    assert authenticator.auth_plan is not plan
+    assert authenticator.auth_plan.permitted_groups == frozenset([NESTED_GROUP_DN])
+    assert plan.permitted_groups == frozenset([HUB_GROUP_DN])
+
+
+def test_invalid_configuration_denies_login(io_loop, make_authenticator):
+    authenticator = make_authenticator(user_search_filter='(uid={user})')
+    assert 'user_search_filter' in authenticator.auth_plan.error
+    errors = login_results('config_error')
+    assert authenticate(io_loop, authenticator, 'alice') is None
+    assert login_results('config_error') == errors + 1
+
+
+def test_searches_keep_the_settings_of_their_plan(make_authenticator):
+    authenticator = make_authenticator(allow_nested_groups=True, nested_groups_max_depth=1)
+    plan = authenticator.auth_plan
+    # configuration changes while a login still holds the previous plan
+    authenticator.nested_groups_max_depth = 0
+    authenticator.allow_nested_groups = False
+    groups = authenticator.service_pool.run(authenticator.get_permitted_groups, plan)
+    assert groups == frozenset([HUB_GROUP_DN, NESTED_GROUP_DN])
+    assert DEEP_GROUP_DN not in groups
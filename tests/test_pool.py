@@ -0,0 +1,216 @@
+"""
+Pooled service connections and standby connections with a fake clock
+"""
+
+import itertools
+from types import SimpleNamespace
+import pytest
+from ldap3.core.exceptions import LDAPBindError, LDAPSessionTerminatedByServerError, LDAPSocketOpenError
+from ldapauthenticator.pool import LDAPConnectionPool, LDAPPoolTimeoutError, StandbyConnections
+
+
+class FakeConnection(object):
+    """
+    Bound connection whose rootDSE read returns `alive`
+    """
+
+    def __init__(self, number, server=None):
+        self.number = number
+        self.server = server
+        self.alive = True
+        self.closed = False
+        self.bound = True
+        self.probes = 0
+
+    def search(self, *args, **kwargs):
+        self.probes += 1
+        return self.alive
+
+    def unbind(self):
+        self.closed = True
+        self.bound = False
+
+
+class FakeFactory(object):
+    """
+    Connection factory recording the connections it opened
+    """
+
+    def __init__(self):
+        self.opened = list()
+        self._numbers = itertools.count()
+
+    def __call__(self, server=None):
+        conn = FakeConnection(next(self._numbers), server)
+        self.opened.append(conn)
+        return conn
+
+
+def make_pool(clock, factory=None, **kwargs):
+    return LDAPConnectionPool(factory or FakeFactory(), timer=clock, **kwargs)
+
+
+def test_idle_connections_above_min_size_are_evicted(clock):
+    pool = make_pool(clock, min_size=1, max_size=3, idle_timeout=10)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    assert pool.size == 2
+
+    clock.advance(5)
+    assert pool.acquire() is second
+    pool.release(second)
+    clock.advance(6)
+    # first has been idle for 11 seconds, second only for 6
+    assert pool.acquire() is second
+    assert first.closed and pool.size == 1
+    pool.release(second)
+
+    clock.advance(60)
+    # the last connection is kept for min_size
+    assert pool.acquire() is second
+    assert pool.size == 1
+
+
+def test_prefill_opens_min_size_connections(clock):
+    factory = FakeFactory()
+    pool = make_pool(clock, factory, min_size=2)
+    pool.prefill()
+    assert pool.size == 2 and len(factory.opened) == 2
+    assert not any(conn.closed for conn in factory.opened)
+
+
+def test_connections_idle_past_the_interval_are_health_checked(clock):
+    factory = FakeFactory()
+    pool = make_pool(clock, factory, health_check_interval=30)
+    conn = pool.acquire()
+    pool.release(conn)
+    clock.advance(10)
+    assert pool.acquire() is conn
+    assert conn.probes == 0
+    pool.release(conn)
+
+    clock.advance(31)
+    assert pool.acquire() is conn
+    assert conn.probes == 1
+    pool.release(conn)
+
+    # the server dropped the connection while it was idle
+    clock.advance(31)
+    conn.alive = False
+    replacement = pool.acquire()
+    assert replacement is not conn
+    assert conn.closed and pool.size == 1 and len(factory.opened) == 2
+
+
+def test_run_rebinds_after_the_server_drops_the_connection(clock):
+    factory = FakeFactory()
+    pool = make_pool(clock, factory)
+    calls = list()
+
+    def search(conn):
+        calls.append(conn)
+        if len(calls) == 1:
+            conn.closed = True
+            raise LDAPSessionTerminatedByServerError('connection reset')
+        return conn.number
+
+    assert pool.run(search) == 1
+    assert [conn.number for conn in calls] == [0, 1]
+    assert pool.size == 1
+    assert pool.acquire() is factory.opened[1]
+
+
+def test_run_gives_up_after_the_retry(clock):
+    pool = make_pool(clock)
+
+    def search(conn):
+        raise LDAPSessionTerminatedByServerError('connection reset')
+
+    with pytest.raises(LDAPSessionTerminatedByServerError):
+        pool.run(search)
+    assert pool.size == 0
+
+
+def test_failed_opens_give_up_their_slot(clock):
+    def unreachable():
+        raise LDAPSocketOpenError('server unreachable')
+
+    pool = make_pool(clock, unreachable, max_size=1)
+    with pytest.raises(LDAPSocketOpenError):
+        pool.acquire()
+    pool.factory = lambda: None
+    with pytest.raises(LDAPBindError):
+        pool.acquire()
+    assert pool.size == 0
+
+
+def test_acquire_times_out_when_all_connections_are_checked_out(clock):
+    pool = make_pool(clock, max_size=1)
+    pool.acquire()
+    with pytest.raises(LDAPPoolTimeoutError):
+        pool.acquire(timeout=0.01)
+
+
+def test_clear_closes_checked_out_connections_on_release(clock):
+    pool = make_pool(clock)
+    idle, checked_out = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    pool.clear()
+    assert idle.closed and not checked_out.closed
+    pool.release(checked_out)
+    assert checked_out.closed and pool.size == 0
+
+
+def servers(*hosts):
+    return [SimpleNamespace(host=host, port=636) for host in hosts]
+
+
+def make_standby(clock, factory, **kwargs):
+    return StandbyConnections(factory, lambda func, *args: func(*args), timer=clock, **kwargs)
+
+
+def test_standby_connections_are_handed_out_once_and_refilled(clock):
+    factory = FakeFactory()
+    standby = make_standby(clock, factory, size=2)
+    first, second = servers('ldap1', 'ldap2')
+    standby.fill([first, second])
+    assert standby.ready(first) == 2 and standby.ready(second) == 2
+
+    conn = standby.take([first, second])
+    assert conn.server is first
+    assert standby.take([first, second]) is not conn
+    # taken connections are replaced right away
+    assert standby.ready(first) == 2
+    assert len(factory.opened) == 6
+
+
+def test_standby_connections_expire_after_max_age(clock):
+    factory = FakeFactory()
+    standby = make_standby(clock, factory, size=1, max_age=60)
+    server, = servers('ldap1')
+    standby.fill([server])
+    stale = factory.opened[0]
+
+    clock.advance(61)
+    conn = standby.take([server])
+    assert conn is None and stale.closed
+    assert standby.take([server]) is factory.opened[1]
+
+    clock.advance(61)
+    standby.recycle([server])
+    assert factory.opened[2].closed
+    assert standby.ready(server) == 1
+
+
+def test_standby_connections_opened_before_clear_are_closed(clock):
+    factory = FakeFactory()
+    pending = list()
+    standby = StandbyConnections(factory, lambda func, *args: pending.append((func, args)), size=1, timer=clock)
+    server, = servers('ldap1')
+    standby.fill([server])
+    standby.clear()
+    func, args = pending.pop()
+    func(*args)
+    assert factory.opened[0].closed
+    assert standby.ready(server) == 0
@@ -0,0 +1,105 @@
+"""
+Home directory provisioning of the users JupyterHub adds at startup
+"""
+
+import threading
+import time
+import pytest
+from jupyterhub import orm
+from jupyterhub.tests.mocking import MockHub
+from traitlets.config import Config
+from conftest import MockLDAPAuthenticator
+
+NAMES = ['user{}'.format(i) for i in range(8)]
+
+
+class SlowHomeDirAuthenticator(MockLDAPAuthenticator):
+    """
+    Authenticator whose home directory checks take 50ms, recording how many
+    ran at once and the ldap executor queue depth seen meanwhile
+    """
+
+    checked = None
+    running = 0
+    max_running = 0
+    max_executor_pending = 0
+    _lock = threading.Lock()
+
+    def user_home_dir_exists(self, username):
+        with self._lock:
+            self.checked.append(username)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.max_executor_pending = max(self.max_executor_pending, self._executor_pending)
+        time.sleep(0.05)
+        with self._lock:
+            self.running -= 1
+        return True
+
+
+class StartupHub(MockHub):
+    """
+    MockHub with NAMES in its database before the authenticator adds them
+    """
+
+    def init_db(self):
+        super().init_db()
+        for name in NAMES:
+            self.db.add(orm.User(name=name))
+        self.db.commit()
+
+
+@pytest.fixture
+def start_hub(io_loop, tmp_path):
+    """
+    Return function initializing a StartupHub with the authenticator
+    config passed to it
+    """
+    apps = list()
+
+    def start(**settings):
+        config = Config()
+        config.JupyterHub.cookie_secret_file = str(tmp_path / 'cookie_secret')
+        config.JupyterHub.authenticator_class = SlowHomeDirAuthenticator
+        config.LDAPAuthenticator.service_pool_min_size = 0
+        config.LDAPAuthenticator.home_dir_concurrency = 4
+        for name, value in settings.items():
+            setattr(config.LDAPAuthenticator, name, value)
+        SlowHomeDirAuthenticator.checked = list()
+        app = StartupHub(config=config)
+        apps.append(app)
+        io_loop.run_sync(app.initialize)
+        return app.authenticator
+
+    yield start
+    for app in apps:
+        app.authenticator.shutdown()
+        app.db_file.close()
+
+
+def test_startup_provisions_database_users_concurrently(start_hub):
+    authenticator = start_hub(create_user_home_dir=True)
+    assert sorted(authenticator.checked) == sorted(NAMES)
+    assert authenticator.max_running == 4
+    assert not authenticator._started_provisionings
+
+
+def test_startup_provisioning_leaves_ldap_executor_free(start_hub):
+    authenticator = start_hub(create_user_home_dir=True)
+    assert authenticator.max_executor_pending == 0
+
+
+def test_startup_provisioning_skipped_without_home_dir_creation(start_hub):
+    authenticator = start_hub(create_user_home_dir=False)
+    # add_user still checks that each user exists locally, one at a time
+    assert sorted(authenticator.checked) == sorted(NAMES)
+    assert authenticator.max_running == 1
+    assert authenticator._started_provisionings is None
+
+
+def test_startup_provisioning_does_not_need_check_allow_config(start_hub, monkeypatch):
+    # JupyterHub releases before 5.0 add the database users without calling it
+    monkeypatch.setattr(SlowHomeDirAuthenticator, 'check_allow_config', lambda self: None)
+    authenticator = start_hub(create_user_home_dir=True)
+    assert sorted(authenticator.checked) == sorted(NAMES)
+    assert authenticator.max_running == 4
@@ -0,0 +1,108 @@
+"""
+Active Directory range retrieval of large membership attributes
+"""
+
+from ldapauthenticator import LDAPAuthenticator
+
+USER_DN = 'CN=user,OU=Users,DC=example,DC=com'
+ALLOWED_DN = 'CN=allowed,OU=Groups,DC=example,DC=com'
+
+
+class RangedConnection(object):
+    """
+    Stand-in for an ldap3 connection serving the membership attribute of
+    one user entry in range retrieval pages of `page_size` values
+    """
+
+    def __init__(self, attribute, values, page_size):
+        self.attribute = attribute
+        self.values = values
+        self.page_size = page_size
+        self.server = None
+        self.response = None
+        self.result = None
+        self.ranges = list()
+
+    def page(self, start):
+        end = start + self.page_size - 1
+        if end >= len(self.values) - 1:
+            name = '{};range={}-*'.format(self.attribute, start)
+        else:
+            name = '{};range={}-{}'.format(self.attribute, start, end)
+        return {
+            'type': 'searchResEntry',
+            'dn': USER_DN,
+            'attributes': {self.attribute: [], name: self.values[start:end + 1]},
+        }
+
+    def search(self, search_base, search_filter, search_scope=None, attributes=None, **kwargs):
+        assert search_base == USER_DN
+        self.ranges.append(attributes[0].partition(';range=')[2])
+        start = int(self.ranges[-1].partition('-')[0])
+        self.response = [self.page(start)]
+        self.result = {'result': 0}
+        return True
+
+
+class CheckedGroups(frozenset):
+    """
+    Permitted groups recording every membership checked against them
+    """
+
+    def __init__(self, groups=()):
+        self.checked = list()
+
+    def __contains__(self, group):
+        self.checked.append(group)
+        return frozenset.__contains__(self, group)
+
+
+def membership_check(values, permitted, page_size=100):
+    authenticator = LDAPAuthenticator(
+        server_hosts=['ldap.example.com'],
+        bind_user_dn='CN=svc,DC=example,DC=com',
+        bind_user_password='unused',
+        user_search_base='OU=Users,DC=example,DC=com',
+        user_search_filter='(sAMAccountName={username})')
+    plan = authenticator.auth_plan
+    conn = RangedConnection(plan.user_membership_attribute, values, page_size)
+    groups = CheckedGroups(permitted)
+    found = authenticator.find_permitted_membership(conn, plan, conn.page(0), groups)
+    return found, groups.checked, conn.ranges
+
+
+def groups(count):
+    return ['CN=group-{:04d},OU=Groups,DC=example,DC=com'.format(i) for i in range(count)]
+
+
+def test_pages_are_read_until_the_last():
+    values = groups(350)
+    found, checked, ranges = membership_check(values, [ALLOWED_DN])
+    assert found is None
+    # every value of every page was checked once, in order
+    assert checked == values
+    assert ranges == ['100-*', '200-*', '300-*']
+
+
+def test_membership_in_the_last_page_is_found():
+    values = groups(350)
+    values[-1] = ALLOWED_DN
+    found, checked, ranges = membership_check(values, [ALLOWED_DN])
+    assert found == ALLOWED_DN
+    assert checked == values
+
+
+def test_reading_stops_at_the_first_permitted_group():
+    values = groups(350)
+    values[150] = ALLOWED_DN
+    found, checked, ranges = membership_check(values, [ALLOWED_DN])
+    assert found == ALLOWED_DN
+    assert checked == values[:151]
+    assert ranges == ['100-*']
+
+
+def test_single_page_needs_no_range_search():
+    values = groups(50)
+    found, checked, ranges = membership_check(values, [ALLOWED_DN])
+    assert found is None
+    assert checked == values and ranges == []
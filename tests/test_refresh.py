@@ -0,0 +1,66 @@
+"""
+Re-validation of logged in users' group memberships in refresh_user
+"""
+
+import ldap3
+from tornado import gen
+from conftest import NESTED_GROUP_DN, SERVICE_DN, SERVICE_PASSWORD, USER_BASE_DN, authenticate
+
+REFRESH = dict(allow_nested_groups=True, refresh_user_membership=True, enable_auth_state=True)
+
+
+class FakeUser(object):
+    """
+    Logged in JupyterHub user with the given auth_state
+    """
+
+    def __init__(self, name, auth_state=None):
+        self.name = name
+        self.auth_state = auth_state
+
+    @gen.coroutine
+    def get_auth_state(self):
+        return self.auth_state
+
+
+def refresh(io_loop, authenticator, user):
+    return io_loop.run_sync(lambda: authenticator.refresh_user(user))
+
+
+def test_refresh_keeps_permitted_users(io_loop, make_authenticator):
+    authenticator = make_authenticator(**REFRESH)
+    auth_state = authenticate(io_loop, authenticator, 'dave')['auth_state']
+    searches = len(authenticator.search_filters)
+    assert refresh(io_loop, authenticator, FakeUser('dave', auth_state)) is True
+    # a single read of dave's entry
+    assert len(authenticator.search_filters) == searches + 1
+    # without auth_state dave's dn is found by a user search and stored
+    assert refresh(io_loop, authenticator, FakeUser('dave')) == {'auth_state': auth_state}
+
+
+def test_refresh_revokes_users_no_longer_permitted(io_loop, make_authenticator):
+    authenticator = make_authenticator(**REFRESH)
+    carol = FakeUser('carol', {'dn': 'uid=carol,' + USER_BASE_DN, 'membership': 'anything'})
+    assert refresh(io_loop, authenticator, carol) is False
+    ghost = FakeUser('ghost', {'dn': 'uid=ghost,' + USER_BASE_DN, 'membership': 'anything'})
+    assert refresh(io_loop, authenticator, ghost) is False
+    assert refresh(io_loop, authenticator, FakeUser('ghost')) is False
+
+
+def test_refresh_records_changed_memberships(io_loop, directory, make_authenticator):
+    authenticator = make_authenticator(**REFRESH)
+    auth_state = authenticate(io_loop, authenticator, 'alice')['auth_state']
+    conn = ldap3.Connection(directory, SERVICE_DN, SERVICE_PASSWORD, client_strategy=ldap3.MOCK_SYNC)
+    conn.bind()
+    conn.modify('uid=alice,' + USER_BASE_DN, {'memberOf': [(ldap3.MODIFY_ADD, [NESTED_GROUP_DN])]})
+    result = refresh(io_loop, authenticator, FakeUser('alice', auth_state))
+    assert result['auth_state']['dn'] == auth_state['dn']
+    assert result['auth_state']['membership'] != auth_state['membership']
+    assert refresh(io_loop, authenticator, FakeUser('alice', result['auth_state'])) is True
+
+
+def test_refresh_accepts_logins_authorized_without_groups(io_loop, make_authenticator):
+    authenticator = make_authenticator(server_side_group_filter=True, **REFRESH)
+    auth_state = authenticate(io_loop, authenticator, 'bob')['auth_state']
+    assert auth_state['membership'] is None
+    assert refresh(io_loop, authenticator, FakeUser('bob', auth_state)) is True
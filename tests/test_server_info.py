@@ -0,0 +1,109 @@
+"""
+Server information snapshot read once and attached to every server
+"""
+
+import ldap3
+import pytest
+from ldap3.protocol.rfc4512 import DsaInfo, SchemaInfo
+from ldap3.protocol.schemas.ad2012R2 import ad_2012_r2_dsa_info, ad_2012_r2_schema
+from traitlets.config import Config
+from ldapauthenticator import LDAPAuthenticator
+
+DOMAINS = {
+    'hub': dict(username_suffix='@hub.example.com', server_hosts=['ldap.hub.example.com']),
+    'other': dict(username_suffix='@other.example.com', server_hosts=['ldap.other.example.com']),
+}
+
+
+@pytest.fixture
+def info():
+    return DsaInfo.from_json(ad_2012_r2_dsa_info), SchemaInfo.from_json(ad_2012_r2_schema)
+
+
+@pytest.fixture
+def loading_authenticator(make_authenticator, info, tmp_path):
+    """
+    Authenticator with a snapshot path whose server information downloads
+    return info, counted in `downloads`
+    """
+    authenticator = make_authenticator()
+    # set after construction so the snapshot is only loaded by the test
+    authenticator.server_info_path = str(tmp_path / 'server_info.json')
+    authenticator.downloads = 0
+
+    def download_server_info(plan):
+        authenticator.downloads += 1
+        return info
+
+    authenticator.download_server_info = download_server_info
+    return authenticator
+
+
+def attached_schema(authenticator):
+    return [server.schema for server in authenticator.auth_plan.server_pool.servers]
+
+
+def test_snapshot_is_read_back(info, tmp_path):
+    path = str(tmp_path / 'server_info.json')
+    LDAPAuthenticator.write_server_info_snapshot(path, info)
+    dsa_info, schema = LDAPAuthenticator.read_server_info_snapshot(path)
+    assert dsa_info.to_json() == info[0].to_json()
+    assert schema.to_json() == info[1].to_json()
+    assert list(tmp_path.iterdir()) == [tmp_path / 'server_info.json']
+
+
+def test_missing_snapshot_is_downloaded_and_saved(io_loop, loading_authenticator, info):
+    authenticator = loading_authenticator
+    assert LDAPAuthenticator.read_server_info_snapshot(authenticator.server_info_path) is None
+    io_loop.run_sync(authenticator.load_server_info)
+    assert authenticator.downloads == 1
+    assert attached_schema(authenticator) == [info[1]]
+    saved = LDAPAuthenticator.read_server_info_snapshot(authenticator.server_info_path)
+    assert saved[1].to_json() == info[1].to_json()
+    # the next start reads the snapshot
+    io_loop.run_sync(authenticator.load_server_info)
+    assert authenticator.downloads == 1
+
+
+@pytest.mark.parametrize('content', ['{"dsa_info": ', '{}', '[]'])
+def test_corrupt_snapshot_is_replaced(io_loop, loading_authenticator, info, content):
+    authenticator = loading_authenticator
+    with open(authenticator.server_info_path, 'w') as f:
+        f.write(content)
+    io_loop.run_sync(authenticator.load_server_info)
+    assert authenticator.downloads == 1
+    assert attached_schema(authenticator) == [info[1]]
+    assert LDAPAuthenticator.read_server_info_snapshot(authenticator.server_info_path) is not None
+
+
+def test_failed_download_leaves_servers_without_information(io_loop, loading_authenticator):
+    authenticator = loading_authenticator
+
+    def unreachable(plan):
+        raise ldap3.core.exceptions.LDAPSocketOpenError('unable to open socket')
+
+    authenticator.download_server_info = unreachable
+    io_loop.run_sync(authenticator.load_server_info)
+    assert attached_schema(authenticator) == [None]
+    assert LDAPAuthenticator.read_server_info_snapshot(authenticator.server_info_path) is None
+
+
+def test_server_information_is_not_read_by_default():
+    authenticator = LDAPAuthenticator(server_hosts=['ldap.example.com'])
+    try:
+        assert authenticator.server_get_info == 'NONE'
+        assert [server.get_info for server in authenticator.auth_plan.server_pool.servers] == [ldap3.NONE]
+    finally:
+        authenticator.shutdown()
+
+
+def test_domains_do_not_inherit_the_snapshot_path(io_loop):
+    config = Config()
+    config.LDAPAuthenticator.server_info_path = '/srv/jupyterhub/server_info.json'
+    domains = dict(DOMAINS, other=dict(DOMAINS['other'], server_info_path='/srv/jupyterhub/other.json'))
+    authenticator = LDAPAuthenticator(config=config, domains=domains)
+    try:
+        paths = {profile.name: profile.authenticator.server_info_path for profile in authenticator.domain_profiles}
+        assert paths == {'hub': '', 'other': '/srv/jupyterhub/other.json'}
+    finally:
+        authenticator.shutdown()
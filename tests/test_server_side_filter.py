@@ -0,0 +1,84 @@
+"""
+Group membership checked by the server with a membership filter in the user
+search ('server_side_group_filter')
+"""
+
+import ldap3
+import pytest
+from conftest import HUB_GROUP_DN, authenticate, login_results
+
+
+@pytest.fixture
+def searches(make_authenticator):
+    """
+    Return factory of authenticators filtering by group on the server,
+    with the list of (search_filter, attributes) of their searches
+    """
+    def make(**config):
+        authenticator = make_authenticator(server_side_group_filter=True, **config)
+        recorded = list()
+        ldap_connection = authenticator.ldap_connection
+
+        def recording_connection(server_pool, username, password):
+            conn = ldap_connection(server_pool, username, password)
+            if conn is not None:
+                search = conn.search
+
+                def recorded_search(search_base, search_filter, attributes=None, **kwargs):
+                    recorded.append((search_filter, attributes))
+                    return search(search_base, search_filter, attributes=attributes, **kwargs)
+
+                conn.search = recorded_search
+            return conn
+
+        authenticator.ldap_connection = recording_connection
+        return authenticator, recorded
+    return make
+
+
+def test_member_is_authorized_with_one_search(io_loop, searches):
+    authenticator, recorded = searches()
+    assert authenticate(io_loop, authenticator, 'alice')['name'] == 'alice'
+    assert len(recorded) == 1
+    search_filter, attributes = recorded[0]
+    assert 'memberOf={}'.format(HUB_GROUP_DN) in search_filter
+    assert attributes == ldap3.NO_ATTRIBUTES
+
+
+def test_non_member_is_denied_reading_only_the_dn(io_loop, searches):
+    authenticator, recorded = searches()
+    denied = login_results('not_in_group')
+    assert authenticate(io_loop, authenticator, 'carol') is None
+    assert login_results('not_in_group') == denied + 1
+    # the second search only tells a non-member from an unknown user
+    assert len(recorded) == 2
+    search_filter, attributes = recorded[1]
+    assert search_filter == '(&(objectClass=person)(uid=carol))'
+    assert attributes == ldap3.NO_ATTRIBUTES
+
+
+def test_unknown_user_is_reported_and_cached(io_loop, searches):
+    authenticator, recorded = searches()
+    unknown = login_results('no_such_user')
+    assert authenticate(io_loop, authenticator, 'nobody') is None
+    assert authenticate(io_loop, authenticator, 'nobody') is None
+    assert login_results('no_such_user') == unknown + 2
+    # the second login finds the empty response in the user cache
+    assert len(recorded) == 2
+
+
+@pytest.mark.parametrize('username', ['bob', 'dave'])
+def test_nested_group_members_are_authorized(io_loop, searches, username):
+    authenticator, recorded = searches(allow_nested_groups=True, nested_groups_strategy='recursive')
+    assert authenticate(io_loop, authenticator, username)['name'] == username
+    user_searches = [search_filter for search_filter, _ in recorded if 'uid={}'.format(username) in search_filter]
+    assert len(user_searches) == 1
+
+
+def test_nested_groups_deny_non_member(io_loop, searches):
+    authenticator, recorded = searches(allow_nested_groups=True, nested_groups_strategy='recursive')
+    denied = login_results('not_in_group')
+    assert authenticate(io_loop, authenticator, 'carol') is None
+    assert login_results('not_in_group') == denied + 1
+    user_searches = [search_filter for search_filter, _ in recorded if 'uid=carol' in search_filter]
+    assert len(user_searches) == 2
@@ -0,0 +1,262 @@
+"""
+Server selection by latency and circuit breaking of failing servers
+"""
+
+import time
+from types import SimpleNamespace
+import ldap3
+import pytest
+from prometheus_client import REGISTRY
+from conftest import MockLDAPAuthenticator
+from ldapauthenticator import LDAPAuthenticator
+from ldapauthenticator.metrics import LoginRecord, call_with_login, record_operation
+from ldapauthenticator.servers import ServerSelector
+
+HOSTS = ['ldap1.example.com', 'ldap2.example.com']
+
+
+class FakeConnectAuthenticator(MockLDAPAuthenticator):
+    """
+    Authenticator whose server connects take `delays` seconds per host
+    """
+
+    delays = dict()
+
+    def open_server_connection(self, server, username, password, probe=False):
+        time.sleep(self.delays.get(server.host, 0))
+        record_operation(server.host, 'connect', 0.0)
+        self.server_selector.record(server.host, 0.0, probe=probe)
+        return SimpleNamespace(server=server, unbind=lambda: None)
+
+
+def servers():
+    return [ldap3.Server(host) for host in HOSTS]
+
+
+def hosts(ordered):
+    return [server.host for server in ordered]
+
+
+def make_selector(**kwargs):
+    """
+    Return ServerSelector and the list holding the time of its clock
+    """
+    now = [0.0]
+    return ServerSelector(timer=lambda: now[0], **kwargs), now
+
+
+def test_servers_are_ordered_by_moving_average_latency():
+    selector, _ = make_selector(decay=0.5)
+    selector.record(HOSTS[0], 0.1)
+    # servers without measurements are tried first
+    assert hosts(selector.ordered(servers())) == [HOSTS[1], HOSTS[0]]
+    selector.record(HOSTS[1], 0.05)
+    assert hosts(selector.ordered(servers())) == [HOSTS[1], HOSTS[0]]
+    # one slow connect moves the average halfway, one slow search adds to it
+    selector.record(HOSTS[1], 0.1)
+    assert selector.stats(HOSTS[1]).connect_latency == pytest.approx(0.075)
+    selector.record(HOSTS[1], 0.1, operation=True)
+    assert hosts(selector.ordered(servers())) == [HOSTS[0], HOSTS[1]]
+
+
+def test_circuit_opens_after_consecutive_failures():
+    selector, _ = make_selector(failure_threshold=3, backoff=5)
+    selector.record(HOSTS[0], 0.01)
+    selector.record(HOSTS[1], 0.5)
+    for _ in range(2):
+        selector.record(HOSTS[0], 1.0, failed=True)
+    # a success resets the count of consecutive failures
+    selector.record(HOSTS[0], 0.01)
+    for _ in range(2):
+        selector.record(HOSTS[0], 1.0, failed=True)
+    assert selector.stats(HOSTS[0]).open_until is None
+    selector.record(HOSTS[0], 1.0, failed=True)
+    assert selector.stats(HOSTS[0]).open_until == 5
+    # the failing server is kept as a last resort
+    assert hosts(selector.ordered(servers())) == [HOSTS[1], HOSTS[0]]
+    assert selector.due_probes(servers()) == []
+
+
+def test_failed_probes_double_the_backoff():
+    selector, now = make_selector(failure_threshold=1, backoff=5, max_backoff=15)
+    selector.record(HOSTS[0], 1.0, failed=True)
+    for backoff in (10, 15, 15):
+        now[0] = selector.stats(HOSTS[0]).open_until
+        assert hosts(selector.due_probes(servers())) == [HOSTS[0]]
+        # only one probe is in flight at a time
+        assert selector.due_probes(servers()) == []
+        selector.record(HOSTS[0], 1.0, failed=True, probe=True)
+        assert selector.stats(HOSTS[0]).backoff == backoff
+        assert selector.stats(HOSTS[0]).open_until == now[0] + backoff
+
+
+def test_successful_probe_closes_the_circuit():
+    selector, now = make_selector(failure_threshold=1, backoff=5)
+    selector.record(HOSTS[0], 1.0, failed=True)
+    now[0] = 4
+    assert selector.due_probes(servers()) == []
+    now[0] = 5
+    assert hosts(selector.due_probes(servers())) == [HOSTS[0]]
+    selector.record(HOSTS[0], 0.01, probe=True)
+    stats = selector.stats(HOSTS[0])
+    assert (stats.open_until, stats.backoff, stats.failures) == (None, 0, 0)
+    assert hosts(selector.ordered(servers())) == [HOSTS[1], HOSTS[0]]
+    # the next failure opens the circuit with the initial backoff again
+    selector.record(HOSTS[0], 1.0, failed=True)
+    assert selector.stats(HOSTS[0]).open_until == 10
+
+
+def test_other_results_leave_the_probe_in_flight():
+    selector, now = make_selector(failure_threshold=1, backoff=5)
+    selector.record(HOSTS[0], 1.0, failed=True)
+    now[0] = 5
+    assert hosts(selector.due_probes(servers())) == [HOSTS[0]]
+    # a login falling back to the failing server neither ends the probe nor
+    # counts as a failed probe
+    selector.record(HOSTS[0], 1.0, failed=True)
+    assert selector.stats(HOSTS[0]).backoff == 5
+    assert selector.due_probes(servers()) == []
+    selector.record(HOSTS[0], 1.0, failed=True, probe=True)
+    assert selector.stats(HOSTS[0]).backoff == 10
+    assert not selector.stats(HOSTS[0]).probing
+
+
+def test_selector_is_rebuilt_when_its_settings_change():
+    authenticator = LDAPAuthenticator(server_hosts=HOSTS, server_pool_strategy='fastest')
+    try:
+        plan = authenticator.auth_plan
+        selector = authenticator.server_selector
+        authenticator.server_circuit_failures = 5
+        authenticator.server_circuit_max_backoff = 60
+        assert authenticator.server_selector is not selector
+        assert authenticator.server_selector.failure_threshold == 5
+        assert authenticator.server_selector.max_backoff == 60
+        # the auth plan and its connections are kept
+        assert authenticator.auth_plan is plan
+    finally:
+        authenticator.shutdown()
+
+
+class FakeEngineConnection:
+    """
+    Unopened async engine connection to a server that is down if its host
+    is in `down`
+    """
+
+    down = ()
+    opened = list()
+
+    def __init__(self, server, **kwargs):
+        self.server = server
+        self.last_error = None
+
+    def open(self, read_server_info=True):
+        FakeEngineConnection.opened.append(self.server.host)
+        if self.server.host in self.down:
+            raise ldap3.core.exceptions.LDAPSocketOpenError('unable to open socket')
+
+    def start_tls(self, read_server_info=True):
+        return True
+
+    def bind(self, read_server_info=True):
+        return True
+
+    def unbind(self):
+        pass
+
+
+def test_async_engine_connects_to_the_fastest_server(monkeypatch):
+    monkeypatch.setattr('ldapauthenticator.ldapauthenticator.engine_connection', FakeEngineConnection)
+    monkeypatch.setattr(FakeEngineConnection, 'down', (HOSTS[1],))
+    monkeypatch.setattr(FakeEngineConnection, 'opened', list())
+    authenticator = LDAPAuthenticator(
+        server_hosts=HOSTS, server_pool_strategy='fastest', ldap_engine='async', server_circuit_failures=1)
+    try:
+        selector = authenticator.server_selector
+        selector.record(HOSTS[0], 0.5)
+        selector.record(HOSTS[1], 0.1)
+        conn = authenticator.open_engine_connection('cn=svc', 'secret')
+        # the faster server is down, so its circuit opens and the next is used
+        assert conn.server.host == HOSTS[0]
+        assert FakeEngineConnection.opened == [HOSTS[1], HOSTS[0]]
+        assert selector.stats(HOSTS[1]).open_until is not None
+        assert hosts(selector.ordered(servers())) == [HOSTS[0], HOSTS[1]]
+    finally:
+        authenticator.shutdown()
+
+
+def test_hedged_connect_counts_towards_the_login():
+    authenticator = FakeConnectAuthenticator(server_hedge_delay=0.05)
+    authenticator.delays = {HOSTS[0]: 0.3}
+    login = LoginRecord('alice')
+    try:
+        conn = call_with_login(login, authenticator.open_fastest_connection, servers(), None, None)
+        assert conn.server.host == HOSTS[1]
+        assert login.operations >= 1
+    finally:
+        authenticator.shutdown()
+
+
+def test_background_connects_do_not_count_towards_the_login():
+    authenticator = FakeConnectAuthenticator(server_standby_connections=1)
+    login = LoginRecord('alice')
+    try:
+        # circuit probe and standby refill started while serving a login
+        call_with_login(login, lambda: authenticator.submit_connect(authenticator.probe_server, servers()[0]).result())
+        call_with_login(login, authenticator.standby_connections.fill, servers())
+        authenticator._hedge_executor.shutdown(wait=True)
+        assert authenticator.standby_connections.ready(servers()[0]) == 1
+        assert login.operations == 0
+    finally:
+        authenticator.shutdown()
+
+
+class RejectingConnection:
+    """
+    Connection whose bind is refused by the first server of its pool
+    """
+
+    def __init__(self, server_pool, **kwargs):
+        self.server = server_pool.servers[0]
+        self.last_error = 'invalidCredentials'
+
+    def open(self, read_server_info=True):
+        pass
+
+    def start_tls(self, read_server_info=True):
+        return True
+
+    def bind(self, read_server_info=True):
+        return False
+
+    def unbind(self):
+        pass
+
+
+def test_rejected_bind_is_not_a_server_error(monkeypatch):
+    monkeypatch.setattr(ldap3, 'Connection', RejectingConnection)
+    authenticator = LDAPAuthenticator()
+    labels = {'server': HOSTS[0], 'operation': 'bind'}
+    errors = REGISTRY.get_sample_value('ldapauthenticator_server_errors_total', labels) or 0.0
+    binds = REGISTRY.get_sample_value('ldapauthenticator_server_operation_duration_seconds_count', labels) or 0.0
+    try:
+        assert authenticator.ldap_connection(ldap3.ServerPool(servers()), 'alice', 'wrong') is None
+        assert (REGISTRY.get_sample_value('ldapauthenticator_server_errors_total', labels) or 0.0) == errors
+        # the bind is still recorded against the server tried
+        assert REGISTRY.get_sample_value(
+            'ldapauthenticator_server_operation_duration_seconds_count', labels) == binds + 1
+    finally:
+        authenticator.shutdown()
+
+
+def test_pool_strategy_is_compiled_into_the_plan():
+    authenticator = LDAPAuthenticator(server_hosts=HOSTS, server_pool_strategy='fastest')
+    try:
+        plan = authenticator.auth_plan
+        assert plan.server_pool_strategy == 'FASTEST'
+        assert plan.server_pool.strategy == ldap3.FIRST
+        authenticator.server_pool_strategy = 'round_robin'
+        assert authenticator.auth_plan is not plan
+        assert authenticator.auth_plan.server_pool_strategy == 'ROUND_ROBIN'
+    finally:
+        authenticator.shutdown()
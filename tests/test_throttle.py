@@ -0,0 +1,43 @@
+"""
+Login throttling per username and client ip
+"""
+
+from conftest import authenticate, login_results
+
+
+def test_ip_rejection_keeps_username_attempts(io_loop, make_authenticator):
+    authenticator = make_authenticator(
+        login_throttle_username_attempts=2, login_throttle_ip_attempts=1, login_throttle_window=3600)
+    assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.1')['name'] == 'alice'
+    throttled = login_results('throttled')
+    for _ in range(5):
+        assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.1') is None
+    assert login_results('throttled') == throttled + 5
+
+    # the rejected attempts did not use up alice's second attempt
+    assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.2')['name'] == 'alice'
+    assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.3') is None
+
+
+def test_throttle_is_off_by_default(io_loop, make_authenticator):
+    authenticator = make_authenticator()
+    throttled = login_results('throttled')
+    for _ in range(100):
+        assert authenticate(io_loop, authenticator, 'alice', 'wrong', client_ip='10.0.0.1') is None
+    assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.1')['name'] == 'alice'
+    assert login_results('throttled') == throttled
+
+
+def test_successful_logins_keep_ip_failures(io_loop, make_authenticator):
+    authenticator = make_authenticator(login_throttle_ip_failures=3, login_throttle_window=3600)
+    throttled = login_results('throttled')
+    for _ in range(3):
+        assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.1')['name'] == 'alice'
+        assert authenticate(io_loop, authenticator, 'bob', 'wrong', client_ip='10.0.0.1') is None
+    assert login_results('throttled') == throttled
+
+    # alice's logins did not refill the ip's failed logins
+    assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.1') is None
+    assert authenticate(io_loop, authenticator, 'bob', 'wrong', client_ip='10.0.0.1') is None
+    assert login_results('throttled') == throttled + 2
+    assert authenticate(io_loop, authenticator, 'alice', client_ip='10.0.0.2')['name'] == 'alice'
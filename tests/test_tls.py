@@ -0,0 +1,160 @@
+"""
+TLS session resumption of ldap connections, and standby connections opened
+ahead of logins with a fake clock
+"""
+
+import ssl
+from types import SimpleNamespace
+from ldapauthenticator.pool import StandbyConnections
+from ldapauthenticator.tls import ResumingTls
+
+
+class FakeSession(object):
+    """
+    TLS session, resumable once the server sent its ticket
+    """
+
+    def __init__(self, has_ticket=True):
+        self.has_ticket = has_ticket
+
+
+class FakeTlsSocket(ssl.SSLSocket):
+    """
+    Socket after a handshake that resumed session, or negotiated a new one
+    """
+
+    session = None
+    session_reused = False
+
+    def __init__(self, session=None, version='TLSv1.2'):
+        self.session_reused = session is not None
+        self.session = session or FakeSession()
+        self._version = version
+
+    def version(self):
+        return self._version
+
+
+class FakeContext(object):
+    """
+    SSLContext recording the sessions offered for resumption
+    """
+
+    def __init__(self):
+        self.offered = list()
+
+    def wrap_socket(self, sock, session=None, **kwargs):
+        self.offered.append(session)
+        return FakeTlsSocket(session)
+
+
+class FakeTlsConnection(object):
+    """
+    Connection to server whose socket is wrapped by the server's tls
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.socket = object()
+        self.closed = False
+
+    def unbind(self):
+        self.closed = True
+
+
+def resuming_tls():
+    tls = ResumingTls(validate=ssl.CERT_NONE)
+    tls._context = FakeContext()
+    return tls
+
+
+def open_connection(server):
+    conn = FakeTlsConnection(server)
+    server.tls.wrap_socket(conn, do_handshake=True)
+    return conn
+
+
+def make_standby(clock, **kwargs):
+    return StandbyConnections(open_connection, lambda func, *args: func(*args), timer=clock, **kwargs)
+
+
+def test_session_reuse_is_opt_in(make_authenticator):
+    servers = make_authenticator(server_hosts=['ldap1.example.com', 'ldap2.example.com']).auth_plan.server_pool.servers
+    assert [server.tls for server in servers] == [None, None]
+
+
+def test_session_reuse_uses_a_session_per_server(make_authenticator):
+    authenticator = make_authenticator(
+        server_hosts=['ldap1.example.com', 'ldap2.example.com'], server_tls_session_reuse=True)
+    first, second = (server.tls for server in authenticator.auth_plan.server_pool.servers)
+    assert isinstance(first, ResumingTls) and isinstance(second, ResumingTls)
+    assert first is not second
+
+
+def test_handshake_session_is_offered_to_later_connections():
+    server = SimpleNamespace(host='ldap1.example.com', port=636, tls=resuming_tls())
+    first, second = open_connection(server), open_connection(server)
+    assert not first.socket.session_reused and second.socket.session_reused
+    assert server.tls._context.offered == [None, first.socket.session]
+
+
+def test_tls13_session_is_saved_once_the_ticket_arrived():
+    tls = resuming_tls()
+    conn = SimpleNamespace(socket=FakeTlsSocket(version='TLSv1.3'))
+    conn.socket.session.has_ticket = False
+    tls.save_session(conn)
+    assert tls.session is None
+    conn.socket.session.has_ticket = True
+    tls.save_session(conn)
+    assert tls.session is conn.socket.session
+
+
+def test_plain_socket_leaves_the_session():
+    tls = resuming_tls()
+    tls.session = saved = FakeSession()
+    tls.save_session(SimpleNamespace(socket=object()))
+    assert tls.session is saved
+
+
+def test_standby_connections_resume_the_session(clock):
+    server = SimpleNamespace(host='ldap1.example.com', port=636, tls=resuming_tls())
+    standby = make_standby(clock, size=2)
+    standby.fill([server])
+    first = standby.take([server])
+    second = standby.take([server])
+    assert not first.socket.session_reused and second.socket.session_reused
+    # replacements opened in the background resume the session too
+    assert server.tls._context.offered[2:] == [first.socket.session] * 2
+
+
+def test_standby_connections_expire_at_max_age(clock):
+    server = SimpleNamespace(host='ldap1.example.com', port=636, tls=resuming_tls())
+    standby = make_standby(clock, size=1, max_age=60)
+    standby.fill([server])
+    clock.advance(59)
+    kept = standby.take([server])
+    assert kept is not None and not kept.closed
+
+    clock.advance(60)
+    expired = server.tls._context.offered[:]
+    assert standby.take([server]) is None
+    # the expired connection was closed and replaced, resuming the session
+    assert standby.ready(server) == 1
+    assert server.tls._context.offered == expired + [kept.socket.session]
+
+
+def test_recycle_replaces_only_expired_connections(clock):
+    first = SimpleNamespace(host='ldap1.example.com', port=636, tls=resuming_tls())
+    second = SimpleNamespace(host='ldap2.example.com', port=636, tls=resuming_tls())
+    standby = make_standby(clock, size=1, max_age=60)
+    standby.fill([first])
+    clock.advance(30)
+    standby.fill([second])
+
+    clock.advance(30)
+    standby.recycle([first, second])
+    assert standby.ready(first) == 1 and standby.ready(second) == 1
+    assert len(first.tls._context.offered) == 2 and len(second.tls._context.offered) == 1
+    # the connection to the second server is still handed out
+    conn = standby.take([second])
+    assert conn.server is second and not conn.closed
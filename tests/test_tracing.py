@@ -0,0 +1,58 @@
+"""
+Traces of slow logins kept for admins
+"""
+
+import random
+import pytest
+from conftest import authenticate
+from ldapauthenticator.tracing import Trace, TraceBuffer
+
+
+def test_search_events_record_filter_template(io_loop, make_authenticator):
+    authenticator = make_authenticator(login_trace_sample_rate=1, login_trace_threshold=0)
+    authenticate(io_loop, authenticator, 'alice')
+    trace, = authenticator.login_traces.traces()
+    assert trace.as_dict()['username'] == 'alice'
+    searches = [event for event in trace.as_dict()['events'] if event['event'] == 'search']
+    assert searches
+    assert '(&(objectClass=person)(uid={username}))' in [event['filter'] for event in searches]
+    assert not any('alice' in event['filter'] for event in searches)
+
+
+def test_logins_are_not_traced_by_default(io_loop, make_authenticator):
+    authenticator = make_authenticator(login_trace_threshold=0)
+    assert authenticator.start_trace('login', 'alice') is None
+    authenticate(io_loop, authenticator, 'alice')
+    assert authenticator.login_traces.traces() == []
+
+
+@pytest.mark.parametrize('rate, draws, traced', [
+    (0.5, [0.2, 0.7, 0.49, 0.5], [True, False, True, False]),
+    (0.1, [0.05, 0.1], [True, False]),
+    (1, [0.99], [True]),
+])
+def test_logins_are_sampled_at_the_rate(make_authenticator, monkeypatch, rate, draws, traced):
+    authenticator = make_authenticator(login_trace_sample_rate=rate)
+    draws = iter(draws)
+    monkeypatch.setattr(random, 'random', lambda: next(draws))
+    assert [authenticator.start_trace('login', 'alice') is not None for _ in traced] == traced
+
+
+def test_fast_logins_are_not_kept(io_loop, make_authenticator):
+    authenticator = make_authenticator(login_trace_sample_rate=1, login_trace_threshold=60)
+    authenticate(io_loop, authenticator, 'alice')
+    assert authenticator.login_traces.traces() == []
+
+
+def test_oldest_traces_are_dropped(io_loop, make_authenticator):
+    authenticator = make_authenticator(
+        login_trace_sample_rate=1, login_trace_threshold=0, login_trace_buffer_size=2)
+    for username in ('alice', 'bob', 'dave'):
+        authenticate(io_loop, authenticator, username)
+    assert [trace.username for trace in authenticator.login_traces.traces()] == ['dave', 'bob']
+
+
+def test_empty_buffer_keeps_nothing():
+    buffer = TraceBuffer(size=0)
+    buffer.add(Trace('login', 'alice'))
+    assert len(buffer) == 0 and buffer.traces() == []